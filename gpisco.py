@@ -1,4 +1,5 @@
 import pisco
+import multiprocessing
 from functools import partial
 from gooey import Gooey, GooeyParser
 
@@ -21,25 +22,50 @@ def gooey_arguments():
     first_arg_group = parser.add_argument_group(title="Commands / Devices")
     arg_device = first_arg_group.add_mutually_exclusive_group(required=True)
     arg_device.add_argument("-d", "--device", help="IP address(es) of the device(s) to connect to (separated by commas)")
-    arg_device.add_argument("-D", "--device-list", help="text file containing a list of IP addresses (one address per line)", widget="FileChooser")
+    arg_device.add_argument("-D", "--device-list", help="text file containing a list of IP addresses (one address per line), or CSV inventory", widget="FileChooser")
+    first_arg_group.add_argument("--tags", help="only the devices of the CSV inventory with one of these tags (separated by commas)")
     arg_commands = first_arg_group.add_mutually_exclusive_group(required=True)
     arg_commands.add_argument("-c", "--commands", help="command(s) to execute on the device (separated by commas)", nargs="*")
     arg_commands.add_argument("-C", "--command-list", help="text file containing a list of commands to execute", widget="FileChooser")
     arg_commands.add_argument("--autodeploy", help="load list of commands from file <ipaddress>_autodeploy.txt for each device", action="store_true")
+    arg_commands.add_argument("--collect", help="collect the facts and the status of the interfaces of each device to this CSV or JSON Lines (.jsonl) file instead of running commands", widget="FileSaver")
+    arg_commands.add_argument("--diff", help="show the differences between two versions in the backup store instead of running commands (default=the last two)", nargs="*", metavar="VERSION")
 
     second_arg_group = parser.add_argument_group(title="Credentials")
     second_arg_group.add_argument("-u", "--username",required=True)
     second_arg_group.add_argument("-p", "--password", widget="PasswordField",required=True)
     second_arg_group.add_argument("-e", "--enable-password", widget="PasswordField")
+    second_arg_group.add_argument("--credential-sets", help="JSON file of named credential sets for the credentials column of the CSV inventory", widget="FileChooser")
+    second_arg_group.add_argument("--credential-cache", help="file remembering which credentials worked for each device", widget="FileSaver")
+    second_arg_group.add_argument("--credential-cache-ttl", help="days after which an entry of the credential cache expires", type=float, default=7)
 
     third_arg_group = parser.add_argument_group(title="Save output")
     third_arg_group.add_argument("-s", "--save", help="save the output to text file(s)", action="store_true")
     third_arg_group.add_argument("-O", "--output-directory", help="specify a directory where to save the output to", widget="FileChooser")
     third_arg_group.add_argument("-S", "--separate-output", help="save the output of each device to a separate file", action="store_true")
+    third_arg_group.add_argument("-z", "--compress", help="gzip the output file(s)", action="store_true")
+    third_arg_group.add_argument("--backup-store", help="also save the output of the show commands to this directory, once per distinct output", widget="DirChooser")
+    third_arg_group.add_argument("--journal", help="record each device and command as soon as they are done to this file", widget="FileSaver")
+    third_arg_group.add_argument("--resume", help="skip the devices done according to the journal of the previous run", action="store_true")
+    third_arg_group.add_argument("--metrics", help="save the timings of each device and command to this JSON Lines file", widget="FileSaver")
+    third_arg_group.add_argument("--prometheus", help="save the summary of the run to this Prometheus textfile (.prom)", widget="FileSaver")
 
     fourth_arg_group = parser.add_argument_group(title="Options")
+    fourth_arg_group.add_argument("--port", help="Telnet port", default="23")
     fourth_arg_group.add_argument("-n", "--no-enable", help="do not go into enable mode after login", action="store_true", default=True)
-    fourth_arg_group.add_argument("-b", "--batch", help="send all commands at once (EXPERIMENTAL)", action="store_true")
+    fourth_arg_group.add_argument("-w", "--workers", help="number of devices to process concurrently", type=int, default=1)
+    fourth_arg_group.add_argument("--processes", help="number of worker processes, each running --workers sessions", type=int, default=1)
+    fourth_arg_group.add_argument("--group-limit", help="maximum number of concurrent sessions in each group of devices", type=int)
+    fourth_arg_group.add_argument("--group-by", help="groups of the group limit: /24 subnet, or tags of the CSV inventory", choices=["subnet", "tag"], default="subnet")
+    fourth_arg_group.add_argument("--login-rate", help="maximum number of new logins per second", type=float)
+    fourth_arg_group.add_argument("--retries", help="number of times the connection to a device is retried after a network error", type=int, default=0)
+    fourth_arg_group.add_argument("--durations", help="file of the time taken by each device in the previous runs, to start the longest ones first", widget="FileSaver")
+    fourth_arg_group.add_argument("--asyncio", help="run the sessions on an asyncio event loop instead of threads", action="store_true")
+    fourth_arg_group.add_argument("-b", "--batch", help="pipeline the commands instead of waiting for the output of each command", action="store_true")
+    fourth_arg_group.add_argument("--window", help="maximum number of commands sent ahead in batch mode", type=int, default=10)
+    fourth_arg_group.add_argument("--sweep", help="check which devices are reachable before connecting to them", action="store_true")
+    fourth_arg_group.add_argument("--sweep-timeout", help="seconds after which a device is unreachable for --sweep", type=float, default=2)
+    fourth_arg_group.add_argument("--read-timeout", help="seconds of silence of a device after which the output of a command is considered complete", type=float, default=7)
     fourth_arg_group.add_argument("-T", "--table", help="format output as a table with IP address in first position", action="store_true")
     fourth_arg_group.add_argument("--debug", help="enable Telnet debugging", action="store_true")
     fourth_arg_group.add_argument("-h", "--help", help="display this message and exit", action="help")
@@ -50,5 +76,9 @@ def gooey_arguments():
 # STDOUT is buffered by default, this is needed to output the print statements in real time
 print = partial(print, flush=True)
 
-pisco.parse_arguments = gooey_arguments
-pisco.main()
+if __name__ == "__main__":
+    # The worker processes of --processes start by importing this module again (spawn on Windows, PyInstaller
+    # executable): they must not open the GUI
+    multiprocessing.freeze_support()
+    pisco.parse_arguments = gooey_arguments
+    pisco.main()
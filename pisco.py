@@ -8,406 +8,3591 @@ Usage: use --help for help
 
 -   Passwords will be prompted at runtime if needed.
 -   We can provide multiple commands and/or IP addresses in the arguments, separated by commas.
--   Import pisco.py to use the TelnetDevice class and it's methods
+-   Import pisco.py to use the TelnetDevice class and it's methods, AsyncTelnetDevice for asyncio, or DevicePool to reuse sessions, and ResultCache to reuse the outputs of show commands
 
 '''
 
 import os
+import io
 import sys
+import csv
+import gzip
+import json
+import time
+import random
+import difflib
+import hashlib
+import shutil
+import socket
+import sqlite3
+import tempfile
+import ipaddress
 import argparse
 import re
-import time
-import telnetlib
 import getpass
+import asyncio
+import warnings
+import threading
+import multiprocessing
+from itertools import chain
+from collections import namedtuple, deque, Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import telnetlib
+except ImportError:
+    # telnetlib was removed from the Standard Library in Python 3.13: only AsyncTelnetDevice can be used
+    telnetlib = None
+
 # Used to split username/password lists
 DELIMITER = ","
 
-class TelnetDevice(telnetlib.Telnet):
+
+class LoginError(ConnectionError):
+    '''
+    The device refused the credentials: unlike the other connection errors, retrying would only lock the account
     '''
-    Define a TelnetDevice class that inherits from telnetlib.Telnet
 
-    We add a few methods that simplify interacting with a Cisco IOS device:
-    -   send_command
-    -   read_output 
-    -   enable
-    -   get_facts
-    -   get_int_list
-    -   get_int_status (with or without full description and PoE status)
 
-    Those methods handle encoding/decoding of strings/bytes.
+class CredentialCache(object):
     '''
+    Credentials shared between all the device sessions of a run.
 
-    def __init__(self, host, port=23, username=None, password=None, enable_password=None, quiet=False, debug=False):
-        '''
-        Instantiating the TelnetDevice class will automatically connect and log into the device
-        '''
-        self.host = host
-        self.port = port
-        self.hostname = ""
+    Values missing from the command line are prompted only once (the first session that needs them
+    holds the lock while the user types) and are then reused for every other device, until they turn out to be
+    wrong (see forget()).
+
+    Without interactive (in the worker processes of --processes, which have no terminal), a missing value fails the
+    session with a LoginError instead.
+    '''
+
+    def __init__(self, username=None, password=None, enable_password=None, interactive=True):
         self.username = username
         self.password = password
         self.enable_password = enable_password
-        self.enable_mode = False
-        self.infos = {}
-        self.int_status = {}
-        self.when = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
-        self.debug = debug
+        self.interactive = interactive
+        self.lock = threading.Lock()
 
-        if not quiet:
-            print("[+] Connecting to {}... ".format(host))
 
-        telnetlib.Telnet.__init__(self, host, port=self.port, timeout=4)
-        response = self.read_output(password_prompt=True).splitlines()[-1]
+    def get(self, name, prompt):
+        '''
+        Return the cached value for name ("username", "password" or "enable_password"), calling prompt() to ask for it if it is not known yet
+        '''
 
-        if self.debug:
-            self.set_debuglevel(5)
+        with self.lock:
+            value = getattr(self, name)
+            if not value:
+                if not self.interactive:
+                    raise LoginError("no {} given, and the worker processes of --processes can't ask for it".format(name.replace("_", " ")))
+                value = prompt()
+                setattr(self, name, value)
+            return value
 
-        retries = 0
-        login_successful = False            
 
-        while not login_successful:
-            if "User" in response or "ame" in response:
-                if not self.username:
-                    self.username = input("Username: ")
-                self.send_command(self.username.split(DELIMITER)[retries])
-                response = self.read_output(password_prompt=True)
-            
-            if "Pass" in response:
-                if not self.password:
-                    self.password = getpass.getpass()
-                if len(self.username.split(DELIMITER)) != len(self.password.split(DELIMITER)):
-                    print("[!] Username and password lists must be the same length (use comma as delimiter)")
-                    raise ConnectionError
-                self.send_command(self.password.split(DELIMITER)[retries])
-                response = self.read_output(password_prompt=True)
+    def forget(self, name, value):
+        '''
+        Forget a value that turned out to be wrong, unless another session already replaced it
+        '''
 
-            if response.endswith(">"):
-                login_successful = True
-                self.hostname = response.splitlines()[-1].rstrip(">")
-            elif response.endswith("#"):
-                login_successful = True
-                self.enable_mode = True
-                self.hostname = response.splitlines()[-1].rstrip("#")
-            else:
-                if (len(self.username.split(DELIMITER)) - retries) > 1:
-                    print("[!] Wrong login/password, trying next one in list")
-                    retries += 1
-                else:
-                    print("[!] Wrong login/password")
-                    raise ConnectionError
+        with self.lock:
+            if getattr(self, name) == value:
+                setattr(self, name, None)
 
-        if not quiet:
-            print("[+] Login successful")
 
+class CredentialIndexCache(object):
+    '''
+    On-disk cache of the position, in the username/password and enable password lists, of the credentials that
+    worked last time for each device, so they are tried first next time.
 
-    def send_command(self, command):
+    Only the indexes are stored, never the secrets. Entries expire after ttl seconds, and are ignored if the length
+    of the list changed. A device (address and port, see device_key()) that is not in the cache yet gets the index
+    that worked last in its subnet (devices of a site usually share the same AAA servers). Call save() to write the
+    cache to disk.
+    '''
+
+    def __init__(self, filename, ttl=7 * 24 * 3600, prefix_length=24):
+        self.filename = filename
+        self.ttl = ttl
+        self.prefix_length = prefix_length
+        self.lock = threading.Lock()
+        self.changed = False
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f).get("entries", {})
+
+
+    def keys(self, host, port):
+        '''
+        Return the keys of the entries applying to host and port, most specific first
         '''
-        Send command to device.
 
-        Note: We use Latin_1 encoding because ascii can yield invalid characters with some devices like Cisco WISM.
+        keys = ["host:{}".format(device_key(host, port))]
+        try:
+            subnet = ipaddress.ip_network("{}/{}".format(host, self.prefix_length), strict=False)
+            keys.append("subnet:{}".format(subnet))
+        except ValueError:
+            # Hostname instead of an IP address
+            pass
+
+        return keys
+
+
+    def get(self, host, port, kind, count):
+        '''
+        Return the index that worked last time for host and port, for kind ("login" or "enable") with a list of count credentials, or None
         '''
 
-        self.write(command.encode("Latin_1") + b"\n")
+        now = time.time()
+        with self.lock:
+            for key in self.keys(host, port):
+                entry = self.entries.get(key, {}).get(kind)
+                if entry and entry["count"] == count and now - entry["time"] < self.ttl and entry["index"] < count:
+                    return entry["index"]
 
 
-    def read_output(self,password_prompt=False):
+    def set(self, host, port, kind, index, count):
         '''
-        Read output until one of the possible prompts.
-        
-        Use password_prompt when a ":" prompt is possible.
+        Remember that the credentials at index worked for host and port
         '''
-        
-        if password_prompt:
-            expected = [b"\>", b"\#", b"sername\:", b"assword\:"]
-        else:
-            expected = [b"\>", b"\#"]
 
-        response = self.expect(expected, timeout=7)
-        response = response[2].decode("Latin_1")
-        
-        return response      
+        entry = {"index": index, "count": count, "time": time.time()}
+        with self.lock:
+            for key in self.keys(host, port):
+                self.entries.setdefault(key, {})[kind] = entry
+            self.changed = True
 
 
-    def enable(self):
+    def merge(self, entries):
         '''
-        Enter enable mode. Multiple passwords can be provided.
+        Add the entries learned by another process (a worker of --processes), keeping the most recent ones
         '''
 
-        if self.enable_mode:
-            return
-        
-        retries = 0
-        self.send_command("enable")
-        
-        while self.enable_mode == False:
-            response = self.read_output(password_prompt=True)
-            # We ask for password only twice in interactive mode, but we'll try all the passwords in the list
-            # This is to avoid getting stuck at the enable password prompt
-            # If the password is incorrect we'd rather fail and move to the next device
-            if "Password:" in response:
-                if not self.enable_password:
-                    self.enable_password = getpass.getpass(prompt="Enable password: ")
-                    retries = 0
-                if (len(self.enable_password.split(DELIMITER)) - retries >= 1):
-                    self.send_command(self.enable_password.split(DELIMITER)[retries])     
-                else:
-                    self.send_command("")
-                    self.enable_password = None
-                retries += 1
-            elif "#" in response:
-                    self.enable_mode = True
-            else:
-                if (len(self.enable_password.split(DELIMITER)) - retries >= 1):
-                    self.send_command("enable")
-                else:
-                    print("[!] Wrong password, can't go into enable mode")
-                    break
-        
+        with self.lock:
+            for key, kinds in entries.items():
+                for kind, entry in kinds.items():
+                    current = self.entries.setdefault(key, {}).get(kind)
+                    if current is None or current["time"] < entry["time"]:
+                        self.entries[key][kind] = entry
+                        self.changed = True
 
-    def get_facts(self):
+
+    def save(self):
         '''
-        Get hostname, IOS info and uptime and put them in a dictionnary
+        Write the cache to disk (atomically, so concurrent runs never read a partial file), dropping the expired entries
         '''
 
-        self.send_command("show version | include Model .umber|uptime")
-        response = self.read_output().splitlines()
-        response_split = [ line.split() for line in response ]
-        response_split.pop(0)
-        hostname = response_split[0][0]
-        uptime = " ".join(response_split[0][3:])
-        model = response_split[1][-1]
+        now = time.time()
+        with self.lock:
+            if not self.changed:
+                return
+            entries = {}
+            for key, kinds in self.entries.items():
+                kinds = dict((kind, entry) for kind, entry in kinds.items() if now - entry["time"] < self.ttl)
+                if kinds:
+                    entries[key] = kinds
+            self.entries = entries
+            directory = os.path.dirname(os.path.abspath(self.filename))
+            with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+                json.dump({"entries": entries}, f)
+            os.replace(f.name, self.filename)
+            self.changed = False
+
+
+class ResultCache(object):
+    '''
+    Cache of the outputs of the show commands of the devices, keyed by (host, port, command with normalized spaces),
+    shared by the sessions which get it with result_cache=. An output is reused for ttls[command] seconds (ttl by default),
+    at most max_size outputs are kept in memory (the least recently used are dropped first).
 
-        self.facts = { 
-                        "ip_address":self.host, \
-                        "hostname":hostname, \
-                        "model":model, \
-                        "uptime":uptime, \
-                        "when":self.when }
+    With filename, the outputs are also kept in a SQLite database, shared by the scripts using the same file.
 
-        return self.facts
+    Any command other than a show command (configure terminal, write, clear...) drops the outputs of the device.
+    '''
 
+    def __init__(self, ttl=60, ttls=None, max_size=1024, filename=None):
+        self.ttl = ttl
+        self.ttls = dict((" ".join(command.split()), seconds) for command, seconds in (ttls or {}).items())
+        self.max_size = max_size
+        # (host, port, command) -> (expiry time, output), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.database = None
+        if filename:
+            self.database = sqlite3.connect(filename, timeout=10, check_same_thread=False, isolation_level=None)
+            self.database.execute("CREATE TABLE IF NOT EXISTS results (host TEXT, port INTEGER, command TEXT, expires REAL, output TEXT, "
+                                  "PRIMARY KEY (host, port, command))")
 
-    def get_int_list(self):
+
+    def cacheable(self, command):
+        return SHOW_COMMAND_PATTERN.match(command) is not None
+
+
+    def get(self, host, port, command):
         '''
-        Get a simple list of all physical interfaces
+        Return the output of command on host and port if it is in the cache and not expired, else None
         '''
-        self.send_command("show int status")
-        list_interfaces = [line.split()[0] for line in self.read_output().splitlines()[3:-1] if not line.startswith("----") and line.strip()]
-        
-        return list_interfaces
 
+        if not self.cacheable(command):
+            return None
 
-    def get_int_status(self, get_full_description=False, get_power=False):
+        key = (host, int(port), " ".join(command.split()))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.database:
+                entry = self.database.execute("SELECT expires, output FROM results WHERE host = ? AND port = ? AND command = ?", key).fetchone()
+                if entry and entry[0] >= now:
+                    self.store(key, tuple(entry))
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+    def set(self, host, port, command, output):
         '''
-        Get interfaces' status and description and store result in a dictionnary "self.int_status"
+        Add the output of a show command, or drop the outputs of host and port after any other command
         '''
-        self.send_command("show int status")
-        list_int_status = [line for line in self.read_output().splitlines()[3:-1] if not line.startswith("----") and line.strip()]
-
-        for line in list_int_status:
-            interface = line[0:8].strip()
-            description = line[10:29].strip()
-            status = line[29:39].strip()
-            vlan = line[42:47].strip()
-            speed = line[60:66].strip().replace("a-", "").replace("auto", "-")
-            
-            self.int_status[interface] = { "description": description, \
-                                      "status": status, \
-                                      "vlan": vlan, \
-                                      "speed": speed, \
-                                      "power": "-"}
 
-        if get_full_description:
-            self.send_command("show int desc")
-            list_int_description = [line for line in self.read_output().splitlines()[3:-1] if line.strip()]
-            for line in list_int_description:
-                interface = line[0:8].strip()
-                if interface in self.int_status:
-                    description = line[55:].strip()
-                    self.int_status[interface]["description"] = description
+        if not self.cacheable(command):
+            self.invalidate(host, port, command)
+            return
 
-        if get_power:
-            self.send_command("show power inline | i /")
-            response = self.read_output().splitlines()
-            if len(response) > 5:
-                response = response[1:-1]
-                for line in response:
-                    interface = line[0:10].strip()
-                    power = line[26:32].strip().replace(".0", "") + "W"
-                    self.int_status[interface].update({"power": power})
+        key = (host, int(port), " ".join(command.split()))
+        entry = (time.time() + self.ttls.get(key[2], self.ttl), output)
+        with self.lock:
+            self.store(key, entry)
+            if self.database:
+                self.database.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", key + entry)
 
-        return self.int_status
 
+    def invalidate(self, host, port, command=None):
+        '''
+        Drop the outputs of host and port, unless command is known to change nothing
+        '''
 
-def parse_arguments():
-    '''
-    Parse command line arguments.
+        if command is not None and (self.cacheable(command) or NEUTRAL_COMMAND_PATTERN.match(command)):
+            return
+
+        port = int(port)
+        with self.lock:
+            for key in [key for key in self.entries if key[:2] == (host, port)]:
+                del self.entries[key]
+            if self.database:
+                self.database.execute("DELETE FROM results WHERE (host = ? AND port = ?) OR expires < ?", (host, port, time.time()))
 
-    Main options:
-        -c / -C:    specify the commands to send via the command line, with a text file, or by loading an <ipaddress>_autodeploy.txt file automatically
-        -d / -D:    specify IP addresses at the command line, or point to a file containing a list of IP addresses
-        -u / -p:    specify credentials at the command line - this is NOT SECURE! (for example in your shell history)
-                    multiple credentials can be specified as a comma separated list
-        -n:         by default the program will go into enable mode at login. We can disable this with --no-enable 
-        -s:         we can use --save to save the output to a text file instead of stdout
-        -S:         to save the output of each host to a different file
-        -O:         use -O filename to save to this filename. Do not forget to use "-s" too
-                    use keywords '{date_time}', '{ip_address}' or '{username}' to insert values in the directoy's name
-        -b:         use 'batch' mode to send all commands at once instead of reading the output of each command - useful for banner commands for example
-        -T:         print output as a one liner per device - ok for short outputs, can be very ugly if the output of the command is more than one line
-        --debug:    enable Telnetlib debugging
 
+    def close(self):
+        if self.database:
+            self.database.close()
+            self.database = None
+
+
+def credential_order(credential_index, host, port, kind, secrets):
+    '''
+    Return the order in which to try the credentials of the secrets list: the index that worked last time first (see CredentialIndexCache), then the others
     '''
 
-    parser = argparse.ArgumentParser(description="Run commands on Cisco devices via Telnet", add_help=False)
+    count = len(secrets.split(DELIMITER))
+    order = list(range(count))
+    first = credential_index.get(host, port, kind, count) if credential_index else None
+    if first:
+        order.remove(first)
+        order.insert(0, first)
 
-    first_arg_group = parser.add_argument_group(title="Devices/Commands")
-    arg_device = first_arg_group.add_mutually_exclusive_group(required=True)
-    arg_device.add_argument("-d", "--device", help="IP address(es) of the device(s) to connect to (separated by commas)")
-    arg_device.add_argument("-D", "--device-list", help="text file containing a list of IP addresses")
-    arg_commands = first_arg_group.add_mutually_exclusive_group(required=True)
-    arg_commands.add_argument("-c", "--commands", help="command(s) to execute on the device (separated by commas)", nargs="*")
-    arg_commands.add_argument("-C", "--command-list", help="text file containing a list of commands to execute")
-    arg_commands.add_argument("--autodeploy", help="load commands from file <ipaddress>_autodeploy.txt for each device", action="store_true")
+    return order
 
-    second_arg_group = parser.add_argument_group(title="Credentials")
-    second_arg_group.add_argument("-u", "--username")
-    second_arg_group.add_argument("-p", "--password")
-    second_arg_group.add_argument("-e", "--enable-password")
 
-    third_arg_group = parser.add_argument_group(title="Save output")
-    third_arg_group.add_argument("-s", "--save", help="save the output to text file(s)", action="store_true")
-    third_arg_group.add_argument("-O", "--output-directory", help="specify a directory where to save the output to")
-    third_arg_group.add_argument("-S", "--separate-output", help="save the output of each device to a separate file", action="store_true")
+# Telnet commands used for option negotiation (RFC 854)
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+IAC_BYTE = bytes([IAC])
 
-    fourth_arg_group = parser.add_argument_group(title="Options")
-    fourth_arg_group.add_argument("--port", help="Telnet port (default=23)", default="23")
-    fourth_arg_group.add_argument("-n", "--no-enable", help="do not go into enable mode", action="store_true")
-    fourth_arg_group.add_argument("-b", "--batch", help="send all commands at once (EXPERIMENTAL)", action="store_true")
-    fourth_arg_group.add_argument("-T", "--table", help="format output as a table with IP address in first column", action="store_true")
-    fourth_arg_group.add_argument("--debug", help="enable Telnet debugging", action="store_true")
-    fourth_arg_group.add_argument("-h", "--help", help="display this message and exit", action="help")
+FACTS_COMMAND = "show version | include Model .umber|uptime"
 
-    return parser.parse_args()
+# Columns of the rows of get_interface_rows(), written by DatasetWriter
+INTERFACE_COLUMNS = ("ip_address", "hostname", "model", "uptime", "when", "interface", "description", "status", "vlan", "duplex", "speed", "type", "power")
 
+# Only this many bytes at the end of the received data are kept to look for the prompt, the rest is searched only once
+PROMPT_WINDOW = 512
 
-def main():
+# Pager prompt, answered with a space when "terminal length 0" is not in effect, and the sequence erasing it afterwards
+PAGER_PATTERN = re.compile(rb" ?--More-- ?\Z")
+PAGER_ERASE_PATTERN = re.compile(rb"\A\x08+ *\x08*")
+
+# Output of a device kept in memory before spilling to a temporary file, when it can't be written to its file straight away
+SPOOL_SIZE = 1024 * 1024
+
+# Same, for an output done but waiting for the output of an earlier device, see hold_result()
+HELD_SPOOL_SIZE = 64 * 1024
+
+# Commands whose output is saved by BackupStore
+SHOW_COMMAND_PATTERN = re.compile(r"\s*sh(?:ow?)?\s")
+
+# Commands which change nothing on the device, besides the show commands: they don't invalidate the ResultCache
+NEUTRAL_COMMAND_PATTERN = re.compile(r"\s*(?:ter\w*\s|ena?\w*\s*$)")
+
+# Banner command of the configuration: its delimiter, then the text on the same line. Until the line with the
+# delimiter, the lines of the banner get no prompt
+BANNER_PATTERN = re.compile(r"\s*banner\s+(?:motd|login|exec|incoming|prompt-timeout|slip-ppp|config-save)\s+(\S)(.*)")
+
+# Output of a command refused by the device: the echo of the command, the marker of the error, then "% Invalid input..."
+ERROR_OUTPUT_PATTERN = re.compile(r"[^\n]*\n(?:[ \t\r]*\^?[ \t\r]*\n)*% ")
+
+# Lines of the outputs which change without any change of the configuration, ignored by BackupStore
+VOLATILE_PATTERN = re.compile(r"(?:! Last configuration change at |! NVRAM config last updated at |! No configuration change since last restart"
+                              r"|!Time: |!Running configuration last done at: |Building configuration\.\.\.|Current configuration : \d+ bytes"
+                              r"|ntp clock-period \d+|\S+ uptime is )")
+
+
+def telnet_filter(data):
     '''
-    Pisco.py Main program
+    Split raw bytes received from a device into (data, replies to send, incomplete Telnet command to keep for the next chunk).
 
+    Options requested by the device are refused (DONT/WONT) like telnetlib does, sub-negotiations are ignored.
+    Data between Telnet commands is copied in slices rather than byte by byte, so large outputs are cheap to process.
     '''
-    args = parse_arguments()
+
+    cooked = bytearray()
+    replies = bytearray()
+    i = 0
+
+    while i < len(data):
+        j = data.find(IAC_BYTE, i)
+        if j == -1:
+            cooked += data[i:]
+            i = len(data)
+            break
+        cooked += data[i:j]
+        i = j
+        if i + 1 >= len(data):
+            break
+        command = data[i + 1]
+        if command == IAC:
+            cooked.append(IAC)
+            i += 2
+        elif command in (DO, DONT, WILL, WONT):
+            if i + 2 >= len(data):
+                break
+            option = data[i + 2]
+            if command == DO:
+                replies += bytes([IAC, WONT, option])
+            elif command == WILL:
+                replies += bytes([IAC, DONT, option])
+            i += 3
+        elif command == SB:
+            end = data.find(bytes([IAC, SE]), i + 2)
+            if end == -1:
+                break
+            i = end + 2
+        else:
+            # NOP, GA, etc.
+            i += 2
+
+    # telnetlib drops NUL and XON characters too
+    return bytes(cooked).replace(b"\x00", b"").replace(b"\x11", b""), bytes(replies), data[i:]
+
+
+def prompt_patterns(password_prompt=False, hostname=None):
+    '''
+    List of regexes matching the possible prompts of a device.
     
-    # Get list of unique IP addresses from text file or arguments
-    if args.device_list:
-        with open(args.device_list) as f:
-            content = f.readlines()
-            list_ip_addresses = []
-            for line in content:
-                if not line.startswith("!") and not line.startswith("#") and line.strip():
-                    for ip_address in re.findall(r"(?:\d{1,3}\.){3}\d{1,3}", line):
-                        if ip_address not in list_ip_addresses and not ip_address.startswith("255."):
-                            list_ip_addresses.append(ip_address)
+    Use password_prompt when a ":" prompt is possible.
+
+    Before login we don't know the hostname, so any ">" or "#" at the very end of the received data is a prompt.
+    Once the hostname is known, only "<hostname>>", "<hostname>#" or "<hostname>(config...)#" at the start of a line
+    are prompts, so "#" and ">" characters inside the output of a command (descriptions, banners...) are ignored.
+    '''
+
+    if hostname:
+        expected = [rb"(?:^|[\r\n])" + re.escape(hostname.encode("Latin_1")) + rb"(?:\([^\r\n)]*\))?[>#]"]
     else:
-        list_ip_addresses = args.device.split(",")
+        expected = [rb"[>#]\Z"]
 
-    # Get command(s) to execute from text file or arguments
-    if args.command_list:
-        with open(args.command_list, "r") as f:
-            commands = [ line.rstrip() for line in f.readlines() if line.strip() ]
-    elif args.autodeploy:
-        # We will load the commands further up
-        pass
+    if password_prompt:
+        expected += [rb"sername: ?\Z", rb"assword: ?\Z"]
+
+    return expected
+
+
+def find_hostname(response):
+    '''
+    Return the hostname from the prompt at the end of response, or None if response does not end with a prompt
+    '''
+
+    prompt = re.search(r"(?:^|[\r\n])([^\r\n>#(]+)(?:\([^\r\n)]*\))?[>#]\Z", response)
+    if prompt:
+        return prompt.group(1)
+
+
+def parse_facts(response, ip_address, when):
+    '''
+    Parse the output of FACTS_COMMAND into a dictionnary
+    '''
+
+    response_split = [ line.split() for line in response.splitlines() ]
+    response_split.pop(0)
+    hostname = response_split[0][0]
+    uptime = " ".join(response_split[0][3:])
+    model = response_split[1][-1]
+
+    return { 
+                "ip_address":ip_address, \
+                "hostname":hostname, \
+                "model":model, \
+                "uptime":uptime, \
+                "when":when }
+
+
+def table_columns(header, ruler=None):
+    '''
+    Return the (name, start, end) of the columns of a table, from the words of its header line, or from the runs of
+    dashes of the ruler line under it when there is one (its name is then made of the header words above each run)
+    '''
+
+    words = [(match.group(), match.start(), match.end()) for match in re.finditer(r"\S+", header)]
+    if not ruler:
+        return words
+
+    columns = []
+    for match in re.finditer(r"-+", ruler):
+        name = " ".join(word for word, start, end in words if start < match.end() and end > match.start())
+        columns.append((name, match.start(), match.end()))
+
+    return columns
+
+
+def split_row(line, columns):
+    '''
+    Split a line of a table into a dictionnary of the values of columns (see table_columns()).
+
+    Each word of the line goes to the column whose header it overlaps the most, so that right aligned values (speed)
+    and values longer than their header (Twe1/0/1) are found, or else to the column it starts in (the next words of
+    a description). Missing values are empty strings.
+    '''
+
+    spans = {}
+    for match in re.finditer(r"\S+", line):
+        start, end = match.span()
+        best, overlap = None, 0
+        for i, (name, column_start, column_end) in enumerate(columns):
+            if column_start <= start:
+                # Column the word starts in, unless it overlaps a header
+                column = i
+            if min(end, column_end) - max(start, column_start) > overlap:
+                best, overlap = i, min(end, column_end) - max(start, column_start)
+        if best is None:
+            best = column if start >= columns[0][1] else 0
+        span = spans.get(best)
+        spans[best] = (span[0], end) if span else (start, end)
+
+    return dict((name, line[spans[i][0]:spans[i][1]] if i in spans else "") for i, (name, start, end) in enumerate(columns))
+
+
+def parse_table(response, first_column):
+    '''
+    Parse the table of the output of a command whose header line starts with first_column into a list of rows (see
+    split_row()), with the columns inferred from the header rather than fixed offsets, which change with the
+    platform and the length of the interface names.
+
+    The lines starting with a space (second line of the header) or dashes are skipped, the table ends at the first
+    empty line or at the prompt.
+    '''
+
+    lines = response.splitlines()[:-1]
+    for i, line in enumerate(lines):
+        if line.split()[:1] == [first_column]:
+            break
     else:
-        # Join parts of the command together, else we'll end up with each word as a separate command
-        # Specify multiple commands by using a comma
-        commands = " ".join(args.commands).split(",")
+        return []
 
-    # Redirect stdout to screen or file when saving is enabled
-    output_file_object = None
+    body = lines[i + 1:]
+    ruler = next((line for line in body[:3] if line.startswith("--")), None)
+    columns = table_columns(lines[i], ruler)
+    rows = []
+    for line in body:
+        if not line.strip():
+            if rows:
+                break
+        elif not line.startswith((" ", "--")):
+            rows.append(split_row(line, columns))
 
-    # Timestamping for filename
-    date_time = datetime.strftime(datetime.now(), "%Y-%m-%d_%Hh%Mm%S")
+    return rows
 
-    # Iterate over the list of IPs and connect to each of them via Telnet, run the commands, then print the output and close
-    for ip_address in list_ip_addresses:
-        
-        try:
-            telnet = TelnetDevice(ip_address, port=args.port, username=args.username, password=args.password, enable_password=args.enable_password, debug=args.debug, quiet=args.table)
-        except Exception as e:
-            print("[!] Error while connecting to {}".format(ip_address))
-            print(str(e)) 
-            continue
-
-        if not args.no_enable:
-            telnet.enable()
-
-        # Store the credentials so we can reuse them for each device. Remove this part if you want to get prompted each time.
-        args.username = telnet.username
-        args.password = telnet.password
-        args.enable_password = telnet.enable_password
-
-        # Set terminal length 0 to avoid the --More-- prompt with long outputs
-        telnet.send_command("terminal length 0")
-        telnet.read_output()
-
-        if args.save:
-            if args.output_directory:
-                save_dir = args.output_directory.format(date_time=date_time, ip_address=ip_address, hostname=telnet.hostname, username=telnet.username)
-                if not os.path.exists(save_dir):
-                    os.makedirs(save_dir, exist_ok=True)
-            else:
-                save_dir = os.getcwd()
-            if args.separate_output:
-                filename = os.path.join(save_dir, "pisco_output_{}_{}_{}.txt".format(telnet.hostname, ip_address, date_time))
-            else:
-                filename = os.path.join(save_dir, "pisco_output_{}.txt".format(date_time))
-            output_file_object = open(filename, "a")
-            print("[+] Saving output to {}...".format(filename), end="")
 
-        if args.autodeploy:
-            filename = "{}_autodeploy.txt".format(ip_address)
-            if os.path.exists(filename):
-                with open(filename, "r") as f:
-                    commands = [ line.rstrip() for line in f.readlines() if line.strip() ]
-            else:
-                print("[!] No autodeploy file found. Skipping device.")
-                continue
+def parse_int_list(response):
+    '''
+    Parse the output of "show int status" into a list of interfaces
+    '''
 
-        if args.batch:
-            # EXPERIMENTAL!
-            telnet.send_command("")
-            for c in commands:
-                telnet.send_command(c)
-                time.sleep(0.3)
-            telnet.send_command("\x1A")
-            telnet.send_command("exit")
-            response = telnet.read_all().decode("Latin-1")
-            print("\n[{}] {} ({}): Output of batch commands:\n{}\n".format(telnet.when, telnet.host, telnet.hostname, response), file=output_file_object)
-        else:
-            for c in commands:
-                telnet.send_command(c)
-                time.sleep(0.1)
-                response = telnet.read_output()
-                # Clean up the output a little bit by removing the first and last lines (IOS prompts)
-                if len(response.splitlines()) > 1:            
-                    response = response.splitlines()
-                    response.pop(0)
-                    response.pop(-1)
-                    response = "\n".join(response)
-                if args.table:
-                    print("{}\t{}\t{}".format(telnet.host, telnet.hostname, response.replace("\n", "").replace("\r", "")), file=output_file_object)
-                else:
-                    print("\n[{}] {} ({}): Output of command '{}'\n{}\n".format(telnet.when, telnet.host, telnet.hostname, c, response), file=output_file_object)
-            telnet.close()
+    return [row["Port"] for row in parse_table(response, "Port")]
 
-        if args.save:
-            print(" Done\n")
-    
-    if output_file_object:
-        output_file_object.close()
+
+def parse_int_status(response):
+    '''
+    Parse the output of "show int status" into a dictionnary indexed by interface
+    '''
+
+    int_status = {}
+
+    for row in parse_table(response, "Port"):
+        int_status[row["Port"]] = { "description": row.get("Name", ""), \
+                                    "status": row.get("Status", ""), \
+                                    "vlan": row.get("Vlan", ""), \
+                                    "duplex": row.get("Duplex", "").replace("a-", ""), \
+                                    "speed": row.get("Speed", "").replace("a-", "").replace("auto", "-"), \
+                                    "type": row.get("Type", ""), \
+                                    "power": "-"}
+
+    return int_status
+
+
+def parse_int_description(response, int_status):
+    '''
+    Update int_status with the full descriptions from the output of "show int desc"
+    '''
+
+    for row in parse_table(response, "Interface"):
+        if row["Interface"] in int_status:
+            int_status[row["Interface"]]["description"] = row.get("Description", "")
+
+
+def parse_power_inline(response, int_status):
+    '''
+    Update int_status with the PoE consumption from the output of "show power inline" (nothing on a switch without PoE)
+    '''
+
+    for row in parse_table(response, "Interface"):
+        if row["Interface"] in int_status and row.get("Power"):
+            int_status[row["Interface"]]["power"] = row["Power"].replace(".0", "") + "W"
+
+
+def interface_rows(facts, int_status):
+    '''
+    Return one row per interface of a device (a dictionnary of INTERFACE_COLUMNS), from its facts and int_status
+    '''
+
+    rows = []
+    for interface, status in int_status.items():
+        row = dict(facts, interface=interface)
+        row.update(status)
+        rows.append(row)
+
+    return rows
+
+
+class AdaptiveTimeout(object):
+    '''
+    Read timeout of a device: how long a silence of the device is waited for before giving up on the prompt.
+
+    It never goes below minimum (a command like write or copy can pause for several seconds while the network
+    round trip is a few milliseconds), and grows for the devices which pause longer: each wait for data from the
+    device, between the command and the first bytes of its output and between two chunks of the output, is a sample
+    smoothed the same way TCP computes its retransmission timeout (RFC 6298). The timeout is the smoothed wait plus
+    4 times its variation, multiplied by factor and bounded by maximum.
+    '''
+
+    def __init__(self, minimum=7, maximum=30, factor=4):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.srtt = None
+        self.rttvar = None
+
+
+    def update(self, sample):
+        '''
+        Add the time waited for data from the device, in seconds
+        '''
+
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+
+
+    @property
+    def value(self):
+        '''
+        Current timeout, in seconds
+        '''
+
+        if self.srtt is None:
+            return self.minimum
+
+        return max(self.minimum, min(self.maximum, self.factor * (self.srtt + 4 * self.rttvar)))
+
+
+def percentile(values, p):
+    '''
+    Return the p-th percentile of values (nearest rank), or None if there are no values
+    '''
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+class DeviceMetrics(object):
+    '''
+    Time spent by the session of a device in each phase (connect, login, enable, terminal length) and on each
+    command, measured with a monotonic clock, and bytes received from the device
+
+    Pass it to TelnetDevice so that the phases are kept even when the connection or the login fails.
+    '''
+
+    def __init__(self):
+        self.hostname = ""
+        self.when = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        self.start = time.monotonic()
+        self.end = None
+        self.phases = OrderedDict()
+        self.commands = []
+        self.bytes_received = 0
+
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Time the code in the with block as the phase name
+        '''
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+
+    def add_command(self, command, seconds, size, complete):
+        '''
+        Record the time spent waiting for and receiving the output of a command, and its size in bytes
+        '''
+
+        self.commands.append({"command": command, "seconds": seconds, "bytes": size, "complete": complete})
+
+
+    def stop(self):
+        self.end = time.monotonic()
+
+
+    @property
+    def elapsed(self):
+        return (self.end or time.monotonic()) - self.start
+
+
+class PromptScanner(object):
+    '''
+    Incremental search of the prompt in the output of a command.
+
+    feed() only searches the new data plus the last PROMPT_WINDOW bytes of the previous data, so the CPU cost is
+    linear with the size of the output (telnetlib.expect() searches the whole buffer again after each read).
+    The data before the window is written to sink as soon as it can't be part of the prompt.
+
+    Pager prompts ("--More--") are removed from the output and flagged with more, so the caller can answer them.
+    '''
+
+    def __init__(self, expected, sink):
+        self.expected = [re.compile(pattern) for pattern in expected]
+        self.sink = sink
+        self.window = b""
+        # Once the window has been cut, its first byte is not the start of a line: "^" must not match there
+        self.start = 0
+        self.size = 0
+        self.prompt = None
+        self.rest = b""
+        self.more = False
+        # After answering a pager prompt, the data is held until the sequence erasing the prompt has been received
+        self.erasing = False
+        self.erased = b""
+
+
+    def feed(self, data):
+        '''
+        Add received data and return True when the prompt has been found.
+
+        The prompt is then in self.prompt, and the data received after it (pipelined commands) in self.rest.
+        '''
+
+        self.size += len(data)
+        self.more = False
+
+        if self.erasing:
+            data = self.erased + data
+            if not data.strip(b"\x08 "):
+                self.erased = data
+                return False
+            data = PAGER_ERASE_PATTERN.sub(b"", data)
+            self.erasing = False
+            self.erased = b""
+
+        self.window += data
+
+        for pattern in self.expected:
+            match = pattern.search(self.window, self.start)
+            if match:
+                self.sink.write(self.window[:match.start()])
+                self.prompt = self.window[match.start():match.end()]
+                self.rest = self.window[match.end():]
+                self.window = b""
+                return True
+
+        pager = PAGER_PATTERN.search(self.window)
+        if pager:
+            self.window = self.window[:pager.start()]
+            self.more = True
+            self.erasing = True
+
+        if len(self.window) > PROMPT_WINDOW:
+            self.sink.write(self.window[:-PROMPT_WINDOW])
+            self.window = self.window[-PROMPT_WINDOW:]
+            self.start = 1
+
+        return False
+
+
+    def flush(self):
+        '''
+        No prompt was found: write what is left in the window to the sink and return it
+        '''
+
+        window, self.window = self.window, b""
+        self.sink.write(window)
+
+        return window
+
+
+class ResponseWriter(object):
+    '''
+    File-like object receiving the raw output of a command in chunks, and writing it to a text file with the same
+    clean up as print_response(): the echoed command (first line) and the line break before the prompt are removed
+    and line endings are converted to Unix line endings. Nothing but the trailing line breaks is kept in memory.
+
+    Use copy to also write the clean output to another file-like object (a BackupWriter), which is closed with the writer.
+    '''
+
+    def __init__(self, file, copy=None):
+        self.file = file
+        self.copy = copy
+        self.echo = True
+        self.pending = ""
+
+
+    def write(self, data):
+        text = self.pending + data.decode("Latin_1")
+        self.pending = ""
+
+        if self.echo:
+            end = text.find("\n")
+            if end == -1:
+                self.pending = text
+                return
+            if self.copy:
+                self.copy.echo(text[:end])
+            text = text[end + 1:]
+            self.echo = False
+
+        # Line breaks at the end are kept until we know if they are the last one
+        body = text.rstrip("\r\n")
+        self.pending = text[len(body):]
+        self.output(body.replace("\r\n", "\n").replace("\r", "\n"))
+
+
+    def output(self, text):
+        self.file.write(text)
+        if self.copy:
+            self.copy.write(text)
+
+
+    def close(self):
+        '''
+        Write the pending line breaks except the last one, which precedes the prompt
+        '''
+
+        if not self.echo:
+            self.output(self.pending.replace("\r\n", "\n").replace("\r", "\n")[:-1])
+        self.pending = ""
+        if self.copy:
+            self.copy.close()
+
+
+class DatasetWriter(object):
+    '''
+    Write rows (dictionnaries) to a CSV file with a header line, or to a JSON Lines file if its name ends with .jsonl
+    or .json, ready for pandas.read_csv() or pandas.read_json(lines=True). Only columns are written, missing values
+    are empty. The rows are flushed as they are written, so an interrupted run keeps the rows of the devices done.
+
+    With append, the rows are added to an existing file (the CSV header is written only if it is empty).
+    '''
+
+    def __init__(self, filename, columns=INTERFACE_COLUMNS, append=False):
+        self.columns = columns
+        self.json = filename.endswith((".jsonl", ".json"))
+        self.file = open(filename, "a" if append else "w", newline="")
+        self.rows = 0
+        if not self.json:
+            self.writer = csv.DictWriter(self.file, columns, restval="", extrasaction="ignore")
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+
+
+    def write(self, rows):
+        for row in rows:
+            if self.json:
+                self.file.write(json.dumps(OrderedDict((column, row.get(column, "")) for column in self.columns)) + "\n")
+            else:
+                self.writer.writerow(row)
+            self.rows += 1
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+def echo_matches(echoed, command):
+    '''
+    Tell if the first line of a response is the echo of command, so the response is the output of this command and
+    not of the previous one (session out of sync). IOS scrolls the long commands: their echo is the prompt, "$" and
+    the end of the command.
+    '''
+
+    echoed = " ".join(echoed.split())
+    command = " ".join(command.split())
+    if echoed.endswith(command):
+        return True
+
+    # The prompt is followed by "$" and the end of the command
+    scrolled = echoed.partition("$")[2].strip()
+    return bool(scrolled) and command.endswith(scrolled)
+
+
+class BackupWriter(object):
+    '''
+    File-like object receiving the clean output of a show command, and adding it to a BackupStore when closed if
+    the command completed (its prompt was found). The output is normalized (the volatile lines are dropped), hashed
+    and compressed as it arrives; it is kept in memory until it is known to be new, and then written to the store.
+
+    An empty output, or an output whose echo (see echo()) is not the command, is not a version of the output of the
+    command: it is counted as rejected instead, so that --diff never shows a whole configuration deleted.
+    '''
+
+    def __init__(self, store, device, command):
+        self.store = store
+        self.device = device
+        self.command = command
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode="wb", mtime=0)
+        self.pending = ""
+        self.echoed = None
+
+
+    def echo(self, line):
+        '''
+        Receive the first line of the response, which IOS echoes the command in
+        '''
+
+        self.echoed = line
+
+
+    def write(self, text):
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.add(line + "\n")
+
+
+    def add(self, line):
+        if VOLATILE_PATTERN.match(line):
+            return
+        data = line.encode("Latin_1")
+        self.hash.update(data)
+        self.gzip.write(data)
+        self.size += len(data)
+
+
+    def close(self):
+        if self.pending:
+            self.add(self.pending)
+            self.pending = ""
+        self.gzip.close()
+        try:
+            if not self.device.prompt_found:
+                pass
+            elif not self.size or self.echoed is None or not echo_matches(self.echoed, self.command):
+                with self.store.lock:
+                    self.store.rejected += 1
+            else:
+                self.store.add(self.file, self.hash.hexdigest(), self.size, self.device.host, self.device.port, self.device.hostname, self.command)
+        finally:
+            self.file.close()
+
+
+class BackupStore(object):
+    '''
+    Content-addressed store of the outputs of the show commands (configurations...) of the devices, without the
+    lines which change at each run (see VOLATILE_PATTERN): each distinct output is saved once, and a device whose
+    output didn't change since the last run costs no write at all.
+
+    Layout of the directory:
+        objects/ab/cdef...gz:       normalized output, gzip compressed, named after its SHA-256
+        devices/<ip_address>.json:  versions of the output of each command of the device (hash, time, hostname, size),
+                                    devices/<ip_address>_<port>.json for a device on another port than 23
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.new = 0
+        self.unchanged = 0
+        # Empty outputs, or outputs of another command
+        self.rejected = 0
+
+
+    def writer(self, device, command):
+        '''
+        Return a BackupWriter for the output of command on device
+        '''
+
+        return BackupWriter(self, device, command)
+
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest[2:] + ".gz")
+
+
+    def index_path(self, ip_address, port):
+        # ":" is not allowed in Windows file names
+        return os.path.join(self.directory, "devices", "{}.json".format(device_key(ip_address, port).replace(":", "_")))
+
+
+    def index(self, ip_address, port):
+        '''
+        Return the versions of the outputs of a device: {command: [{"hash", "time", "hostname", "size"}, ...]}
+        '''
+
+        try:
+            with open(self.index_path(ip_address, port)) as f:
+                return json.load(f)["commands"]
+        except FileNotFoundError:
+            return {}
+
+
+    def write_atomically(self, filename, data):
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as f:
+            shutil.copyfileobj(data, f)
+        os.replace(f.name, filename)
+
+
+    def add(self, data, digest, size, ip_address, port, hostname, command):
+        '''
+        Add a version of the output of command on a device, unless it is the same as the last one. data is the
+        compressed output, digest its SHA-256 before compression. Return True if it is a new version.
+        '''
+
+        command = " ".join(command.split())
+        with self.lock:
+            index = self.index(ip_address, port)
+            versions = index.setdefault(command, [])
+            if versions and versions[-1]["hash"] == digest:
+                self.unchanged += 1
+                return False
+
+            # Another device may have the same output
+            if not os.path.exists(self.object_path(digest)):
+                data.seek(0)
+                self.write_atomically(self.object_path(digest), data)
+            versions.append({"hash": digest, "time": datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"), "hostname": hostname, "size": size})
+            self.write_atomically(self.index_path(ip_address, port), io.BytesIO(json.dumps({"commands": index}, indent=1).encode()))
+            self.new += 1
+
+        return True
+
+
+    def read(self, digest):
+        '''
+        Return a saved output
+        '''
+
+        with gzip.open(self.object_path(digest), "rt", encoding="Latin_1") as f:
+            return f.read()
+
+
+    def version(self, versions, reference):
+        '''
+        Return the version of a list of versions referenced by its number (1 is the first one, -1 the last one) or
+        the beginning of its hash (at least 7 characters, like git)
+        '''
+
+        if len(reference) < 7:
+            try:
+                number = int(reference)
+            except ValueError:
+                raise KeyError("invalid version {}".format(reference))
+        else:
+            matches = [version for version in versions if version["hash"].startswith(reference.lower())]
+            if len(matches) != 1:
+                raise KeyError("no version or several versions match {}".format(reference))
+            return matches[0]
+
+        if number == 0 or abs(number) > len(versions):
+            raise KeyError("no version {} (there are {})".format(number, len(versions)))
+        return versions[number - 1 if number > 0 else number]
+
+
+    def diff(self, ip_address, port, command, old="-2", new="-1"):
+        '''
+        Return the unified diff between two versions of the output of command on a device, as a list of lines
+        '''
+
+        versions = self.index(ip_address, port).get(" ".join(command.split()), [])
+        if len(versions) < 2 and (old, new) == ("-2", "-1"):
+            return []
+        old_version = self.version(versions, old)
+        new_version = self.version(versions, new)
+        # Same hash, same output: no need to read them
+        if old_version["hash"] == new_version["hash"]:
+            return []
+
+        return list(difflib.unified_diff(self.read(old_version["hash"]).splitlines(True), self.read(new_version["hash"]).splitlines(True),
+                                         "{} {} ({})".format(ip_address, command, old_version["time"]),
+                                         "{} {} ({})".format(ip_address, command, new_version["time"])))
+
+
+def run_steps(steps, perform):
+    '''
+    Run steps, a generator of I/O requests (see DeviceProtocol), with the blocking function perform(request), and
+    return the value of steps. What perform() returns, or the exception it raises, is sent back into steps.
+    '''
+
+    result, error = None, None
+    while True:
+        try:
+            request = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        result, error = None, None
+        try:
+            result = perform(request)
+        except BaseException as e:
+            error = e
+
+
+async def run_steps_async(steps, perform):
+    '''
+    Same as run_steps(), with perform(request) a coroutine
+    '''
+
+    result, error = None, None
+    while True:
+        try:
+            request = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        result, error = None, None
+        try:
+            result = await perform(request)
+        except BaseException as e:
+            error = e
+
+
+class DeviceProtocol(object):
+    '''
+    Session with a Cisco IOS device without the I/O: login, enable mode, reading the output of a command until the
+    prompt, pipelining. TelnetDevice (blocking sockets) and AsyncTelnetDevice (asyncio) only add the transport.
+
+    The methods ending with _steps are generators yielding the I/O they need as requests, which the transport runs
+    with its perform() method (see run_steps()) and answers by sending back the result:
+    -   ("write", data):        send raw bytes to the device
+    -   ("read", timeout):      return the raw bytes received within timeout seconds, b"" if the connection is closed,
+                                or None on timeout
+    -   ("ask", name, prompt):  return the credential name of self.credentials, calling prompt() if it is not known yet
+    '''
+
+    def __init__(self, host, port=23, username=None, password=None, enable_password=None, quiet=False, debug=False, credentials=None, credential_index=None, connect_timeout=4, read_timeout=None, metrics=None, result_cache=None):
+        if credentials is None:
+            credentials = CredentialCache(username, password, enable_password)
+        self.credentials = credentials
+        self.credential_index = credential_index
+        self.host = host
+        self.port = port
+        self.hostname = ""
+        self.username = credentials.username
+        self.password = credentials.password
+        self.enable_password = credentials.enable_password
+        self.enable_mode = False
+        self.infos = {}
+        self.int_status = {}
+        self.when = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        self.quiet = quiet
+        self.debug = debug
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout or AdaptiveTimeout()
+        self.metrics = metrics or DeviceMetrics()
+        self.result_cache = result_cache
+        # Data received but not consumed yet, and incomplete Telnet command at the end of the last chunk
+        self.buffer = b""
+        self.raw_buffer = b""
+        self.eof = False
+        self.prompt_found = False
+
+
+    def login_steps(self):
+        '''
+        Log into the device, trying each username/password in the lists
+        '''
+
+        start = time.monotonic()
+        response = (yield from self.read_output_steps(password_prompt=True)).splitlines()[-1]
+
+        retries = 0
+        order = None
+        login_successful = False
+
+        while not login_successful:
+            if "User" in response or "ame" in response:
+                if not self.username:
+                    self.username = yield ("ask", "username", lambda: input("Username: "))
+                order = order or credential_order(self.credential_index, self.host, self.port, "login", self.username)
+                yield from self.send_command_steps(self.username.split(DELIMITER)[order[retries]])
+                response = yield from self.read_output_steps(password_prompt=True)
+
+            if "Pass" in response:
+                if not self.password:
+                    self.password = yield ("ask", "password", getpass.getpass)
+                if len(self.username.split(DELIMITER)) != len(self.password.split(DELIMITER)):
+                    print("[!] Username and password lists must be the same length (use comma as delimiter)", file=sys.stderr)
+                    self.forget_login()
+                    raise LoginError("username and password lists of different lengths")
+                order = order or credential_order(self.credential_index, self.host, self.port, "login", self.password)
+                yield from self.send_command_steps(self.password.split(DELIMITER)[order[retries]])
+                response = yield from self.read_output_steps(password_prompt=True)
+
+            if response.endswith(">"):
+                login_successful = True
+                self.hostname = response.splitlines()[-1].rstrip(">")
+            elif response.endswith("#"):
+                login_successful = True
+                self.enable_mode = True
+                self.hostname = response.splitlines()[-1].rstrip("#")
+            else:
+                if (len(self.username.split(DELIMITER)) - retries) > 1:
+                    print("[!] Wrong login/password, trying next one in list", file=sys.stderr)
+                    retries += 1
+                else:
+                    print("[!] Wrong login/password", file=sys.stderr)
+                    self.forget_login()
+                    raise LoginError("wrong login/password")
+
+        if self.credential_index is not None and order and len(order) > 1:
+            self.credential_index.set(self.host, self.port, "login", order[retries], len(order))
+
+        self.metrics.add_phase("login", time.monotonic() - start)
+
+        if not self.quiet:
+            print("[+] Login successful", file=sys.stderr)
+
+
+    def forget_login(self):
+        '''
+        Drop the username and password which failed from self.credentials, so that the next session asks for them
+        again instead of sending a typo to the AAA servers for every device (and locking the account)
+        '''
+
+        self.credentials.forget("username", self.username)
+        self.credentials.forget("password", self.password)
+
+
+    def send_command_steps(self, command):
+        '''
+        Send command to device.
+
+        Note: We use Latin_1 encoding because ascii can yield invalid characters with some devices like Cisco WISM.
+        '''
+
+        if self.debug:
+            print("[DEBUG] {} send {!r}".format(self.host, command), file=sys.stderr)
+        yield ("write", command.encode("Latin_1").replace(IAC_BYTE, bytes([IAC, IAC])) + b"\n")
+
+
+    def read_output_steps(self, password_prompt=False, sink=None, timeout=None):
+        '''
+        Read output until one of the possible prompts.
+
+        Use password_prompt when a ":" prompt is possible.
+
+        Use sink to stream the output to a file-like object as it arrives instead of returning it: the bytes
+        received before the prompt are written to sink, and only the prompt is returned.
+
+        The timeout (by default the device's adaptive read_timeout, which learns from the waits for data) is reset
+        each time data is received, so long outputs (show tech...) are not interrupted.
+        '''
+
+        timeout = timeout or self.read_timeout.value
+        last = time.monotonic()
+
+        buffer = io.BytesIO() if sink is None else None
+        scanner = PromptScanner(prompt_patterns(password_prompt, self.hostname), buffer or sink)
+        data, self.buffer = self.buffer, b""
+
+        while not scanner.feed(data):
+            if scanner.more:
+                yield ("write", b" ")
+            if self.eof:
+                break
+            data = yield ("read", timeout)
+            if data is None:
+                break
+            if not data:
+                self.eof = True
+                break
+            self.metrics.bytes_received += len(data)
+            # How long the device kept silent
+            now = time.monotonic()
+            self.read_timeout.update(now - last)
+            last = now
+            if self.debug:
+                print("[DEBUG] {} recv {!r}".format(self.host, data), file=sys.stderr)
+            data, replies, self.raw_buffer = telnet_filter(self.raw_buffer + data)
+            if replies:
+                yield ("write", replies)
+
+        self.prompt_found = scanner.prompt is not None
+        if self.prompt_found:
+            # Anything after the prompt belongs to the next command (pipelining)
+            self.buffer = scanner.rest + self.buffer
+            tail = scanner.prompt.decode("Latin_1")
+        else:
+            # What is left is written to the sink or the buffer
+            tail = ""
+            window = scanner.flush().decode("Latin_1")
+            if not scanner.size and self.eof:
+                raise EOFError("telnet connection closed")
+            hostname = find_hostname(window) if self.hostname else None
+            if hostname and hostname != self.hostname:
+                # No prompt found because the command changed the hostname: the output ends with the new prompt
+                self.hostname = hostname
+                self.prompt_found = True
+
+        if sink is not None:
+            return tail
+        return buffer.getvalue().decode("Latin_1") + tail
+
+
+    def run_command_steps(self, command):
+        '''
+        Send command and return its output, or return it from self.result_cache when it was already run recently.
+        The errors of the device ("% Invalid input...") are not cached.
+        '''
+
+        if self.result_cache:
+            response = self.result_cache.get(self.host, self.port, command)
+            if response is not None:
+                return response
+            # Before sending it: the outputs are stale even if the command doesn't return
+            self.result_cache.invalidate(self.host, self.port, command)
+
+        yield from self.send_command_steps(command)
+        response = yield from self.read_output_steps()
+        if self.result_cache and self.prompt_found and self.result_cache.cacheable(command) and not ERROR_OUTPUT_PATTERN.match(response):
+            self.result_cache.set(self.host, self.port, command, response)
+
+        return response
+
+
+    def enable_steps(self):
+        '''
+        Enter enable mode. Multiple passwords can be provided.
+        '''
+
+        if self.enable_mode:
+            return
+
+        start = time.monotonic()
+        retries = 0
+        order = None
+        yield from self.send_command_steps("enable")
+
+        while self.enable_mode == False:
+            response = yield from self.read_output_steps(password_prompt=True)
+            # We ask for password only twice in interactive mode, but we'll try all the passwords in the list
+            # This is to avoid getting stuck at the enable password prompt
+            # If the password is incorrect we'd rather fail and move to the next device
+            if "Password:" in response:
+                if not self.enable_password:
+                    self.enable_password = yield ("ask", "enable_password", lambda: getpass.getpass(prompt="Enable password: "))
+                    retries = 0
+                    order = None
+                order = order or credential_order(self.credential_index, self.host, self.port, "enable", self.enable_password)
+                if (len(self.enable_password.split(DELIMITER)) - retries >= 1):
+                    yield from self.send_command_steps(self.enable_password.split(DELIMITER)[order[retries]])
+                else:
+                    yield from self.send_command_steps("")
+                    self.credentials.forget("enable_password", self.enable_password)
+                    self.enable_password = None
+                retries += 1
+            elif "#" in response:
+                    self.enable_mode = True
+                    if self.credential_index is not None and order and len(order) > 1 and 0 < retries <= len(order):
+                        self.credential_index.set(self.host, self.port, "enable", order[retries - 1], len(order))
+            else:
+                if (len(self.enable_password.split(DELIMITER)) - retries >= 1):
+                    yield from self.send_command_steps("enable")
+                else:
+                    print("[!] Wrong password, can't go into enable mode", file=sys.stderr)
+                    break
+
+        self.metrics.add_phase("enable", time.monotonic() - start)
+
+
+    def prepare_steps(self, enable=True):
+        '''
+        Enter enable mode (unless enable is False) and set terminal length 0 to avoid the --More-- prompt with long outputs
+        '''
+
+        if enable:
+            yield from self.enable_steps()
+
+        with self.metrics.phase("terminal_length"):
+            yield from self.send_command_steps("terminal length 0")
+            yield from self.read_output_steps()
+
+
+    def get_facts_steps(self):
+        '''
+        Get hostname, IOS info and uptime and put them in a dictionnary
+        '''
+
+        self.facts = parse_facts((yield from self.run_command_steps(FACTS_COMMAND)), self.host, self.when)
+
+        return self.facts
+
+
+    def get_int_list_steps(self):
+        '''
+        Get a simple list of all physical interfaces
+        '''
+
+        return parse_int_list((yield from self.run_command_steps("show int status")))
+
+
+    def get_int_status_steps(self, get_full_description=False, get_power=False):
+        '''
+        Get interfaces' status and description and store result in a dictionnary "self.int_status"
+        '''
+
+        self.int_status.update(parse_int_status((yield from self.run_command_steps("show int status"))))
+
+        if get_full_description:
+            parse_int_description((yield from self.run_command_steps("show int desc")), self.int_status)
+
+        if get_power:
+            parse_power_inline((yield from self.run_command_steps("show power inline")), self.int_status)
+
+        return self.int_status
+
+
+    def get_interface_rows_steps(self):
+        '''
+        Get the facts and the status, full description and PoE consumption of the interfaces, as one row per interface
+        '''
+
+        yield from self.get_facts_steps()
+        yield from self.get_int_status_steps(get_full_description=True, get_power=True)
+
+        return interface_rows(self.facts, self.int_status)
+
+
+class CommandPipeline(object):
+    '''
+    Commands of a session sent ahead of their output: up to window commands are sent without waiting for the output
+    of the previous ones (pipelining). The device buffers them as typeahead, and the returned stream is split back
+    into one response per command at each prompt.
+
+    The lines of a multi-line banner (from "banner motd ^" to the line with the delimiter) get no prompt: nothing is
+    read for them, and their echo is in the response of the line closing the banner.
+
+    When the prompt doesn't come within the read timeout, it is waited for once more. If it is still missing (a
+    command asking a question...), the command is incomplete. Without pipelining (window=1), the next command is
+    sent anyway, and its output may start with the end of this one. With pipelining, the session is out of sync: the
+    responses of the commands already sent are empty, the next commands are not sent, and TimeoutError is raised,
+    instead of giving each command the output of the previous one.
+
+    Use sink to stream the outputs instead of keeping them in memory: sink(command) is called before
+    reading the output of each command and returns the file-like object to write it to.
+
+    The time spent reading the output of each command and its size are recorded in the metrics of the session. The
+    commands are not cached, but those which may change the device invalidate the result_cache of the session.
+    '''
+
+    def __init__(self, session, commands, window=1, sink=None):
+        self.session = session
+        self.commands = iter(commands)
+        self.window = window
+        self.sink = sink
+        self.in_flight = deque()
+        # Delimiter of the banner being sent
+        self.delimiter = None
+        # Command after which the prompt was lost, and number of commands not sent
+        self.lost = None
+        self.not_sent = 0
+
+
+    def next_steps(self):
+        '''
+        Send the next commands, up to window commands ahead, and return the (command, response) tuple of the oldest
+        one, or None when all the commands are done (see DeviceProtocol)
+        '''
+
+        session = self.session
+        if self.lost is None:
+            while len(self.in_flight) < self.window:
+                command = next(self.commands, None)
+                if command is None:
+                    break
+                if session.result_cache:
+                    session.result_cache.invalidate(session.host, session.port, command)
+                yield from session.send_command_steps(command)
+                self.in_flight.append((command, self.expects_prompt(command)))
+
+        if not self.in_flight:
+            if self.lost is not None:
+                raise TimeoutError("no prompt after '{}', the session is out of sync ({} command(s) not sent)".format(self.lost, self.not_sent))
+            return None
+
+        command, expects_prompt = self.in_flight.popleft()
+        command_sink = self.sink(command) if self.sink else None
+        if self.lost is not None:
+            response = ""
+        elif not expects_prompt:
+            response = ""
+            session.prompt_found = True
+        else:
+            start = time.monotonic()
+            size = session.metrics.bytes_received
+            response = yield from session.read_output_steps(sink=command_sink)
+            if not session.prompt_found:
+                # Late prompt (slow write...): wait for it once more rather than shifting the next outputs
+                response += yield from session.read_output_steps(sink=command_sink)
+            session.metrics.add_command(command, time.monotonic() - start, session.metrics.bytes_received - size, session.prompt_found)
+            if not session.prompt_found and self.window > 1:
+                self.lost = command
+                self.not_sent = len(list(self.commands))
+        if command_sink:
+            command_sink.close()
+
+        return command, response
+
+
+    def expects_prompt(self, command):
+        '''
+        Tell if the device returns a prompt after command: not after the lines of a multi-line banner, the line closing
+        it excepted
+        '''
+
+        if self.delimiter is not None:
+            if self.delimiter in command:
+                self.delimiter = None
+                return True
+            return False
+
+        match = BANNER_PATTERN.match(command)
+        if match and match.group(1) not in match.group(2):
+            self.delimiter = match.group(1)
+            return False
+
+        return True
+
+
+class TelnetDevice(DeviceProtocol, telnetlib.Telnet if telnetlib else object):
+    '''
+    Define a TelnetDevice class that inherits from telnetlib.Telnet
+
+    We add a few methods that simplify interacting with a Cisco IOS device:
+    -   send_command
+    -   read_output 
+    -   enable
+    -   prepare (enable and terminal length 0)
+    -   get_facts
+    -   get_int_list
+    -   get_int_status (with or without full description and PoE status)
+    -   get_interface_rows
+
+    Those methods handle encoding/decoding of strings/bytes. They run the steps of DeviceProtocol on the socket.
+    '''
+
+    def __init__(self, host, port=23, username=None, password=None, enable_password=None, quiet=False, debug=False, credentials=None, credential_index=None, connect_timeout=4, read_timeout=None, metrics=None, result_cache=None):
+        '''
+        Instantiating the TelnetDevice class will automatically connect and log into the device
+
+        Use credentials to share a CredentialCache between several sessions (username/password/enable_password are then ignored)
+        Use credential_index to try first the credentials that worked last time, from a CredentialIndexCache
+        Use read_timeout to pass an AdaptiveTimeout (with another minimum for example)
+        Use metrics to pass the DeviceMetrics where the timings of the session are recorded
+        Use result_cache to share a ResultCache, used by run_command() and the get_* methods
+        '''
+        DeviceProtocol.__init__(self, host, port, username, password, enable_password, quiet, debug, credentials, credential_index, connect_timeout, read_timeout, metrics, result_cache)
+
+        if telnetlib is None:
+            raise RuntimeError("telnetlib is not available with this version of Python, use AsyncTelnetDevice instead")
+
+        if not quiet:
+            print("[+] Connecting to {}... ".format(host), file=sys.stderr)
+
+        start = time.monotonic()
+        telnetlib.Telnet.__init__(self, host, port=self.port, timeout=connect_timeout)
+        self.metrics.add_phase("connect", time.monotonic() - start)
+
+        self.run(self.login_steps())
+
+
+    def perform(self, request):
+        '''
+        Run a request of DeviceProtocol on the socket
+        '''
+
+        kind = request[0]
+        if kind == "write":
+            self.sock.sendall(request[1])
+        elif kind == "read":
+            # telnetlib reads 50 bytes at a time and parses them byte by byte: read the socket directly instead
+            self.sock.settimeout(request[1])
+            try:
+                return self.sock.recv(65536)
+            except socket.timeout:
+                return None
+        elif kind == "ask":
+            return self.credentials.get(request[1], request[2])
+
+
+    def run(self, steps):
+        return run_steps(steps, self.perform)
+
+
+    def send_command(self, command):
+        self.run(self.send_command_steps(command))
+
+
+    def read_output(self, password_prompt=False, sink=None, timeout=None):
+        '''
+        Read output until one of the possible prompts, see DeviceProtocol.read_output_steps()
+        '''
+
+        return self.run(self.read_output_steps(password_prompt, sink, timeout))
+
+
+    def run_command(self, command):
+        '''
+        Send command and return its output, or return it from self.result_cache when it was already run recently
+        '''
+
+        return self.run(self.run_command_steps(command))
+
+
+    def send_commands(self, commands, window=1, sink=None):
+        '''
+        Send commands and yield a (command, response) tuple for each of them, in order, up to window commands ahead
+        of their output (see CommandPipeline)
+        '''
+
+        pipeline = CommandPipeline(self, commands, window, sink)
+        while True:
+            result = self.run(pipeline.next_steps())
+            if result is None:
+                return
+            yield result
+
+
+    def enable(self):
+        '''
+        Enter enable mode. Multiple passwords can be provided.
+        '''
+
+        self.run(self.enable_steps())
+
+
+    def prepare(self, enable=True):
+        '''
+        Enter enable mode (unless enable is False) and set terminal length 0
+        '''
+
+        self.run(self.prepare_steps(enable))
+
+
+    def get_facts(self):
+        return self.run(self.get_facts_steps())
+
+
+    def get_int_list(self):
+        return self.run(self.get_int_list_steps())
+
+
+    def get_int_status(self, get_full_description=False, get_power=False):
+        return self.run(self.get_int_status_steps(get_full_description, get_power))
+
+
+    def get_interface_rows(self):
+        return self.run(self.get_interface_rows_steps())
+
+
+class AsyncTelnetDevice(DeviceProtocol):
+    '''
+    asyncio version of TelnetDevice, for running thousands of sessions on a single event loop.
+
+    It offers the same methods as TelnetDevice, as coroutines:
+    -   send_command
+    -   read_output
+    -   enable
+    -   prepare (enable and terminal length 0)
+    -   get_facts
+    -   get_int_list
+    -   get_int_status (with or without full description and PoE status)
+    -   get_interface_rows
+
+    It does not depend on telnetlib (removed from the Standard Library in Python 3.13): Telnet option
+    negotiation is handled by DeviceProtocol, by refusing every option like telnetlib does.
+
+    Usage:
+        telnet = await AsyncTelnetDevice.connect("192.0.2.1", username="admin", password="cisco")
+    '''
+
+    def __init__(self, host, port=23, username=None, password=None, enable_password=None, quiet=False, debug=False, credentials=None, credential_index=None, connect_timeout=4, read_timeout=None, metrics=None, result_cache=None):
+        '''
+        Instantiating the class does not connect to the device: use the connect() class method, or open() then login()
+        '''
+        DeviceProtocol.__init__(self, host, port, username, password, enable_password, quiet, debug, credentials, credential_index, connect_timeout, read_timeout, metrics, result_cache)
+        self.reader = None
+        self.writer = None
+
+
+    @classmethod
+    async def connect(cls, host, **kwargs):
+        '''
+        Create the device object, connect and log into the device
+        '''
+
+        device = cls(host, **kwargs)
+        await device.open()
+        try:
+            await device.login()
+        except BaseException:
+            device.close()
+            raise
+
+        return device
+
+
+    async def open(self):
+        '''
+        Open the TCP connection to the device
+        '''
+
+        if not self.quiet:
+            print("[+] Connecting to {}... ".format(self.host), file=sys.stderr)
+
+        start = time.monotonic()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, int(self.port)), timeout=self.connect_timeout)
+        self.metrics.add_phase("connect", time.monotonic() - start)
+
+
+    def close(self):
+        '''
+        Close the connection
+        '''
+
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+    async def perform(self, request):
+        '''
+        Run a request of DeviceProtocol on the asyncio streams
+        '''
+
+        kind = request[0]
+        if kind == "write":
+            self.writer.write(request[1])
+            await self.writer.drain()
+        elif kind == "read":
+            try:
+                return await asyncio.wait_for(self.reader.read(65536), timeout=request[1])
+            except asyncio.TimeoutError:
+                return None
+        elif kind == "ask":
+            # Prompt in a thread, so the other sessions keep running while the user types
+            return await asyncio.get_running_loop().run_in_executor(None, self.credentials.get, request[1], request[2])
+
+
+    async def run(self, steps):
+        return await run_steps_async(steps, self.perform)
+
+
+    async def login(self):
+        '''
+        Log into the device, trying each username/password in the lists
+        '''
+
+        await self.run(self.login_steps())
+
+
+    async def send_command(self, command):
+        await self.run(self.send_command_steps(command))
+
+
+    async def read_output(self, password_prompt=False, sink=None, timeout=None):
+        '''
+        Read output until one of the possible prompts, see DeviceProtocol.read_output_steps()
+        '''
+
+        return await self.run(self.read_output_steps(password_prompt, sink, timeout))
+
+
+    async def run_command(self, command):
+        '''
+        Send command and return its output, or return it from self.result_cache when it was already run recently
+        '''
+
+        return await self.run(self.run_command_steps(command))
+
+
+    async def send_commands(self, commands, window=1, sink=None):
+        '''
+        Send commands and yield a (command, response) tuple for each of them, in order, see TelnetDevice.send_commands()
+        '''
+
+        pipeline = CommandPipeline(self, commands, window, sink)
+        while True:
+            result = await self.run(pipeline.next_steps())
+            if result is None:
+                return
+            yield result
+
+
+    async def enable(self):
+        '''
+        Enter enable mode. Multiple passwords can be provided.
+        '''
+
+        await self.run(self.enable_steps())
+
+
+    async def prepare(self, enable=True):
+        '''
+        Enter enable mode (unless enable is False) and set terminal length 0
+        '''
+
+        await self.run(self.prepare_steps(enable))
+
+
+    async def get_facts(self):
+        return await self.run(self.get_facts_steps())
+
+
+    async def get_int_list(self):
+        return await self.run(self.get_int_list_steps())
+
+
+    async def get_int_status(self, get_full_description=False, get_power=False):
+        return await self.run(self.get_int_status_steps(get_full_description, get_power))
+
+
+    async def get_interface_rows(self):
+        return await self.run(self.get_interface_rows_steps())
+
+
+class DevicePool(object):
+    '''
+    Pool of logged-in sessions, for scripts polling the same devices again and again.
+
+    Sessions are logged in, in enable mode (unless enable=False) and with "terminal length 0". Idle sessions are kept
+    for idle_timeout seconds, at most max_size of them (the least recently used are closed first). Before a session
+    is handed out, a bare newline checks that it is still alive, and a dead session is transparently replaced.
+
+    Usage:
+        pool = DevicePool(username="admin", password="cisco")
+        with pool.session("192.0.2.1") as telnet:
+            facts = telnet.get_facts()
+    '''
+
+    def __init__(self, username=None, password=None, enable_password=None, port=23, enable=True, max_size=64, idle_timeout=300, health_timeout=2, credentials=None, credential_index=None, result_cache=None):
+        if credentials is None:
+            credentials = CredentialCache(username, password, enable_password)
+        self.credentials = credentials
+        self.credential_index = credential_index
+        self.result_cache = result_cache
+        self.port = port
+        self.enable = enable
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_timeout = health_timeout
+        # Idle sessions, least recently used first: (host, port, id) -> (device, time it was released)
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def connect(self, host, port):
+        '''
+        Open a new session, ready to run commands
+        '''
+
+        device = TelnetDevice(host, port=port, quiet=True, credentials=self.credentials, credential_index=self.credential_index, result_cache=self.result_cache)
+        try:
+            device.prepare(self.enable)
+        except BaseException:
+            device.close()
+            raise
+
+        return device
+
+
+    def is_alive(self, device):
+        '''
+        Send a bare newline and check that the prompt comes back
+        '''
+
+        if device.get_socket() is None:
+            return False
+        try:
+            device.send_command("")
+            device.read_output(timeout=self.health_timeout)
+        except (OSError, EOFError):
+            return False
+
+        return device.prompt_found
+
+
+    def expire(self):
+        '''
+        Remove the sessions idle for more than idle_timeout seconds and the least recently used ones above max_size.
+        Return the removed devices: they must be closed outside the lock.
+        '''
+
+        expired = []
+        now = time.monotonic()
+        for key, (device, released) in list(self.idle.items()):
+            if now - released > self.idle_timeout or len(self.idle) > self.max_size:
+                expired.append(device)
+                del self.idle[key]
+
+        return expired
+
+
+    def acquire(self, host, port=None):
+        '''
+        Return a session to host, reusing an idle one when possible. Give it back with release().
+        '''
+
+        port = port or self.port
+
+        while True:
+            with self.lock:
+                expired = self.expire()
+                device = None
+                for key in reversed(self.idle):
+                    if key[:2] == (host, port):
+                        device = self.idle.pop(key)[0]
+                        break
+            for expired_device in expired:
+                expired_device.close()
+            if device is None:
+                return self.connect(host, port)
+            if self.is_alive(device):
+                return device
+            device.close()
+
+
+    def release(self, device):
+        '''
+        Give a session back to the pool
+        '''
+
+        with self.lock:
+            self.idle[(device.host, device.port, id(device))] = (device, time.monotonic())
+            expired = self.expire()
+        for expired_device in expired:
+            expired_device.close()
+
+
+    @contextmanager
+    def session(self, host, port=None):
+        '''
+        Context manager acquiring a session and releasing it at the end of the block.
+        A session is closed instead of being released if the block raises an exception, as its state is unknown.
+        '''
+
+        device = self.acquire(host, port)
+        try:
+            yield device
+        except BaseException:
+            device.close()
+            raise
+        self.release(device)
+
+
+    def close(self):
+        '''
+        Close all the idle sessions
+        '''
+
+        with self.lock:
+            devices = [device for device, released in self.idle.values()]
+            self.idle.clear()
+        for device in devices:
+            device.close()
+
+
+def parse_arguments():
+    '''
+    Parse command line arguments.
+
+    Main options:
+        -c / -C:    specify the commands to send via the command line, with a text file, or by loading an <ipaddress>_autodeploy.txt file automatically
+        -d / -D:    specify IP addresses at the command line, or point to a file containing a list of IP addresses
+                    CIDR blocks (10.0.0.0/24) and ranges (10.0.0.1-20) are expanded
+                    the file can also be a CSV file with a header line and ip_address, port, credentials (see --credential-sets) and tags columns (see --tags)
+        -u / -p:    specify credentials at the command line - this is NOT SECURE! (for example in your shell history)
+                    multiple credentials can be specified as a comma separated list
+        --credential-cache: remember in a file the position in the lists of the credentials that worked for each device, so they are tried first next time
+        -n:         by default the program will go into enable mode at login. We can disable this with --no-enable 
+        -s:         we can use --save to save the output to a text file instead of stdout
+        -S:         to save the output of each host to a different file
+        -O:         use -O filename to save to this filename. Do not forget to use "-s" too
+                    use keywords '{date_time}', '{ip_address}' or '{username}' to insert values in the directoy's name
+        -z:         gzip the output files (.txt.gz)
+        --backup-store: keep the versions of the output of the show commands in a directory: each distinct output is saved once, without the lines
+                    which change at every run (timestamps, ntp clock-period...), and unchanged outputs are not saved again
+        --diff:     show the differences between two versions of the outputs saved in the --backup-store, instead of running commands
+        --collect:  instead of running commands, collect the facts and the status, description, PoE consumption... of each interface into a CSV
+                    or JSON Lines (.jsonl) file with one row per device and interface, ready for pandas or a spreadsheet
+        --journal:  record each device and command as soon as they are done (synced to disk): after an interrupted run, --resume
+                    runs only the devices which were not done ok (failed, skipped or not run yet)
+        --metrics:  save the timings of each device (connect, login, enable, terminal length 0, each command) and bytes received to a JSON Lines file,
+                    followed by a summary (command latency percentiles, throughput, slowest devices) - see also --prometheus
+        -b:         use 'batch' mode to pipeline the commands: up to --window commands are sent before reading their output, which is then split per command
+                    at each prompt - this saves a round trip per command on high latency links
+                    the lines of multi-line banners are sent without waiting for a prompt, but any other command without a prompt (a question...)
+                    stops the device after twice the read timeout, as the outputs can't be split any more: don't use -b for those
+        -T:         print output as a one liner per device - ok for short outputs, can be very ugly if the output of the command is more than one line
+        -w:         use --workers N to process N devices concurrently (the output of each device is still printed/saved in one block)
+        --processes: use --processes P to split the devices between P worker processes, each running --workers sessions, to use all the
+                    CPU cores on very large inventories (the outputs and the summary are the same as with a single process). The
+                    processes can't ask for the enable password: give it with -e, or -e alone to be asked for it before they start
+        --group-limit: limit the concurrent sessions in each /24 subnet (or tag of the CSV inventory with --group-by tag), on top of --workers
+        --login-rate: limit the new logins per second, to spare the TACACS/RADIUS servers
+        --retries:  retry the connection and login of a device after a network error (timeout, connection refused or reset), with a random
+                    exponential backoff - wrong credentials are never retried
+        --durations: remember how long each device took in this file, and start the longest ones first in the next runs
+        --asyncio:  run the sessions on a single asyncio event loop - scales to thousands of concurrent sessions with a large --workers value
+        --read-timeout: seconds waited for the prompt after the last data received (default=7), raised for the devices which pause longer
+        --sweep:    check which devices accept TCP connections (all of them concurrently) before connecting: the unreachable ones are skipped
+                    and the measured latency sets the connect timeout of the others
+        --debug:    enable Telnetlib debugging
+
+    '''
+
+    parser = argparse.ArgumentParser(description="Run commands on Cisco devices via Telnet", add_help=False)
+
+    first_arg_group = parser.add_argument_group(title="Devices/Commands")
+    arg_device = first_arg_group.add_mutually_exclusive_group(required=True)
+    arg_device.add_argument("-d", "--device", help="IP address(es) of the device(s) to connect to (separated by commas)")
+    arg_device.add_argument("-D", "--device-list", help="text file containing a list of IP addresses, or CSV file with ip_address, port, credentials and tags columns")
+    first_arg_group.add_argument("--tags", help="only the devices of the CSV inventory with one of these tags (separated by commas)")
+    arg_commands = first_arg_group.add_mutually_exclusive_group(required=True)
+    arg_commands.add_argument("-c", "--commands", help="command(s) to execute on the device (separated by commas)", nargs="*")
+    arg_commands.add_argument("-C", "--command-list", help="text file containing a list of commands to execute")
+    arg_commands.add_argument("--autodeploy", help="load commands from file <ipaddress>_autodeploy.txt for each device", action="store_true")
+    arg_commands.add_argument("--collect", help="instead of running commands, collect the facts and the status of the interfaces of each device to this CSV file, or JSON Lines file (.jsonl), one row per interface")
+    arg_commands.add_argument("--diff", help="instead of running commands, show the differences between two versions (number, or first 7+ characters of the hash) in --backup-store (default=the last two)",
+                              nargs="*", metavar="VERSION")
+
+    second_arg_group = parser.add_argument_group(title="Credentials")
+    second_arg_group.add_argument("-u", "--username")
+    second_arg_group.add_argument("-p", "--password")
+    second_arg_group.add_argument("-e", "--enable-password", help="without a value, ask for it before the processes of --processes start", nargs="?", const="")
+    second_arg_group.add_argument("--credential-sets", help="JSON file of named credential sets ({name: {username, password, enable_password}}) for the credentials column of the CSV inventory")
+    second_arg_group.add_argument("--credential-cache", help="file remembering which username/password and enable password worked for each device (indexes only, never the passwords)")
+    second_arg_group.add_argument("--credential-cache-ttl", help="days after which an entry of the credential cache expires (default=7)", type=float, default=7)
+
+    third_arg_group = parser.add_argument_group(title="Save output")
+    third_arg_group.add_argument("-s", "--save", help="save the output to text file(s)", action="store_true")
+    third_arg_group.add_argument("-O", "--output-directory", help="specify a directory where to save the output to")
+    third_arg_group.add_argument("-S", "--separate-output", help="save the output of each device to a separate file", action="store_true")
+    third_arg_group.add_argument("-z", "--compress", help="gzip the output file(s)", action="store_true")
+    third_arg_group.add_argument("--backup-store", help="also save the output of the show commands to this directory, once per distinct output (see --diff)")
+    third_arg_group.add_argument("--journal", help="record each device and command as soon as they are done to this file, to --resume the run if it is interrupted")
+    third_arg_group.add_argument("--resume", help="skip the devices done according to the --journal of the previous run, retry the failed ones", action="store_true")
+    third_arg_group.add_argument("--metrics", help="save the time spent on each device and command, and a summary, to this JSON Lines file")
+    third_arg_group.add_argument("--prometheus", help="save the summary of the run to this Prometheus textfile collector file (.prom)")
+
+    fourth_arg_group = parser.add_argument_group(title="Options")
+    fourth_arg_group.add_argument("--port", help="Telnet port (default=23)", default="23")
+    fourth_arg_group.add_argument("-n", "--no-enable", help="do not go into enable mode", action="store_true")
+    fourth_arg_group.add_argument("-w", "--workers", help="number of devices to process concurrently (default=1)", type=int, default=1)
+    fourth_arg_group.add_argument("--processes", help="number of worker processes, each running --workers sessions (default=1)", type=int, default=1)
+    fourth_arg_group.add_argument("--group-limit", help="maximum number of concurrent sessions in each group of devices (see --group-by)", type=int)
+    fourth_arg_group.add_argument("--group-by", help="groups of --group-limit: /24 subnet of the devices, or each of their tags in the CSV inventory (default=subnet)",
+                                  choices=["subnet", "tag"], default="subnet")
+    fourth_arg_group.add_argument("--login-rate", help="maximum number of new logins per second", type=float)
+    fourth_arg_group.add_argument("--retries", help="number of times the connection to a device is retried after a network error (default=0)", type=int, default=0)
+    fourth_arg_group.add_argument("--durations", help="file of the time taken by each device in the previous runs, to start the longest ones first (updated by the run)")
+    fourth_arg_group.add_argument("--asyncio", help="run the sessions on an asyncio event loop instead of threads (use with --workers)", action="store_true")
+    fourth_arg_group.add_argument("-b", "--batch", help="pipeline the commands: send them without waiting for the output of the previous ones (each command but the lines of banners must return a prompt)", action="store_true")
+    fourth_arg_group.add_argument("--window", help="maximum number of commands sent ahead in batch mode (default=10)", type=int, default=10)
+    fourth_arg_group.add_argument("--read-timeout", help="seconds of silence of a device after which the output of a command is considered complete, longer for the devices which pause longer (default=7)",
+                                  type=float, default=7)
+    fourth_arg_group.add_argument("--sweep", help="check which devices accept TCP connections, all at once, before connecting to them", action="store_true")
+    fourth_arg_group.add_argument("--sweep-timeout", help="seconds after which a device is unreachable for --sweep (default=2)", type=float, default=2)
+    fourth_arg_group.add_argument("-T", "--table", help="format output as a table with IP address in first column", action="store_true")
+    fourth_arg_group.add_argument("--debug", help="enable Telnet debugging", action="store_true")
+    fourth_arg_group.add_argument("-h", "--help", help="display this message and exit", action="help")
+
+    return parser.parse_args()
+
+
+# A device of the inventory: credentials is the name of a credential set (None for the -u/-p/-e credentials)
+Device = namedtuple("Device", ["ip_address", "port", "credentials", "tags"])
+
+
+def device_key(ip_address, port):
+    '''
+    Return the name of a device in the files kept between runs: its address, followed by its port unless it is the
+    Telnet port
+    '''
+
+    if int(port) == 23:
+        return ip_address
+
+    return "{}:{}".format(ip_address, port)
+
+
+# IPv4 address, CIDR block (10.0.0.0/24) or range of the last byte (10.0.0.1-20), which can end a sentence
+ADDRESS_PATTERN = re.compile(r"(?:\d{1,3}\.){3}\d{1,3}(?:/\d{1,2}|-\d{1,3})?(?!\.?\d)")
+
+# Names of the column of the addresses in a CSV inventory
+ADDRESS_COLUMNS = ("ip_address", "ip", "address", "host")
+
+
+def expand_addresses(token, networks=True):
+    '''
+    Yield the addresses of token: a CIDR block yields its hosts, a.b.c.d-e yields a.b.c.d to a.b.c.e. An address
+    with the prefix length of its subnet (10.0.0.1/24, as in an interface configuration) yields only the address.
+
+    With networks=False, a CIDR block yields nothing: in free text it is a route or a subnet (S 0.0.0.0/0 via...),
+    not a list of devices.
+    '''
+
+    if "/" in token:
+        try:
+            network = ipaddress.ip_network(token)
+        except ValueError:
+            yield token.split("/")[0]
+            return
+        if network.num_addresses > 1 and not networks:
+            return
+        if network.num_addresses == 1:
+            yield str(network.network_address)
+        else:
+            for host in network.hosts():
+                yield str(host)
+    elif ADDRESS_PATTERN.fullmatch(token) and "-" in token:
+        address, last = token.split("-")
+        prefix, first = address.rsplit(".", 1)
+        for i in range(int(first), max(int(first), min(int(last), 255)) + 1):
+            yield "{}.{}".format(prefix, i)
+    else:
+        yield token
+
+
+def read_inventory(filename, port=23):
+    '''
+    Yield the devices of an inventory file as it is read, so that the first devices are processed while the rest
+    of the file is still being read. Lines starting with "!" or "#" are skipped.
+
+    A text file gives every address found in each line (except the masks starting with 255.), and the ranges. The
+    hosts of a CIDR block are only given when it is alone on its line: elsewhere it is a route or a subnet (see
+    expand_addresses()), skipped with a warning.
+    A CSV file has a header line naming its columns: "ip_address" (or "ip", "address", "host") and optionally
+    "port", "credentials" (name of a credential set) and "tags" (separated by ";" or spaces).
+    Its addresses can be CIDR blocks or ranges.
+    '''
+
+    with open(filename, newline="") as f:
+        lines = (line for line in f if line.strip() and not line.startswith("!") and not line.startswith("#"))
+        first = next(lines, None)
+        if first is None:
+            return
+
+        header = [column.strip().lower() for column in next(csv.reader([first]))]
+        address_column = next((column for column in ADDRESS_COLUMNS if column in header), None)
+
+        if address_column is None:
+            for line in chain([first], lines):
+                tokens = ADDRESS_PATTERN.findall(line)
+                alone = len(tokens) == 1 and line.strip() == tokens[0]
+                for token in tokens:
+                    skipped = True
+                    for ip_address in expand_addresses(token, networks=alone):
+                        skipped = False
+                        if not ip_address.startswith("255."):
+                            yield Device(ip_address, port, None, ())
+                    if skipped:
+                        print("[!] {}: skipping {} in '{}' (put a CIDR block alone on its line to run its hosts)".format(filename, token, line.strip()),
+                              file=sys.stderr)
+            return
+
+        for row in csv.DictReader(lines, fieldnames=header):
+            device_port = int((row.get("port") or "").strip() or port)
+            credentials = (row.get("credentials") or "").strip() or None
+            tags = tuple(tag for tag in re.split(r"[;\s]+", row.get("tags") or "") if tag)
+            for ip_address in expand_addresses((row.get(address_column) or "").strip()):
+                if ip_address:
+                    yield Device(ip_address, device_port, credentials, tags)
+
+
+def parse_devices(devices, port=23):
+    '''
+    Yield the devices of the -d argument (separated by commas), which can also be CIDR blocks or ranges
+    '''
+
+    for token in devices.split(","):
+        for ip_address in expand_addresses(token.strip()):
+            yield Device(ip_address, port, None, ())
+
+
+def unique_devices(devices):
+    '''
+    Yield the devices the first time they appear (same address and port)
+    '''
+
+    seen = set()
+    for device in devices:
+        key = (device.ip_address, device.port)
+        if key not in seen:
+            seen.add(key)
+            yield device
+
+
+# Result of the processing of one device by run_device(): status is "ok", "failed", "skipped" or "unreachable", error tells why
+# rows are the interface rows of the device with --collect
+DeviceResult = namedtuple("DeviceResult", ["ip_address", "port", "filename", "output", "status", "error", "metrics", "rows"], defaults=(None,))
+
+# Maximum number of TCP connections opened at the same time by sweep()
+SWEEP_CONCURRENCY = 512
+
+# Devices read ahead of the sessions, among which the Scheduler picks the next one to start
+SCHEDULER_LOOKAHEAD = 1024
+
+# Devices done but not written yet, waiting for an earlier device of the list, after which only that device can start:
+# the large outputs among them are rolled over to temporary files (see hold_result()), which stay few
+SCHEDULER_BACKLOG = 256
+
+# Seconds between two checks of the groups shared with the other processes, when no device of the process can start
+SCHEDULER_POLL = 0.2
+
+# Output of a device run by a worker process of --processes, too large to be passed back as text: it was saved to filename
+SpilledOutput = namedtuple("SpilledOutput", ["filename"])
+
+
+class Scheduler(object):
+    '''
+    Decide when the devices of a run start: at most limit sessions at a time, and at most group_limit at a time in
+    each group of devices (their /24 subnet, or each of their tags with group_by="tag"), to spare the AAA servers and
+    the links of the sites. The first waiting device which can start does, so a busy group doesn't hold up the others.
+
+    New logins are spaced to at most login_rate per second (see login_delay()).
+
+    ready() and finish() are called by the runner, which serializes them.
+
+    shared is a (lock, dict) pair of a multiprocessing.Manager holding the counts of the groups, for the worker
+    processes of --processes: a group then has at most group_limit sessions in all the processes. A device can be
+    held up by the sessions of another process, which don't wake the runner: it calls ready() again every poll seconds.
+    The calls to the manager block, so an event loop runs them on a thread.
+    '''
+
+    def __init__(self, limit, group_limit=None, group_by="subnet", login_rate=None, shared=None):
+        self.limit = limit
+        self.group_limit = group_limit
+        self.group_by = group_by
+        self.login_rate = login_rate
+        self.running = 0
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.next_login = 0
+        self.shared = shared if group_limit else None
+        self.poll = SCHEDULER_POLL if self.shared else None
+
+
+    def groups(self, device):
+        if not self.group_limit:
+            return ()
+        if self.group_by == "tag":
+            return device.tags or ("",)
+        try:
+            return (str(ipaddress.ip_network("{}/24".format(device.ip_address), strict=False)),)
+        except ValueError:
+            # Hostname instead of an IP address
+            return (device.ip_address,)
+
+
+    def ready(self, waiting):
+        '''
+        Remove from waiting (a list of (device, ...) tuples in the order of the list) the ones which can start now,
+        count them as running and return them
+        '''
+
+        started = []
+        if self.shared and (not waiting or self.running >= self.limit):
+            return started
+
+        if self.shared:
+            lock, counts = self.shared
+            lock.acquire()
+            self.counts = Counter(counts.copy())
+        try:
+            i = 0
+            while i < len(waiting) and self.running < self.limit:
+                groups = self.groups(waiting[i][0])
+                if any(self.counts[group] >= self.group_limit for group in groups):
+                    i += 1
+                    continue
+                self.running += 1
+                self.counts.update(groups)
+                started.append(waiting.pop(i))
+        finally:
+            if self.shared:
+                if started:
+                    counts.update(dict((group, self.counts[group]) for device in started for group in self.groups(device[0])))
+                lock.release()
+
+        return started
+
+
+    def finish(self, device):
+        self.running -= 1
+        groups = self.groups(device)
+        if not self.shared:
+            self.counts.subtract(groups)
+            return
+
+        lock, counts = self.shared
+        with lock:
+            counts.update(dict((group, counts.get(group, 0) - groups.count(group)) for group in groups))
+
+
+    def login_delay(self):
+        '''
+        Reserve the next login slot and return the seconds to wait until it (0 without login_rate)
+        '''
+
+        if not self.login_rate:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_login)
+            self.next_login = start + 1 / self.login_rate
+
+        return start - now
+
+
+def ready_devices(scheduler, waiting, results):
+    '''
+    Remove from waiting the devices which can start now and return them (see Scheduler.ready()). results holds the
+    futures of the devices not written yet, in the order of the list.
+
+    Past SCHEDULER_BACKLOG devices done but not written yet, only the first device not written yet can still start,
+    if it is waiting (its group may have been full): the backlog is only written once it is done.
+    '''
+
+    if len(results) - len(waiting) - scheduler.running < SCHEDULER_BACKLOG:
+        return scheduler.ready(waiting)
+
+    if waiting and waiting[0][1] is results[0]:
+        head = waiting[:1]
+        started = scheduler.ready(head)
+        if started:
+            del waiting[0]
+        return started
+
+    return []
+
+
+def is_transient(error):
+    '''
+    Tell if a session failed because of the network (timeout, connection refused or reset, closed by the device...)
+    rather than because of the credentials, so that it is worth retrying
+    '''
+
+    return isinstance(error, (OSError, EOFError, asyncio.TimeoutError)) and not isinstance(error, LoginError)
+
+
+def retry_delay(attempt, base=1, maximum=30):
+    '''
+    Return the seconds to wait before the retry number attempt (1, 2...) of a session: exponential backoff with full
+    jitter, so that the sessions which failed together (overloaded AAA server or link) don't come back together
+    '''
+
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+
+class DurationHistory(object):
+    '''
+    Time taken by each device (see device_key()) in the previous runs (moving average), kept in a JSON file, so that the longest ones
+    can be started first: the run then ends with short devices instead of waiting for a long one started last.
+    '''
+
+    def __init__(self, filename, weight=0.5):
+        self.filename = filename
+        self.weight = weight
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+
+
+    def add(self, ip_address, port, seconds):
+        key = device_key(ip_address, port)
+        previous = self.entries.get(key)
+        if previous is not None:
+            seconds = self.weight * seconds + (1 - self.weight) * previous
+        self.entries[key] = round(seconds, 3)
+
+
+    def order(self, devices):
+        '''
+        Return the list of devices sorted from the longest to the shortest, the unknown ones taking the average time
+        '''
+
+        average = sum(self.entries.values()) / len(self.entries) if self.entries else 0
+
+        return sorted(devices, key=lambda device: self.entries.get(device_key(device.ip_address, device.port), average), reverse=True)
+
+
+    def save(self):
+        '''
+        Write the durations to disk (atomically, like CredentialIndexCache.save())
+        '''
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            json.dump(self.entries, f)
+        os.replace(f.name, self.filename)
+
+
+class RunContext(object):
+    '''
+    State shared by the sessions of all the devices of a run of main()
+    '''
+
+    def __init__(self, args, commands, date_time):
+        self.args = args
+        self.commands = commands
+        self.date_time = date_time
+
+        # Credentials are prompted once and reused for each device
+        self.credentials = CredentialCache(args.username, args.password, args.enable_password)
+
+        # Credentials of the devices of the inventory with a credential set, the missing values are the -u/-p/-e ones
+        self.credential_sets = {}
+        if args.credential_sets:
+            with open(args.credential_sets) as f:
+                for name, values in json.load(f).items():
+                    self.credential_sets[name] = CredentialCache(values.get("username", args.username), values.get("password", args.password),
+                                                                 values.get("enable_password", args.enable_password))
+
+        # Indexes of the credentials that worked last time for each device
+        self.credential_index = None
+        if args.credential_cache:
+            self.credential_index = CredentialIndexCache(args.credential_cache, ttl=args.credential_cache_ttl * 24 * 3600)
+
+        # TCP connect time of each device measured by sweep(), in seconds, by (IP address, port)
+        self.latencies = {}
+
+        self.backup_store = BackupStore(args.backup_store) if args.backup_store else None
+        self.journal = Journal(args.journal, args.resume) if args.journal else None
+
+        self.scheduler = Scheduler(args.workers, args.group_limit, args.group_by, args.login_rate)
+        self.durations = DurationHistory(args.durations) if args.durations else None
+
+
+    def device_credentials(self, device):
+        '''
+        Return the CredentialCache of a device
+        '''
+
+        if device.credentials is None:
+            return self.credentials
+        if device.credentials not in self.credential_sets:
+            raise KeyError("unknown credential set {}".format(device.credentials))
+
+        return self.credential_sets[device.credentials]
+
+
+    def timeouts(self, ip_address, port):
+        '''
+        Return the connect timeout for the session of a device, shorter when its latency was measured by the sweep,
+        and its AdaptiveTimeout, starting at --read-timeout
+
+        The connect latency says nothing about how long the commands take: it doesn't seed the read timeout.
+        '''
+
+        read_timeout = AdaptiveTimeout(minimum=self.args.read_timeout)
+        latency = self.latencies.get((ip_address, port))
+        if latency is None:
+            return 4, read_timeout
+
+        return min(4, max(1, 10 * latency)), read_timeout
+
+
+    def close(self):
+        '''
+        Save what has to be kept for the next runs
+        '''
+
+        if self.credential_index:
+            self.credential_index.save()
+        if self.durations:
+            self.durations.save()
+        if self.journal:
+            self.journal.close()
+
+
+class Journal(object):
+    '''
+    Append-only JSON Lines file recording each command and each device as soon as they are done, synced to disk
+    (fsync) so that it survives a crash or an interrupted run. A device is recorded once its output is saved or
+    printed, with its status, output file and duration.
+
+    With resume, the journal of the previous run is kept and the devices it records as "ok" are in self.done, so
+    that only the other devices are run again: failed, pending, and skipped (their autodeploy file may have been
+    added since).
+
+    Without filename, the records are kept in self.records: a worker process of --processes returns them to the
+    main process, which writes them to its journal.
+    '''
+
+    def __init__(self, filename, resume=False):
+        self.done = set()
+        self.lock = threading.Lock()
+        self.file = None
+        self.records = []
+        if filename is None:
+            return
+        line = "\n"
+
+        if resume and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Last record of a run which died while writing it
+                        continue
+                    if record.get("type") == "device":
+                        key = (record["ip_address"], record["port"])
+                        if record["status"] == "ok":
+                            self.done.add(key)
+                        else:
+                            self.done.discard(key)
+
+        self.file = open(filename, "a" if resume else "w")
+        if not line.endswith("\n"):
+            # Don't append to a truncated last record
+            self.file.write("\n")
+
+
+    def write(self, *records):
+        now = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        for record in records:
+            record.setdefault("time", now)
+        with self.lock:
+            if self.file is None:
+                self.records.extend(records)
+                return
+            self.file.write("".join(json.dumps(record) + "\n" for record in records))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+
+    def command(self, device, command, complete, seconds):
+        '''
+        Record that a command is done on a device (complete is False if its prompt was not found)
+        '''
+
+        self.write({"type": "command", "ip_address": device.ip_address, "port": device.port, "command": command,
+                    "status": "ok" if complete else "incomplete", "seconds": round(seconds, 6)})
+
+
+    def device(self, ip_address, port, status, error=None, filename=None, seconds=None):
+        '''
+        Record that a device is done
+        '''
+
+        self.write({"type": "device", "ip_address": ip_address, "port": port, "status": status, "error": error, "filename": filename,
+                    "seconds": round(seconds, 6) if seconds is not None else None})
+
+
+    def pending(self, devices):
+        '''
+        Yield the devices which are not done
+        '''
+
+        for device in devices:
+            if (device.ip_address, device.port) not in self.done:
+                yield device
+
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class RunSummary(object):
+    '''
+    Count the devices of a run by status and remember why the others than "ok" failed
+    '''
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counts = OrderedDict((status, 0) for status in ("ok", "failed", "skipped", "unreachable"))
+        self.errors = []
+
+
+    def add(self, ip_address, status, error=None):
+        '''
+        Count a device, with the reason why it wasn't processed
+        '''
+
+        self.counts[status] += 1
+        if status != "ok":
+            self.errors.append((ip_address, status, error))
+
+
+    def print(self, backup_store=None):
+        '''
+        Print the counts and the devices which failed
+        '''
+
+        total = sum(self.counts.values())
+        counts = ", ".join("{} {}".format(count, status) for status, count in self.counts.items())
+        print("[+] Summary: {} device(s) in {:.1f}s - {}".format(total, time.monotonic() - self.start, counts))
+        if backup_store:
+            print("[+] Backups: {} new version(s), {} unchanged".format(backup_store.new, backup_store.unchanged))
+            if backup_store.rejected:
+                print("[!] Backups: {} empty or out of sync output(s) not saved".format(backup_store.rejected))
+        for ip_address, status, error in self.errors:
+            print("[!] {} {}: {}".format(ip_address, status, error))
+
+
+class RunMetrics(object):
+    '''
+    Write the DeviceMetrics of each device of a run to a JSON Lines file as the results come in: one "device" record
+    with the time spent in each phase, then one "command" record per command. A "summary" record is written at the
+    end, with the percentiles of the command latencies, the throughput and the slowest devices.
+
+    The summary can also be written to a Prometheus textfile (for the node_exporter textfile collector), to follow
+    the login times (slow TACACS servers...) and command latencies across scheduled runs.
+    '''
+
+    def __init__(self, filename=None, prometheus=None, slowest=10):
+        self.file = open(filename, "w") if filename else None
+        self.prometheus = prometheus
+        self.slowest = slowest
+        self.start = time.monotonic()
+        self.devices = []
+        self.latencies = []
+        self.bytes_received = 0
+
+
+    def write(self, record):
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+
+
+    def add(self, ip_address, status, error=None, metrics=None, hostname=""):
+        '''
+        Record the metrics of a device
+        '''
+
+        device = {"type": "device", "ip_address": ip_address, "hostname": hostname, "status": status, "error": error}
+        if metrics:
+            device.update({"when": metrics.when, "seconds": round(metrics.elapsed, 6), "bytes": metrics.bytes_received,
+                           "phases": dict((name, round(seconds, 6)) for name, seconds in metrics.phases.items()),
+                           "commands": len(metrics.commands)})
+            self.bytes_received += metrics.bytes_received
+        self.devices.append(device)
+        self.write(device)
+
+        for command in (metrics.commands if metrics else []):
+            record = {"type": "command", "ip_address": ip_address, "hostname": hostname}
+            record.update(command)
+            record["seconds"] = round(command["seconds"], 6)
+            self.latencies.append(record["seconds"])
+            self.write(record)
+
+
+    def summary(self, counts):
+        '''
+        Return the summary record of the run, counts is the number of devices per status
+        '''
+
+        elapsed = time.monotonic() - self.start
+        timed = [device for device in self.devices if "seconds" in device]
+        slowest = sorted(timed, key=lambda device: device["seconds"], reverse=True)[:self.slowest]
+        phases = OrderedDict()
+        for device in timed:
+            for name, seconds in device["phases"].items():
+                phases.setdefault(name, []).append(seconds)
+
+        return {
+            "type": "summary",
+            "when": datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S"),
+            "seconds": round(elapsed, 6),
+            "devices": dict(counts),
+            "commands": len(self.latencies),
+            "latency": dict((name, percentile(self.latencies, p)) for name, p in (("p50", 50), ("p95", 95), ("p99", 99))),
+            "phases": dict((name, {"p50": percentile(values, 50), "p95": percentile(values, 95)}) for name, values in phases.items()),
+            "bytes": self.bytes_received,
+            "bytes_per_second": round(self.bytes_received / elapsed, 1) if elapsed else None,
+            "slowest_devices": [dict((key, device[key]) for key in ("ip_address", "hostname", "seconds", "phases")) for device in slowest],
+        }
+
+
+    def write_prometheus(self, summary):
+        '''
+        Write the summary and the timings of each device in the Prometheus text format (atomically, as the textfile
+        collector may read it at any time)
+        '''
+
+        def labels(**values):
+            return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                                  for key, value in values.items()) + "}"
+
+        lines = [
+            "# HELP pisco_run_timestamp_seconds Time of the end of the last run",
+            "# TYPE pisco_run_timestamp_seconds gauge",
+            "pisco_run_timestamp_seconds {:.3f}".format(time.time()),
+            "# HELP pisco_run_duration_seconds Duration of the last run",
+            "# TYPE pisco_run_duration_seconds gauge",
+            "pisco_run_duration_seconds {}".format(summary["seconds"]),
+            "# HELP pisco_run_devices Number of devices of the last run per status",
+            "# TYPE pisco_run_devices gauge",
+        ]
+        lines += ["pisco_run_devices{} {}".format(labels(status=status), count) for status, count in summary["devices"].items()]
+        lines += [
+            "# HELP pisco_run_bytes_received Bytes received from the devices during the last run",
+            "# TYPE pisco_run_bytes_received gauge",
+            "pisco_run_bytes_received {}".format(summary["bytes"]),
+            "# HELP pisco_command_latency_seconds Time to receive the output of the commands of the last run",
+            "# TYPE pisco_command_latency_seconds summary",
+        ]
+        lines += ["pisco_command_latency_seconds{} {}".format(labels(quantile=quantile), summary["latency"][name])
+                  for name, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")) if summary["latency"][name] is not None]
+        lines += [
+            "pisco_command_latency_seconds_sum {}".format(round(sum(self.latencies), 6)),
+            "pisco_command_latency_seconds_count {}".format(len(self.latencies)),
+            "# HELP pisco_device_up Whether the commands ran on the device during the last run",
+            "# TYPE pisco_device_up gauge",
+        ]
+        lines += ["pisco_device_up{} {}".format(labels(ip_address=device["ip_address"], hostname=device["hostname"]), int(device["status"] == "ok"))
+                  for device in self.devices]
+        lines += [
+            "# HELP pisco_device_phase_seconds Time spent by the session of the device in each phase during the last run",
+            "# TYPE pisco_device_phase_seconds gauge",
+        ]
+        lines += ["pisco_device_phase_seconds{} {}".format(labels(ip_address=device["ip_address"], hostname=device["hostname"], phase=name), seconds)
+                  for device in self.devices for name, seconds in device.get("phases", {}).items()]
+
+        directory = os.path.dirname(os.path.abspath(self.prometheus))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, self.prometheus)
+
+
+    def close(self, counts):
+        '''
+        Write the summary and close the file
+        '''
+
+        summary = self.summary(counts)
+        self.write(summary)
+        if self.file:
+            self.file.close()
+        if self.prometheus:
+            self.write_prometheus(summary)
+
+
+async def probe(host, port, timeout):
+    '''
+    Open a TCP connection to host and return the time it took, in seconds
+    '''
+
+    start = time.monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+    latency = time.monotonic() - start
+    writer.close()
+
+    return latency
+
+
+async def sweep_async(devices, timeout, concurrency=SWEEP_CONCURRENCY):
+    '''
+    Probe all the devices concurrently and return a dict of their connect times and a dict of the reasons why the
+    others are unreachable, by (IP address, port): another port of the same address can be up
+    '''
+
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    latencies = {}
+    unreachable = {}
+
+    async def check(device):
+        key = (device.ip_address, device.port)
+        async with semaphore:
+            try:
+                latencies[key] = await probe(device.ip_address, int(device.port), timeout)
+            except asyncio.TimeoutError:
+                unreachable[key] = "no answer on port {} after {}s".format(device.port, timeout)
+            except OSError as e:
+                unreachable[key] = os.strerror(e.errno) if e.errno else str(e)
+
+    await asyncio.gather(*(check(device) for device in devices))
+
+    return latencies, unreachable
+
+
+def sweep(devices, timeout):
+    '''
+    Check which devices accept TCP connections on their port before any Telnet session is opened, so that the
+    unreachable ones fail in timeout seconds all at once instead of each holding a worker for the connect timeout
+    '''
+
+    return asyncio.run(sweep_async(devices, timeout))
+
+
+def get_output_filename(args, ip_address, hostname, username, date_time):
+    '''
+    Return the name of the file where the output of a device is saved (creating its directory if needed), or None when not saving
+    '''
+
+    if not args.save:
+        return None
+
+    if args.output_directory:
+        save_dir = args.output_directory.format(date_time=date_time, ip_address=ip_address, hostname=hostname, username=username)
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+    else:
+        save_dir = os.getcwd()
+    if args.separate_output:
+        filename = os.path.join(save_dir, "pisco_output_{}_{}_{}.txt".format(hostname, ip_address, date_time))
+    else:
+        filename = os.path.join(save_dir, "pisco_output_{}.txt".format(date_time))
+    if args.compress:
+        filename += ".gz"
+
+    return filename
+
+
+def open_output_file(filename):
+    '''
+    Open an output file for appending, gzip compressed if its name ends with .gz
+    '''
+
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "at")
+    return open(filename, "a")
+
+
+def load_autodeploy_commands(ip_address):
+    '''
+    Return the commands from the <ipaddress>_autodeploy.txt file, or None if there is no such file
+    '''
+
+    filename = "{}_autodeploy.txt".format(ip_address)
+    if not os.path.exists(filename):
+        print("[!] No autodeploy file found. Skipping device.", file=sys.stderr)
+        return None
+    with open(filename, "r") as f:
+        return [ line.rstrip() for line in f.readlines() if line.strip() ]
+
+
+def print_response(args, device, command, response, output):
+    '''
+    Format the response of a command and print it to output
+    '''
+
+    # Clean up the output a little bit by removing the first and last lines (IOS prompts)
+    if len(response.splitlines()) > 1:
+        response = response.splitlines()
+        response.pop(0)
+        response.pop(-1)
+        response = "\n".join(response)
+    if args.table:
+        print("{}\t{}\t{}".format(device.host, device.hostname, response.replace("\n", "").replace("\r", "")), file=output)
+    else:
+        print("\n[{}] {} ({}): Output of command '{}'\n{}\n".format(device.when, device.host, device.hostname, command, response), file=output)
+
+
+def get_response_sink(args, device, output, backup_store=None):
+    '''
+    Return the sink for TelnetDevice.send_commands(): print the header of the output of each command and stream the output itself to output
+    (and to backup_store for the show commands)
+
+    Table mode needs the whole response to format it, so it doesn't stream (returns None).
+    '''
+
+    if args.table:
+        return None
+
+    def sink(command):
+        print("\n[{}] {} ({}): Output of command '{}'".format(device.when, device.host, device.hostname, command), file=output)
+        copy = None
+        if backup_store and SHOW_COMMAND_PATTERN.match(command):
+            copy = backup_store.writer(device, command)
+        return ResponseWriter(output, copy)
+
+    return sink
+
+
+def backup_response(backup_store, device, command, response):
+    '''
+    Add the response of a show command to backup_store, when it was not streamed (table mode)
+    '''
+
+    if backup_store and SHOW_COMMAND_PATTERN.match(command):
+        writer = backup_store.writer(device, command)
+        writer.echo(response.splitlines()[0] if response else "")
+        writer.write("\n".join(response.splitlines()[1:-1]))
+        writer.close()
+
+
+def open_device_output(filename, separate_output):
+    '''
+    Return the file object the output of a device is written to while it runs.
+
+    A device with its own file writes to it directly. Otherwise the output is spooled (in memory, then in a temporary
+    file when it gets large) until main() copies it to the shared file or stdout, in the order of the device list.
+    '''
+
+    if filename and separate_output:
+        return open_output_file(filename)
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+")
+
+
+def close_device_output(device, filename, output, status="ok", error=None, metrics=None):
+    '''
+    Close the output of a device and return its DeviceResult: the spooled output is handed over to write_result()
+    '''
+
+    if isinstance(output, tempfile.SpooledTemporaryFile):
+        output.seek(0)
+        return DeviceResult(device.ip_address, device.port, filename, output, status, error, metrics)
+    output.close()
+    return DeviceResult(device.ip_address, device.port, filename, None, status, error, metrics)
+
+
+def hold_result(result):
+    '''
+    Roll the spooled output of a result which has to wait for the results of earlier devices over to a temporary file
+    when it is larger than HELD_SPOOL_SIZE, so that the results held up by a slow device don't pile up in memory
+    '''
+
+    output = result.output
+    if isinstance(output, tempfile.SpooledTemporaryFile):
+        if output.seek(0, io.SEEK_END) > HELD_SPOOL_SIZE:
+            output.rollover()
+        output.seek(0)
+    return result
+
+
+def device_steps(device, context):
+    '''
+    Connect to a device, run the commands and return a DeviceResult.
+
+    It is a generator of the requests of DeviceProtocol (see run_device() and run_device_async()), plus ("sleep", seconds)
+    and ("connect", kwargs), which connects and logs into the device with the keyword arguments of TelnetDevice and
+    returns the session.
+
+    The output is streamed to the device's file, or spooled so that concurrent sessions never interleave in the output file or stdout.
+    '''
+
+    args = context.args
+    commands = context.commands
+    ip_address = device.ip_address
+    connect_timeout, read_timeout = context.timeouts(ip_address, device.port)
+    metrics = DeviceMetrics()
+
+    # Network errors are retried args.retries times, never the wrong credentials
+    attempt = 0
+    while True:
+        delay = context.scheduler.login_delay()
+        if delay:
+            metrics.add_phase("wait", delay)
+            yield ("sleep", delay)
+        try:
+            telnet = yield ("connect", dict(host=ip_address, port=device.port, debug=args.debug, quiet=args.table, credentials=context.device_credentials(device),
+                                            credential_index=context.credential_index, connect_timeout=connect_timeout, read_timeout=read_timeout, metrics=metrics))
+            break
+        except Exception as e:
+            if attempt < args.retries and is_transient(e):
+                attempt += 1
+                delay = retry_delay(attempt)
+                print("[!] Error while connecting to {}: {} - retry {} in {:.1f}s".format(ip_address, str(e) or type(e).__name__, attempt, delay), file=sys.stderr)
+                metrics.add_phase("wait", delay)
+                yield ("sleep", delay)
+                continue
+            print("[!] Error while connecting to {}".format(ip_address), file=sys.stderr)
+            print(str(e), file=sys.stderr)
+            metrics.stop()
+            return DeviceResult(ip_address, device.port, None, None, "failed", str(e) or type(e).__name__, metrics)
+
+    filename = None
+    output = None
+    status = "ok"
+    error = None
+
+    try:
+        yield from telnet.prepare_steps(not args.no_enable)
+
+        if args.collect:
+            with metrics.phase("collect"):
+                rows = yield from telnet.get_interface_rows_steps()
+            return DeviceResult(ip_address, device.port, None, None, "ok", None, metrics, rows)
+
+        if args.autodeploy:
+            commands = load_autodeploy_commands(ip_address)
+            if commands is None:
+                return DeviceResult(ip_address, device.port, None, None, "skipped", "no autodeploy file", metrics)
+
+        filename = get_output_filename(args, ip_address, telnet.hostname, telnet.username, context.date_time)
+        output = open_device_output(filename, args.separate_output)
+
+        # In batch mode, up to args.window commands are pipelined
+        window = args.window if args.batch else 1
+        pipeline = CommandPipeline(telnet, commands, window, get_response_sink(args, telnet, output, context.backup_store))
+        start = time.monotonic()
+        incomplete = []
+        while True:
+            result = yield from pipeline.next_steps()
+            if result is None:
+                break
+            c, response = result
+            if args.table:
+                backup_response(context.backup_store, telnet, c, response)
+                print_response(args, telnet, c, response, output)
+            else:
+                output.write("\n\n")
+            if not telnet.prompt_found:
+                incomplete.append(c)
+            if context.journal:
+                context.journal.command(device, c, telnet.prompt_found, time.monotonic() - start)
+            start = time.monotonic()
+        # The device is not done: --resume runs it again
+        if incomplete:
+            status = "failed"
+            error = "incomplete output of {}".format(", ".join("'{}'".format(c) for c in incomplete))
+    except Exception as e:
+        print("[!] Error while running commands on {}".format(ip_address), file=sys.stderr)
+        print(str(e), file=sys.stderr)
+        status = "failed"
+        error = str(e) or type(e).__name__
+    finally:
+        telnet.close()
+        metrics.hostname = telnet.hostname
+        metrics.stop()
+
+    if output is None:
+        return DeviceResult(ip_address, device.port, None, None, status, error, metrics)
+    return close_device_output(device, filename, output, status, error, metrics)
+
+
+def run_device(device, context):
+    '''
+    Run device_steps() with a TelnetDevice session
+    '''
+
+    telnet = None
+
+    def perform(request):
+        nonlocal telnet
+        if request[0] == "sleep":
+            time.sleep(request[1])
+        elif request[0] == "connect":
+            telnet = TelnetDevice(**request[1])
+            return telnet
+        else:
+            return telnet.perform(request)
+
+    return run_steps(device_steps(device, context), perform)
+
+
+async def run_device_async(device, context):
+    '''
+    Run device_steps() with an AsyncTelnetDevice session
+    '''
+
+    telnet = None
+
+    async def perform(request):
+        nonlocal telnet
+        if request[0] == "sleep":
+            await asyncio.sleep(request[1])
+        elif request[0] == "connect":
+            telnet = await AsyncTelnetDevice.connect(**request[1])
+            return telnet
+        else:
+            return await telnet.perform(request)
+
+    return await run_steps_async(device_steps(device, context), perform)
+
+
+async def run_devices_async(devices, context, write_result):
+    '''
+    Run all the devices on one event loop, starting them as context.scheduler allows, and pass the results to
+    write_result() in the order of the list
+
+    devices can be a generator reading the inventory: the sessions start while it is still being read.
+    '''
+
+    scheduler = context.scheduler
+    devices = iter(devices)
+    loop = asyncio.get_running_loop()
+    waiting = []
+    results = deque()
+    tasks = set()
+    wake = asyncio.Event()
+    # The groups shared with the other processes are counted by a manager, whose calls would block the loop: they
+    # run on one thread, which also serializes them
+    executor = ThreadPoolExecutor(max_workers=1) if scheduler.shared else None
+
+    async def call(function, *args):
+        if executor is None:
+            return function(*args)
+        return await loop.run_in_executor(executor, function, *args)
+
+    async def process(device, future):
+        try:
+            result = await run_device_async(device, context)
+            if results[0] is not future:
+                result = hold_result(result)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            await call(scheduler.finish, device)
+            wake.set()
+
+    try:
+        while True:
+            for i in range(SCHEDULER_LOOKAHEAD - len(waiting)):
+                device = next(devices, None)
+                if device is None:
+                    break
+                future = loop.create_future()
+                waiting.append((device, future))
+                results.append(future)
+                # Let the sessions run while reading a large inventory
+                if i % 100 == 99:
+                    await asyncio.sleep(0)
+            for device, future in await call(ready_devices, scheduler, waiting, results):
+                task = asyncio.ensure_future(process(device, future))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if not results:
+                break
+            if results[0].done():
+                write_result(results.popleft().result())
+            else:
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), scheduler.poll)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for task in list(tasks):
+            task.cancel()
+        if executor:
+            executor.shutdown(wait=False)
+
+
+async def collect_fleet_async(devices, dataset, credentials, workers=64, enable=True, **kwargs):
+    '''
+    Collect the interface rows of devices (see collect_fleet()) on one event loop, at most workers sessions at a time,
+    and write them to the DatasetWriter as each device is done. Return a RunSummary.
+
+    kwargs are passed to AsyncTelnetDevice (credential_index, result_cache...).
+    '''
+
+    semaphore = asyncio.BoundedSemaphore(workers)
+    summary = RunSummary()
+
+    async def process(device):
+        async with semaphore:
+            try:
+                telnet = await AsyncTelnetDevice.connect(device.ip_address, port=device.port, quiet=True, credentials=credentials, **kwargs)
+            except Exception as e:
+                summary.add(device.ip_address, "failed", str(e) or type(e).__name__)
+                return
+            try:
+                await telnet.prepare(enable)
+                dataset.write(await telnet.get_interface_rows())
+                summary.add(device.ip_address, "ok")
+            except Exception as e:
+                summary.add(device.ip_address, "failed", str(e) or type(e).__name__)
+            finally:
+                telnet.close()
+
+    await asyncio.gather(*(process(device) for device in devices))
+
+    return summary
+
+
+def collect_fleet(devices, filename, username=None, password=None, enable_password=None, port=23, workers=64, enable=True, **kwargs):
+    '''
+    Collect the facts and the status of the interfaces of many devices in parallel into filename, one row per device
+    and interface (INTERFACE_COLUMNS), a CSV file or a JSON Lines file (.jsonl) ready for pandas. Return a RunSummary.
+
+    devices is a string of IP addresses, CIDR blocks and ranges (see parse_devices()) or a list of Device.
+
+    Usage:
+        summary = pisco.collect_fleet("10.0.0.0/24", "interfaces.csv", username="admin", password="cisco")
+        df = pandas.read_csv("interfaces.csv")
+    '''
+
+    if isinstance(devices, str):
+        devices = unique_devices(parse_devices(devices, port))
+    credentials = CredentialCache(username, password, enable_password)
+    dataset = DatasetWriter(filename)
+    try:
+        return asyncio.run(collect_fleet_async(devices, dataset, credentials, workers, enable, **kwargs))
+    finally:
+        dataset.close()
+
+
+def run_devices(devices, context, write_result):
+    '''
+    Run the devices, args.workers sessions at a time on threads or on an asyncio event loop, and pass the results to
+    write_result() in the order of the list
+    '''
+
+    args = context.args
+    if args.asyncio or telnetlib is None:
+        asyncio.run(run_devices_async(devices, context, write_result))
+        return
+
+    scheduler = context.scheduler
+    devices = iter(devices)
+    condition = threading.Condition()
+    waiting = []
+    results = deque()
+
+    def process(device, future):
+        try:
+            result = run_device(device, context)
+            with condition:
+                held = results[0] is not future
+            future.set_result(hold_result(result) if held else result)
+        except BaseException as e:
+            future.set_exception(e)
+        with condition:
+            scheduler.finish(device)
+            condition.notify()
+
+    # Connect to each device via Telnet, run the commands, then print or save the output in the order of the device list
+    # (the devices are submitted to the workers as the inventory is read)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        while True:
+            with condition:
+                while len(waiting) < SCHEDULER_LOOKAHEAD:
+                    device = next(devices, None)
+                    if device is None:
+                        break
+                    future = Future()
+                    waiting.append((device, future))
+                    results.append(future)
+                for device, future in ready_devices(scheduler, waiting, results):
+                    executor.submit(process, device, future)
+
+                if not results:
+                    break
+                if not results[0].done():
+                    condition.wait(scheduler.poll)
+                    continue
+            write_result(results.popleft().result())
+    finally:
+        executor.shutdown(wait=False)
+
+
+def detach_output(result):
+    '''
+    Return the DeviceResult of a worker process of --processes with its spooled output replaced by its text, or by a
+    SpilledOutput when it is large, so that it can be passed to the main process
+    '''
+
+    if result.output is None:
+        return result
+
+    with result.output:
+        text = result.output.read(SPOOL_SIZE)
+        if len(text) < SPOOL_SIZE:
+            return result._replace(output=text)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write(text)
+            shutil.copyfileobj(result.output, f)
+
+    return result._replace(output=SpilledOutput(f.name))
+
+
+def attach_output(result):
+    '''
+    Return the DeviceResult passed by a worker process of --processes with its output spooled again, for write_result()
+    '''
+
+    if result.output is None:
+        return result
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+")
+    if isinstance(result.output, SpilledOutput):
+        with open(result.output.filename) as f:
+            shutil.copyfileobj(f, output)
+        os.remove(result.output.filename)
+    else:
+        output.write(result.output)
+    output.seek(0)
+
+    return result._replace(output=output)
+
+
+def run_shard(args, commands, date_time, latencies, devices, shared=None, credential_sets=None):
+    '''
+    Run a shard of the devices in a worker process of --processes, with args.workers sessions at a time, and return
+    their results in order, with what the main process has to keep: the credential indexes learned, the backup counts
+    and the journal records of the commands
+
+    shared holds the counts of the groups of --group-limit of all the processes (see Scheduler), and credential_sets
+    the (username, password, enable password) of each credential set, resolved by the main process.
+    '''
+
+    context = RunContext(args, commands, date_time)
+    # Nothing can be asked in a worker process
+    context.credentials.interactive = False
+    context.credential_sets = dict((name, CredentialCache(*values, interactive=False)) for name, values in (credential_sets or {}).items())
+    context.latencies = latencies
+    context.scheduler = Scheduler(args.workers, args.group_limit, args.group_by, args.login_rate, shared)
+    context.journal = Journal(None)
+    results = []
+    run_devices(devices, context, lambda result: results.append(detach_output(result)))
+
+    entries = context.credential_index.entries if context.credential_index else {}
+    backups = (context.backup_store.new, context.backup_store.unchanged, context.backup_store.rejected) if context.backup_store else (0, 0, 0)
+
+    return results, entries, backups, context.journal.records
+
+
+def shards(devices, size):
+    '''
+    Split devices (a list or a generator reading the inventory) into lists of size devices
+    '''
+
+    shard = []
+    for device in devices:
+        shard.append(device)
+        if len(shard) == size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def run_devices_sharded(devices, context, write_result):
+    '''
+    Split the devices between args.processes worker processes, each running args.workers sessions at a time, so that
+    decoding and parsing the outputs use all the CPU cores instead of one. The results are passed to write_result() in
+    the order of the list, as with run_devices().
+
+    The devices are sent in shards of a few rounds of args.workers devices, at most two per process at a time, so a
+    large inventory is read as it is processed and the results waiting for an earlier shard stay few.
+
+    If a worker process dies, the pool stops all of its processes: the devices of the shards which were not done are
+    failed (--resume runs them again), and the next shards go to new processes, with new counts of the groups (the
+    sessions counted are gone, and the lock may have died with its holder).
+    '''
+
+    args = context.args
+    credentials = context.credentials
+
+    # The worker processes can't prompt for the credentials: the username and password are asked now, the enable
+    # password only if -e is given without a value (many devices log in straight into enable mode), otherwise the
+    # devices which need it fail
+    credentials.get("username", lambda: input("Username: "))
+    credentials.get("password", getpass.getpass)
+    if args.enable_password == "" and not args.no_enable:
+        credentials.get("enable_password", lambda: getpass.getpass(prompt="Enable password: "))
+
+    # The values missing from the credential sets are the ones of -u/-p/-e
+    credential_sets = dict((name, (cache.username or credentials.username, cache.password or credentials.password,
+                                   cache.enable_password or credentials.enable_password))
+                           for name, cache in context.credential_sets.items())
+
+    # The journal (with the records of the commands returned by the workers) and the durations are written by the
+    # main process only, as it gets the results, and the login rate is split between the processes
+    shard_args = argparse.Namespace(**dict(vars(args), username=credentials.username, password=credentials.password,
+                                           enable_password=credentials.enable_password, credential_sets=None, journal=None, resume=False,
+                                           processes=1, durations=None, login_rate=args.login_rate and args.login_rate / args.processes))
+
+    # The sessions of each group are counted across the processes, so that each group has at most --group-limit sessions
+    manager = None
+    shared = None
+    if args.group_limit:
+        manager = multiprocessing.Manager()
+        shared = (manager.Lock(), manager.dict())
+
+    def merge(future, shard):
+        try:
+            results, entries, (new, unchanged, rejected), records = future.result()
+        except BrokenProcessPool as e:
+            print("[!] A worker process died, {} device(s) not done".format(len(shard)), file=sys.stderr)
+            for device in shard:
+                write_result(DeviceResult(device.ip_address, device.port, None, None, "failed", str(e) or type(e).__name__, None))
+            return
+        if context.credential_index:
+            context.credential_index.merge(entries)
+        if context.backup_store:
+            context.backup_store.new += new
+            context.backup_store.unchanged += unchanged
+            context.backup_store.rejected += rejected
+        # Before the records of the devices, written as their results
+        if context.journal and records:
+            context.journal.write(*records)
+        for result in results:
+            write_result(attach_output(result))
+
+    executor = ProcessPoolExecutor(max_workers=args.processes)
+    futures = deque()
+    try:
+        for shard in shards(devices, 4 * args.workers):
+            latencies = dict(((device.ip_address, device.port), context.latencies[(device.ip_address, device.port)]) for device in shard
+                             if (device.ip_address, device.port) in context.latencies)
+            try:
+                future = executor.submit(run_shard, shard_args, context.commands, context.date_time, latencies, shard, shared, credential_sets)
+            except BrokenProcessPool:
+                # The shards submitted to the dead processes fail as they are merged
+                executor.shutdown(wait=True)
+                executor = ProcessPoolExecutor(max_workers=args.processes)
+                if manager:
+                    shared = (manager.Lock(), manager.dict())
+                future = executor.submit(run_shard, shard_args, context.commands, context.date_time, latencies, shard, shared, credential_sets)
+            futures.append((future, shard))
+            if len(futures) >= 2 * args.processes:
+                merge(*futures.popleft())
+        while futures:
+            merge(*futures.popleft())
+    finally:
+        # Only the shards already running are waited for
+        for future, shard in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if manager:
+            manager.shutdown()
+
+
+def print_diffs(backup_store, devices, versions):
+    '''
+    Print the differences between two versions of the outputs of each device in backup_store
+    '''
+
+    # By default the last two versions, or the given version and the last one
+    old, new = "-2", "-1"
+    if len(versions) == 1:
+        old = versions[0]
+    elif len(versions) > 1:
+        old, new = versions[:2]
+    for ip_address, port in ((device.ip_address, device.port) for device in devices):
+        index = backup_store.index(ip_address, port)
+        if not index:
+            print("[!] No backup of {}".format(ip_address))
+        for command in index:
+            try:
+                diff = backup_store.diff(ip_address, port, command, old, new)
+            except KeyError as e:
+                print("[!] {} {}: {}".format(ip_address, command, e.args[0]))
+                continue
+            if diff:
+                sys.stdout.writelines(diff)
+            else:
+                print("[+] {} {}: no differences".format(ip_address, command))
+
+
+def write_result(result):
+    '''
+    Copy the spooled output of a device to the shared output file or stdout
+
+    The sessions still running write their messages to stderr, so they don't land inside the output on stdout.
+    '''
+
+    if result.output is None:
+        if result.filename:
+            print("[+] Output of {} saved to {}\n".format(result.ip_address, result.filename))
+        return
+
+    try:
+        if result.filename:
+            print("[+] Saving output of {} to {}...".format(result.ip_address, result.filename), end="")
+            with open_output_file(result.filename) as output_file_object:
+                shutil.copyfileobj(result.output, output_file_object)
+            print(" Done\n")
+        else:
+            shutil.copyfileobj(result.output, sys.stdout)
+    finally:
+        result.output.close()
+
+
+def main():
+    '''
+    Pisco.py Main program
+
+    '''
+    args = parse_arguments()
+    
+    # Unique devices from the inventory file or arguments, read as they are processed
+    if args.device_list:
+        devices = unique_devices(read_inventory(args.device_list, int(args.port)))
+    else:
+        devices = unique_devices(parse_devices(args.device, int(args.port)))
+    if args.tags:
+        tags = set(args.tags.split(","))
+        devices = (device for device in devices if tags.intersection(device.tags))
+
+    if args.diff is not None:
+        if not args.backup_store:
+            print("[!] --diff needs --backup-store")
+            sys.exit(1)
+        print_diffs(BackupStore(args.backup_store), devices, args.diff)
+        sys.exit(0)
+
+    # Get command(s) to execute from text file or arguments
+    if args.command_list:
+        with open(args.command_list, "r") as f:
+            commands = [ line.rstrip() for line in f.readlines() if line.strip() ]
+    elif args.autodeploy or args.collect:
+        # The commands are loaded for each device by run_device(), or replaced by the collection of the interfaces
+        commands = None
+    else:
+        # Join parts of the command together, else we'll end up with each word as a separate command
+        # Specify multiple commands by using a comma
+        commands = " ".join(args.commands).split(",")
+
+    # Timestamping for filename
+    date_time = datetime.strftime(datetime.now(), "%Y-%m-%d_%Hh%Mm%S")
+
+    if args.resume and not args.journal:
+        print("[!] --resume needs --journal")
+        sys.exit(1)
+
+    context = RunContext(args, commands, date_time)
+    summary = RunSummary()
+    metrics = None
+    if args.metrics or args.prometheus:
+        metrics = RunMetrics(args.metrics, args.prometheus)
+    # The rows of the devices done by the previous run are kept
+    dataset = DatasetWriter(args.collect, append=args.resume) if args.collect else None
+
+    # Skip the devices done by the previous run
+    if args.resume:
+        print("[+] Resuming: {} device(s) already done are skipped".format(len(context.journal.done)), file=sys.stderr)
+        devices = context.journal.pending(devices)
+
+    # Find out which devices are reachable before opening any session, and their latency to set their timeouts
+    # (the whole inventory has to be read first)
+    if args.sweep:
+        devices = list(devices)
+        context.latencies, unreachable = sweep(devices, args.sweep_timeout)
+        for device in devices:
+            if (device.ip_address, device.port) in unreachable:
+                error = unreachable[(device.ip_address, device.port)]
+                print("[!] {} is unreachable: {}".format(device.ip_address, error), file=sys.stderr)
+                summary.add(device.ip_address, "unreachable", error)
+                if metrics:
+                    metrics.add(device.ip_address, "unreachable", error)
+                if context.journal:
+                    context.journal.device(device.ip_address, device.port, "unreachable", error)
+        devices = [device for device in devices if (device.ip_address, device.port) not in unreachable]
+
+    # Start the devices which took the longest in the previous runs first (the whole inventory has to be read first)
+    if context.durations and context.durations.entries:
+        devices = context.durations.order(devices)
+
+    def collect(result):
+        summary.add(result.ip_address, result.status, result.error)
+        if metrics:
+            metrics.add(result.ip_address, result.status, result.error, result.metrics, result.metrics.hostname if result.metrics else "")
+        if result.rows:
+            dataset.write(result.rows)
+        if context.durations and result.status == "ok":
+            context.durations.add(result.ip_address, result.port, result.metrics.elapsed - result.metrics.phases.get("wait", 0))
+        write_result(result)
+        # Only once the output is saved
+        if context.journal:
+            context.journal.device(result.ip_address, result.port, result.status, result.error, result.filename, result.metrics.elapsed if result.metrics else None)
+
+    try:
+        if args.processes > 1:
+            run_devices_sharded(devices, context, collect)
+        else:
+            run_devices(devices, context, collect)
+    finally:
+        context.close()
+        if metrics:
+            metrics.close(summary.counts)
+        if dataset:
+            dataset.close()
+
+    # The summary would get mixed with the table
+    if not args.table or args.save:
+        summary.print(context.backup_store)
+    if dataset:
+        print("[+] {} interface(s) saved to {}".format(dataset.rows, args.collect))
 
     sys.exit(0)
 
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+'''
+
+pisco_bench.py - Benchmarks for pisco.py
+
+Usage: use --help for help
+
+-   scanner:    CPU time per MB of output spent receiving a command's output and looking for the prompt,
+                with telnetlib.expect() (as used by pisco.py before) and with pisco.PromptScanner
+-   devices:    TelnetDevice (or AsyncTelnetDevice) sessions against N devices simulated by pisco_sim.py
+-   main:       pisco.py itself (in a subprocess) against N devices simulated by pisco_sim.py
+
+The devices and main benchmarks report the devices processed per minute, the latency of the commands, the CPU time
+per MB received and the peak RSS (of the benchmark process for devices, of pisco.py for main).
+
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import warnings
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: no peak RSS
+    resource = None
+
+import pisco
+import pisco_sim
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import telnetlib
+except ImportError:
+    # telnetlib was removed from the Standard Library in Python 3.13: no telnetlib column, and the devices benchmark uses --asyncio
+    telnetlib = None
+
+
+def make_output(size, hostname="SW1"):
+    '''
+    Return about size bytes of "show run" like output, with "#" and ">" characters inside, followed by the prompt
+    '''
+
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        line = "interface GigabitEthernet1/0/{}\r\n description uplink #{} to >core-sw#{}\r\n!\r\n".format(i, i, i)
+        lines.append(line)
+        length += len(line)
+        i += 1
+
+    return ("show run\r\n" + "".join(lines) + "end\r\n\r\n{}#".format(hostname)).encode("Latin_1")
+
+
+def scan_telnetlib(data, expected):
+    '''
+    Process data like telnetlib.expect() does: 50 bytes per read, parsed byte by byte, then every regex searched
+    over the whole buffer
+    '''
+
+    telnet = telnetlib.Telnet()
+    expected = [re.compile(pattern) for pattern in expected]
+
+    for i in range(0, len(data), 50):
+        telnet.rawq += data[i:i + 50]
+        telnet.process_rawq()
+        for pattern in expected:
+            if pattern.search(telnet.cookedq):
+                return True
+
+    return False
+
+
+def scan_pisco(data, expected):
+    '''
+    Process data like TelnetDevice.read_output() does: 64KB per read, filtered in slices, then scanned incrementally
+    '''
+
+    scanner = pisco.PromptScanner(expected, pisco.io.BytesIO())
+
+    for i in range(0, len(data), 65536):
+        chunk, replies, remainder = pisco.telnet_filter(data[i:i + 65536])
+        if scanner.feed(chunk):
+            return True
+
+    return False
+
+
+def cpu_time(function, *args):
+    '''
+    Return the CPU time used by function(*args), checking that it found the prompt
+    '''
+
+    start = time.process_time()
+    if not function(*args):
+        raise RuntimeError("prompt not found by {}".format(function.__name__))
+
+    return time.process_time() - start
+
+
+def bench_scanner(args):
+    '''
+    Print the CPU time per MB of output for both methods, for each size
+    '''
+
+    expected = pisco.prompt_patterns(hostname="SW1")
+
+    print("{:>10}  {:>18}  {:>18}  {:>8}".format("size (MB)", "telnetlib (s/MB)", "pisco (s/MB)", "speedup"))
+    for size in args.sizes:
+        data = make_output(int(size * 1024 * 1024))
+        megabytes = len(data) / 1024 / 1024
+        new = cpu_time(scan_pisco, data, expected) / megabytes
+        if telnetlib and size <= args.max_telnetlib_size:
+            old = cpu_time(scan_telnetlib, data, expected) / megabytes
+            print("{:>10.2f}  {:>18.3f}  {:>18.4f}  {:>7.0f}x".format(megabytes, old, new, old / new))
+        else:
+            print("{:>10.2f}  {:>18}  {:>18.4f}  {:>8}".format(megabytes, "-", new, "-"))
+
+
+def peak_rss(who):
+    '''
+    Return the peak RSS in MB of this process (who="self") or of its terminated children (who="children")
+    '''
+
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN).ru_maxrss
+    # Bytes on macOS, KB elsewhere
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def start_simulator(args):
+    '''
+    Start pisco_sim.py in a subprocess with the options of the benchmark and return it once it is listening
+    '''
+
+    command = [sys.executable, pisco_sim.__file__, "--devices", str(args.devices), "--address", args.address, "--port", str(args.port),
+               "--interfaces", str(args.interfaces), "--latency", str(args.latency), "--login-delay", str(args.login_delay),
+               "--login-failure-rate", str(args.login_failure_rate)]
+    if args.hash_in_output:
+        command.append("--hash-in-output")
+
+    simulator = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    if not simulator.stdout.readline().startswith("[+]"):
+        simulator.wait()
+        raise RuntimeError("pisco_sim.py failed to start")
+
+    return simulator
+
+
+def print_report(devices, failed, elapsed, latencies, received, cpu, rss):
+    '''
+    Print the results of the devices and main benchmarks
+    '''
+
+    megabytes = received / 1024 / 1024
+    print("devices:          {} in {:.2f}s ({} failed)".format(devices, elapsed, failed))
+    print("devices/minute:   {:.0f}".format(devices / elapsed * 60))
+    print("commands:         {}".format(len(latencies)))
+    if latencies:
+        print("latency (ms):     p50 {:.2f}  p95 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+            *(pisco.percentile(latencies, p) * 1000 for p in (50, 95, 99, 100))))
+    print("received:         {:.2f} MB".format(megabytes))
+    print("CPU:              {:.2f}s ({:.3f} s/MB)".format(cpu, cpu / megabytes if megabytes else 0))
+    print("peak RSS:         {}".format("{:.1f} MB".format(rss) if rss is not None else "-"))
+
+
+def run_session(address, args):
+    '''
+    Run the commands on a simulated device with a TelnetDevice and return whether it succeeded, and its DeviceMetrics.
+    A session which lost the prompt (TimeoutError, see pisco.CommandPipeline) failed.
+    '''
+
+    metrics = pisco.DeviceMetrics()
+    try:
+        telnet = pisco.TelnetDevice(address, port=args.port, username="admin", password="cisco", enable_password="secret", quiet=True, metrics=metrics)
+    except Exception:
+        return False, metrics
+
+    try:
+        telnet.enable()
+        telnet.send_command("terminal length 0")
+        telnet.read_output()
+        for command, response in telnet.send_commands(args.commands, args.window):
+            pass
+    except TimeoutError:
+        return False, metrics
+    finally:
+        telnet.close()
+
+    return True, metrics
+
+
+async def run_session_async(address, args, semaphore):
+    '''
+    Same as run_session(), with an AsyncTelnetDevice
+    '''
+
+    metrics = pisco.DeviceMetrics()
+    async with semaphore:
+        try:
+            telnet = await pisco.AsyncTelnetDevice.connect(address, port=args.port, username="admin", password="cisco", enable_password="secret", quiet=True, metrics=metrics)
+        except Exception:
+            return False, metrics
+
+        try:
+            await telnet.enable()
+            await telnet.send_command("terminal length 0")
+            await telnet.read_output()
+            async for command, response in telnet.send_commands(args.commands, args.window):
+                pass
+        except TimeoutError:
+            return False, metrics
+        finally:
+            telnet.close()
+
+    return True, metrics
+
+
+async def run_sessions_async(addresses, args):
+    semaphore = asyncio.BoundedSemaphore(args.workers)
+    return await asyncio.gather(*(run_session_async(address, args, semaphore) for address in addresses))
+
+
+def bench_devices(args):
+    '''
+    Run TelnetDevice sessions against the simulated devices, args.workers at a time, in this process
+    '''
+
+    simulator = start_simulator(args)
+    addresses = pisco_sim.device_addresses(args.address, args.devices)
+    try:
+        start = time.monotonic()
+        cpu = time.process_time()
+        if args.asyncio or telnetlib is None:
+            results = asyncio.run(run_sessions_async(addresses, args))
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                results = list(executor.map(lambda address: run_session(address, args), addresses))
+        cpu = time.process_time() - cpu
+        elapsed = time.monotonic() - start
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+    latencies = [command["seconds"] for ok, metrics in results for command in metrics.commands]
+    received = sum(metrics.bytes_received for ok, metrics in results)
+    failed = sum(1 for ok, metrics in results if not ok)
+    print_report(len(results), failed, elapsed, latencies, received, cpu, peak_rss("self"))
+
+
+def bench_main(args):
+    '''
+    Run pisco.py in a subprocess against the simulated devices, with its --metrics file to get the latencies
+    '''
+
+    simulator = start_simulator(args)
+    with tempfile.TemporaryDirectory() as directory:
+        device_list = os.path.join(directory, "devices.txt")
+        with open(device_list, "w") as f:
+            f.write("\n".join(pisco_sim.device_addresses(args.address, args.devices)) + "\n")
+        metrics = os.path.join(directory, "metrics.jsonl")
+        command = [sys.executable, pisco.__file__, "-D", device_list, "-c", ",".join(args.commands), "-u", "admin", "-p", "cisco", "-e", "secret",
+                   "--port", str(args.port), "--workers", str(args.workers), "--metrics", metrics] + args.pisco_options
+        if args.asyncio:
+            command.append("--asyncio")
+        if args.window > 1:
+            command += ["--batch", "--window", str(args.window)]
+
+        try:
+            start = time.monotonic()
+            children = os.times()
+            subprocess.run(command, stdout=subprocess.DEVNULL, cwd=directory, check=True)
+            elapsed = time.monotonic() - start
+            cpu = (os.times().children_user - children.children_user) + (os.times().children_system - children.children_system)
+        finally:
+            simulator.terminate()
+            simulator.wait()
+
+        with open(metrics) as f:
+            records = [json.loads(line) for line in f]
+
+    latencies = [record["seconds"] for record in records if record["type"] == "command"]
+    summary = records[-1]
+    devices = sum(summary["devices"].values())
+    # The simulator is still running when pisco.py is waited for: the children's peak RSS is pisco.py's
+    print_report(devices, devices - summary["devices"]["ok"], elapsed, latencies, summary["bytes"], cpu, peak_rss("children"))
+
+
+def parse_arguments():
+    '''
+    Parse command line arguments.
+    '''
+
+    parser = argparse.ArgumentParser(description="Benchmarks for pisco.py")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    scanner_parser = subparsers.add_parser("scanner", help="CPU time per MB of output spent looking for the prompt")
+    scanner_parser.add_argument("--sizes", help="output sizes in MB (default=0.0625 0.125 0.25 1 16)", type=float, nargs="+", default=[0.0625, 0.125, 0.25, 1, 16])
+    scanner_parser.add_argument("--max-telnetlib-size", help="largest size in MB to run with telnetlib, which is quadratic (default=0.25)", type=float, default=0.25)
+    scanner_parser.set_defaults(function=bench_scanner)
+
+    session_options = argparse.ArgumentParser(add_help=False)
+    session_options.add_argument("-n", "--devices", help="number of simulated devices (default=100)", type=int, default=100)
+    session_options.add_argument("-w", "--workers", help="number of devices processed concurrently (default=10)", type=int, default=10)
+    session_options.add_argument("--asyncio", help="use AsyncTelnetDevice sessions (pisco.py --asyncio)", action="store_true")
+    session_options.add_argument("--window", help="pipeline up to this number of commands (default=1)", type=int, default=1)
+    session_options.add_argument("-c", "--commands", help="commands to run on each device (default=show version, show int status, show int desc, show power inline, show run)",
+                                 nargs="+", default=["show version", "show int status", "show int desc", "show power inline", "show run"])
+    session_options.add_argument("--address", help="address of the first simulated device (default=127.0.1.1)", default="127.0.1.1")
+    session_options.add_argument("--port", help="port of the simulated devices (default=2323)", type=int, default=2323)
+    session_options.add_argument("-i", "--interfaces", help="number of interfaces of the simulated devices, which sets the size of the outputs (default=48)", type=int, default=48)
+    session_options.add_argument("--latency", help="seconds before the simulated devices answer each command (default=0)", type=float, default=0)
+    session_options.add_argument("--login-delay", help="seconds taken by the simulated devices to check the credentials (default=0)", type=float, default=0)
+    session_options.add_argument("--login-failure-rate", help="probability that a login fails on the simulated devices (default=0)", type=float, default=0)
+    session_options.add_argument("--hash-in-output", help="put '#' and '>' characters in the outputs of the simulated devices", action="store_true")
+
+    devices_parser = subparsers.add_parser("devices", parents=[session_options], help="TelnetDevice sessions against simulated devices")
+    devices_parser.set_defaults(function=bench_devices)
+
+    main_parser = subparsers.add_parser("main", parents=[session_options], help="pisco.py against simulated devices")
+    main_parser.add_argument("pisco_options", help="other options for pisco.py (after --)", nargs=argparse.REMAINDER)
+    main_parser.set_defaults(function=bench_main)
+
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Pisco_bench.py Main program
+    '''
+
+    args = parse_arguments()
+    if getattr(args, "pisco_options", None) and args.pisco_options[0] == "--":
+        args.pisco_options = args.pisco_options[1:]
+    args.function(args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print()
+        sys.exit(1)
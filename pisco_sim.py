@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+'''
+
+pisco_sim.py - Simulated Cisco IOS devices, to test and benchmark pisco.py without touching real devices
+
+Usage: use --help for help
+
+Each simulated device listens on its own loopback address (127.0.1.1, 127.0.1.2...), so that pisco.py sees them
+as different devices on the same port (Linux routes the whole 127.0.0.0/8 to the loopback interface, other systems
+need an alias for each address).
+
+The devices answer the login, enable, terminal length, show version, show int status, show int desc,
+show power inline and show run commands (with "| include" filters), and page their output with --More--
+until "terminal length 0" is sent. Latency, output size, '#' characters inside the output and login failures
+can be configured to reproduce difficult devices.
+
+'''
+
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import ipaddress
+
+import pisco
+
+
+def interface_name(i):
+    '''
+    Name of the i-th interface of a device: 48 ports per stack member
+    '''
+
+    return "Gi{}/0/{}".format(i // 48 + 1, i % 48 + 1)
+
+
+def device_addresses(first, count):
+    '''
+    Return the list of the addresses of count simulated devices, starting at first
+    '''
+
+    first = ipaddress.ip_address(first)
+    return [str(first + i) for i in range(count)]
+
+
+class SimulatedDevice(object):
+    '''
+    Outputs of the commands of one simulated device
+    '''
+
+    def __init__(self, hostname, interfaces=48, hash_in_output=False):
+        self.hostname = hostname
+        self.interfaces = interfaces
+        self.hash_in_output = hash_in_output
+
+
+    def description(self, i):
+        if self.hash_in_output:
+            return "uplink #{} to >core-sw#{}".format(i, i)
+        return "user port {}".format(i)
+
+
+    def show_version(self):
+        return [
+            "Cisco IOS Software, C2960X Software (C2960X-UNIVERSALK9-M), Version 15.2(7)E4, RELEASE SOFTWARE (fc2)",
+            "Technical Support: http://www.cisco.com/techsupport",
+            "",
+            "ROM: Bootstrap program is C2960X boot loader",
+            "{} uptime is 1 year, 2 weeks, 3 days, 4 hours, 5 minutes".format(self.hostname),
+            "System returned to ROM by power-on",
+            "",
+            "Model revision number           : A0",
+            "Model number                    : WS-C2960X-48FPD-L",
+            "System serial number            : FOC1234X0AB",
+            "",
+            "Configuration register is 0xF",
+            "",
+        ]
+
+
+    def show_int_status(self):
+        lines = ["", "Port      Name               Status       Vlan       Duplex  Speed Type "]
+        for i in range(self.interfaces):
+            status, vlan, duplex, speed = ("connected", str(10 + i % 4), "a-full", "a-1000") if i % 3 else ("notconnect", "1", "auto", "auto")
+            lines.append("{:<10}{:<19}{:<13}{:<11}{:<7}{:<7}10/100/1000BaseTX".format(interface_name(i), self.description(i)[:18], status, vlan, duplex, speed))
+        return lines
+
+
+    def show_int_desc(self):
+        lines = ["", "Interface                      Status         Protocol Description"]
+        for i in range(self.interfaces):
+            status, protocol = ("up", "up") if i % 3 else ("down", "down")
+            lines.append("{:<31}{:<15}{:<9}{}".format(interface_name(i), status, protocol, self.description(i)))
+        return lines
+
+
+    def show_power_inline(self):
+        lines = [
+            "",
+            "Module   Available     Used     Remaining",
+            "          (Watts)     (Watts)    (Watts) ",
+            "------   ---------   --------   ---------",
+            "1            740.0       92.4       647.6",
+            "Interface Admin  Oper       Power   Device              Class Max",
+            "                            (Watts)                            ",
+            "--------- ------ ---------- ------- ------------------- ----- ----",
+        ]
+        for i in range(self.interfaces):
+            oper, power, device, cls = ("on", "15.4", "IP Phone 8845", "4") if i % 3 else ("off", "0.0", "n/a", "n/a")
+            lines.append("{:<10}{:<7}{:<11}{:<8}{:<20}{:<6}30.0".format(interface_name(i), "auto", oper, power, device, cls))
+        return lines
+
+
+    def show_run(self):
+        lines = [
+            "Building configuration...",
+            "",
+            "Current configuration : {} bytes".format(200 + 80 * self.interfaces),
+            "!",
+            "! Last configuration change at {}".format(time.strftime("%H:%M:%S UTC %a %b %d %Y", time.gmtime())),
+            "!",
+            "version 15.2",
+            "service timestamps log datetime msec",
+            "!",
+            "hostname {}".format(self.hostname),
+            "!",
+            "enable secret 5 $1$abcd$0123456789abcdefghijk",
+            "!",
+        ]
+        for i in range(self.interfaces):
+            lines += [
+                "interface {}".format(interface_name(i)),
+                " description {}".format(self.description(i)),
+                " switchport access vlan {}".format(10 + i % 4),
+                " switchport mode access",
+                "!",
+            ]
+        lines += [
+            "banner motd ^C",
+            "# Authorized access only #" if self.hash_in_output else "Authorized access only",
+            "^C",
+            "!",
+            "line vty 0 15",
+            " transport input telnet",
+            "!",
+            "ntp clock-period {}".format(random.randint(36000000, 36100000)),
+            "ntp server 192.0.2.123",
+            "end",
+            "",
+        ]
+        return lines
+
+
+    def output(self, command):
+        '''
+        Return the lines of the output of a show command, or None if it is unknown
+        '''
+
+        command, _, pipe = command.partition("|")
+        words = command.split()
+        commands = (
+            (("show", "version"), self.show_version),
+            (("show", "interfaces", "status"), self.show_int_status),
+            (("show", "interfaces", "description"), self.show_int_desc),
+            (("show", "power", "inline"), self.show_power_inline),
+            (("show", "running-config"), self.show_run),
+        )
+        for keywords, function in commands:
+            # IOS accepts abbreviated keywords (sh int st...)
+            if len(words) == len(keywords) and all(keyword.startswith(word) for word, keyword in zip(words, keywords)):
+                lines = function()
+                break
+        else:
+            return None
+
+        pipe = pipe.split(None, 1)
+        if len(pipe) == 2 and "include".startswith(pipe[0]):
+            pattern = re.compile(pipe[1])
+            lines = [line for line in lines if pattern.search(line)]
+
+        return lines
+
+
+class SimulatedSession(object):
+    '''
+    Telnet session of a client with a SimulatedDevice
+    '''
+
+    def __init__(self, device, reader, writer, args):
+        self.device = device
+        self.reader = reader
+        self.writer = writer
+        self.args = args
+        self.buffer = b""
+        self.raw_buffer = b""
+        self.paged = True
+        self.mode = ">"
+
+
+    async def read(self):
+        '''
+        Read more data from the client, dropping its Telnet commands
+        '''
+
+        data = await self.reader.read(65536)
+        if not data:
+            raise EOFError
+        data, replies, self.raw_buffer = pisco.telnet_filter(self.raw_buffer + data)
+        if replies:
+            self.writer.write(replies)
+        self.buffer += data
+
+
+    async def readline(self):
+        '''
+        Return the next line typed by the client (ended by CR, LF, CR LF or CR NUL)
+        '''
+
+        while True:
+            match = re.search(rb"\r\n|\r\x00|\r|\n", self.buffer)
+            # A CR at the end of the buffer may be followed by LF or NUL
+            if match and (match.group() != b"\r" or match.end() < len(self.buffer)):
+                line, self.buffer = self.buffer[:match.start()], self.buffer[match.end():]
+                return line.decode("Latin_1")
+            await self.read()
+
+
+    async def readchar(self):
+        while not self.buffer:
+            await self.read()
+        char, self.buffer = self.buffer[:1], self.buffer[1:]
+        return char
+
+
+    def write(self, text):
+        self.writer.write(text.encode("Latin_1"))
+
+
+    async def write_lines(self, lines):
+        '''
+        Write the lines of an output, stopping at each page with --More-- unless terminal length is 0
+        '''
+
+        chunk = []
+        for n, line in enumerate(lines, 1):
+            chunk.append(line + "\r\n")
+            if self.paged and n % 23 == 0 and n < len(lines):
+                self.write("".join(chunk) + " --More-- ")
+                chunk = []
+                await self.writer.drain()
+                if await self.readchar() == b"q":
+                    self.write("\x08" * 10 + " " * 10 + "\x08" * 10)
+                    return
+                self.write("\x08" * 10 + " " * 10 + "\x08" * 10)
+            elif len(chunk) >= 1000:
+                self.write("".join(chunk))
+                chunk = []
+                await self.writer.drain()
+        self.write("".join(chunk))
+
+
+    async def delay(self, seconds):
+        if seconds:
+            await asyncio.sleep(seconds)
+
+
+    @property
+    def prompt(self):
+        return self.device.hostname + self.mode
+
+
+    async def login(self):
+        '''
+        Ask for username and password, up to 3 times. Return False if the login failed.
+        '''
+
+        self.write("\r\n\r\nUser Access Verification\r\n\r\n")
+        for attempt in range(3):
+            self.write("Username: ")
+            username = await self.readline()
+            self.write(username + "\r\nPassword: ")
+            password = await self.readline()
+            # Time taken by the AAA server
+            await self.delay(self.args.login_delay)
+            if username == self.args.username and password == self.args.password and random.random() >= self.args.login_failure_rate:
+                self.write("\r\n\r\n" + self.prompt)
+                return True
+            self.write("\r\n% Authentication failed\r\n\r\n")
+
+        return False
+
+
+    async def enable(self):
+        self.write("Password: ")
+        password = await self.readline()
+        if password == self.args.enable_password:
+            self.mode = "#"
+            self.write("\r\n")
+        else:
+            self.write("\r\n% Access denied\r\n\r\n")
+
+
+    async def run(self):
+        '''
+        Log the client in and answer its commands until it disconnects
+        '''
+
+        # Same negotiation as IOS: the device echoes and suppresses go-ahead
+        self.writer.write(bytes([pisco.IAC, pisco.WILL, 1, pisco.IAC, pisco.WILL, 3]))
+        if not await self.login():
+            return
+
+        while True:
+            await self.writer.drain()
+            command = (await self.readline()).strip()
+            await self.delay(self.args.latency)
+            self.write(command + "\r\n")
+            words = command.split()
+
+            if not words:
+                pass
+            elif words[0] in ("exit", "logout", "quit") and self.mode != "(config)#":
+                return
+            elif "enable".startswith(words[0]) and len(words[0]) >= 2:
+                await self.enable()
+            elif "terminal".startswith(words[0]) and len(words) == 3 and "length".startswith(words[1]):
+                self.paged = words[2] != "0"
+            elif self.mode == "(config)#":
+                if words[0] in ("end", "exit"):
+                    self.mode = "#"
+            elif self.mode == "#" and "configure".startswith(words[0]) and len(words) == 2 and "terminal".startswith(words[1]):
+                self.write("Enter configuration commands, one per line.  End with CNTL/Z.\r\n")
+                self.mode = "(config)#"
+            elif self.mode == "#" and words[0] == "write":
+                self.write("Building configuration...\r\n")
+                await self.writer.drain()
+                await self.delay(self.args.write_delay)
+                self.write("[OK]\r\n")
+            else:
+                lines = self.device.output(command)
+                if lines is None:
+                    self.write("{}^\r\n% Invalid input detected at '^' marker.\r\n\r\n".format(" " * len(self.prompt)))
+                else:
+                    await self.write_lines(lines)
+
+            self.write(self.prompt)
+
+
+async def serve(args):
+    '''
+    Start one server per simulated device and serve them forever
+    '''
+
+    addresses = device_addresses(args.address, args.devices)
+    servers = []
+    for i, address in enumerate(addresses, 1):
+        device = SimulatedDevice("{}{}".format(args.hostname, i), interfaces=args.interfaces, hash_in_output=args.hash_in_output)
+
+        async def handle(reader, writer, device=device):
+            try:
+                await SimulatedSession(device, reader, writer, args).run()
+            except (EOFError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        servers.append(await asyncio.start_server(handle, address, args.port, backlog=1024))
+
+    if args.device_list:
+        with open(args.device_list, "w") as f:
+            f.write("\n".join(addresses) + "\n")
+
+    print("[+] Simulating {} device(s) on {} to {}, port {}".format(len(addresses), addresses[0], addresses[-1], args.port), flush=True)
+
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def parse_arguments(arguments=None):
+    '''
+    Parse command line arguments.
+    '''
+
+    parser = argparse.ArgumentParser(description="Simulated Cisco IOS devices for pisco.py")
+    parser.add_argument("-n", "--devices", help="number of devices (default=1)", type=int, default=1)
+    parser.add_argument("--address", help="address of the first device, the next ones follow (default=127.0.1.1)", default="127.0.1.1")
+    parser.add_argument("--port", help="Telnet port (default=2323)", type=int, default=2323)
+    parser.add_argument("--device-list", help="write the addresses of the devices to this file (for pisco.py -D)")
+    parser.add_argument("--hostname", help="hostname of the devices, followed by their number (default=SW)", default="SW")
+    parser.add_argument("-u", "--username", help="username (default=admin)", default="admin")
+    parser.add_argument("-p", "--password", help="password (default=cisco)", default="cisco")
+    parser.add_argument("-e", "--enable-password", help="enable password (default=secret)", default="secret")
+    parser.add_argument("-i", "--interfaces", help="number of interfaces, which sets the size of the outputs (default=48)", type=int, default=48)
+    parser.add_argument("--hash-in-output", help="put '#' and '>' characters in the descriptions and the banner", action="store_true")
+    parser.add_argument("--latency", help="seconds before answering each command (default=0)", type=float, default=0)
+    parser.add_argument("--write-delay", help="seconds taken by the write command to save the configuration (default=0)", type=float, default=0)
+    parser.add_argument("--login-delay", help="seconds taken to check the username and password (default=0)", type=float, default=0)
+    parser.add_argument("--login-failure-rate", help="probability that a login with the right credentials fails anyway (default=0)", type=float, default=0)
+
+    return parser.parse_args(arguments)
+
+
+def main():
+    '''
+    Pisco_sim.py Main program
+    '''
+
+    args = parse_arguments()
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print()
+        sys.exit(1)
@@ -0,0 +1,102 @@
+'''
+Tests of BackupStore, fed with responses as in table mode (see backup_response())
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import pisco
+
+
+CONFIG = """SW1#show running-config
+Building configuration...
+
+Current configuration : 1234 bytes
+!
+! Last configuration change at {} UTC Mon Oct 12 2026
+!
+hostname SW1
+!
+interface GigabitEthernet1/0/1
+ description {}
+!
+ntp clock-period {}
+end
+SW1#"""
+
+
+class BackupStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = pisco.BackupStore(self.directory)
+        self.device = SimpleNamespace(host="10.0.0.1", port=23, hostname="SW1", prompt_found=True)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def backup(self, response, command="show running-config", device=None):
+        pisco.backup_response(self.store, device or self.device, command, response)
+
+
+    def test_volatile_lines_are_ignored(self):
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001))
+        self.backup(CONFIG.format("11:00:00", "AP-Floor1", 36000002))
+        self.assertEqual((self.store.new, self.store.unchanged), (1, 1))
+        versions = self.store.index("10.0.0.1", 23)["show running-config"]
+        self.assertEqual(len(versions), 1)
+        self.assertNotIn("clock-period", self.store.read(versions[0]["hash"]))
+
+
+    def test_diff(self):
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001))
+        self.backup(CONFIG.format("11:00:00", "AP-Floor2", 36000002))
+        self.assertEqual(self.store.new, 2)
+        diff = self.store.diff("10.0.0.1", 23, "show  running-config")
+        self.assertIn("- description AP-Floor1\n", diff)
+        self.assertIn("+ description AP-Floor2\n", diff)
+        self.assertEqual(self.store.diff("10.0.0.1", 23, "show running-config", "1", "1"), [])
+        with self.assertRaises(KeyError):
+            self.store.diff("10.0.0.1", 23, "show running-config", "3")
+
+
+    def test_same_output_is_saved_once(self):
+        other = SimpleNamespace(host="10.0.0.2", port=23, hostname="SW1", prompt_found=True)
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001))
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001), device=other)
+        self.assertEqual(self.store.new, 2)
+        objects = [name for path, directories, names in os.walk(os.path.join(self.directory, "objects")) for name in names]
+        self.assertEqual(len(objects), 1)
+
+
+    def test_ports_have_their_own_index(self):
+        console = SimpleNamespace(host="10.0.0.1", port=2001, hostname="SW1", prompt_found=True)
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001))
+        self.backup(CONFIG.format("10:00:00", "AP-Floor2", 36000001), device=console)
+        self.assertEqual(len(self.store.index("10.0.0.1", 23)["show running-config"]), 1)
+        self.assertEqual(len(self.store.index("10.0.0.1", 2001)["show running-config"]), 1)
+
+
+    def test_incomplete_empty_or_other_outputs_are_not_saved(self):
+        self.device.prompt_found = False
+        self.backup(CONFIG.format("10:00:00", "AP-Floor1", 36000001))
+        self.device.prompt_found = True
+        self.backup("SW1#show running-config\nSW1#")
+        # Output of the previous command, after a session out of sync
+        self.backup("SW1#write\n[OK]\nSW1#")
+        self.assertEqual((self.store.new, self.store.rejected), (0, 2))
+        self.assertEqual(self.store.index("10.0.0.1", 23), {})
+
+
+    def test_scrolled_echo(self):
+        self.backup("SW1#$g | include hostname|ntp server\nhostname SW1\nSW1#", command="show running-config | include hostname|ntp server")
+        self.assertEqual((self.store.new, self.store.rejected), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+'''
+Tests of ResultCache, alone and through DeviceProtocol.run_command() (see ScriptedDevice)
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pisco
+from tests.test_session import ScriptedDevice
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache.db")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_ttl(self):
+        cache = pisco.ResultCache(ttl=60, ttls={"show  running-config": 600})
+        with mock.patch("pisco.time.time", return_value=1000):
+            cache.set("10.0.0.1", 23, "show version", "version")
+            cache.set("10.0.0.1", 23, "show running-config", "config")
+        with mock.patch("pisco.time.time", return_value=1059):
+            self.assertEqual(cache.get("10.0.0.1", 23, "show  version"), "version")
+        with mock.patch("pisco.time.time", return_value=1061):
+            self.assertIsNone(cache.get("10.0.0.1", 23, "show version"))
+            self.assertEqual(cache.get("10.0.0.1", 23, "show running-config"), "config")
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+    def test_invalidation(self):
+        cache = pisco.ResultCache()
+        cache.set("10.0.0.1", 23, "show version", "version")
+        cache.set("10.0.0.1", 2323, "show version", "other port")
+        cache.invalidate("10.0.0.1", 23, "terminal length 0")
+        self.assertEqual(cache.get("10.0.0.1", 23, "show version"), "version")
+        cache.invalidate("10.0.0.1", 23, "configure terminal")
+        self.assertIsNone(cache.get("10.0.0.1", 23, "show version"))
+        self.assertEqual(cache.get("10.0.0.1", 2323, "show version"), "other port")
+
+
+    def test_max_size(self):
+        cache = pisco.ResultCache(max_size=2)
+        cache.set("10.0.0.1", 23, "show version", "version")
+        cache.set("10.0.0.1", 23, "show clock", "clock")
+        cache.get("10.0.0.1", 23, "show version")
+        cache.set("10.0.0.1", 23, "show users", "users")
+        self.assertEqual(list(cache.entries), [("10.0.0.1", 23, "show version"), ("10.0.0.1", 23, "show users")])
+
+
+    def test_persistence(self):
+        cache = pisco.ResultCache(filename=self.filename)
+        cache.set("10.0.0.1", 23, "show version", "version")
+        cache.set("10.0.0.2", 23, "show version", "version 2")
+        cache.invalidate("10.0.0.2", 23)
+        cache.close()
+
+        cache = pisco.ResultCache(filename=self.filename)
+        self.assertEqual(cache.get("10.0.0.1", 23, "show version"), "version")
+        self.assertIsNone(cache.get("10.0.0.2", 23, "show version"))
+        cache.close()
+
+
+    def test_expired_rows_are_not_loaded(self):
+        cache = pisco.ResultCache(ttl=60, filename=self.filename)
+        with mock.patch("pisco.time.time", return_value=1000):
+            cache.set("10.0.0.1", 23, "show version", "version")
+        cache.close()
+
+        cache = pisco.ResultCache(filename=self.filename)
+        self.assertIsNone(cache.get("10.0.0.1", 23, "show version"))
+        self.assertEqual(len(cache.entries), 0)
+        cache.close()
+
+
+class RunCommandCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = pisco.ResultCache()
+        self.device = ScriptedDevice({"show version": "Version 15.2", "show foo": "   ^\r\n% Invalid input detected at '^' marker.",
+                                      "clear counters": ""})
+
+
+    def run_command(self, command):
+        session = pisco.DeviceProtocol("192.0.2.1", quiet=True, result_cache=self.cache)
+        session.hostname = "SW1"
+        return pisco.run_steps(session.run_command_steps(command), self.device.perform)
+
+
+    def test_show_command_is_cached(self):
+        response = self.run_command("show version")
+        self.assertEqual(self.run_command("show  version"), response)
+        self.assertEqual(self.device.sent, ["show version"])
+
+
+    def test_errors_are_not_cached(self):
+        self.run_command("show foo")
+        self.run_command("show foo")
+        self.assertEqual(self.device.sent, ["show foo", "show foo"])
+
+
+    def test_invalidation_before_sending(self):
+        self.run_command("show version")
+        self.run_command("clear counters")
+        self.run_command("show version")
+        self.assertEqual(self.device.sent, ["show version", "clear counters", "show version"])
+        # Even if the device doesn't return a prompt
+        self.run_command("banner motd ^")
+        self.assertEqual(len(self.cache.entries), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
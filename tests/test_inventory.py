@@ -0,0 +1,99 @@
+'''
+Tests of the reading of the device lists
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+import pisco
+
+
+class ExpandAddressesTest(unittest.TestCase):
+
+    def test_address(self):
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.1")), ["10.0.0.1"])
+
+
+    def test_cidr_block(self):
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.0/30")), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.1/32")), ["10.0.0.1"])
+
+
+    def test_address_with_prefix_length(self):
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.1/24")), ["10.0.0.1"])
+
+
+    def test_range(self):
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.254-300")), ["10.0.0.254", "10.0.0.255"])
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.5-3")), ["10.0.0.5"])
+
+
+    def test_no_networks(self):
+        self.assertEqual(list(pisco.expand_addresses("0.0.0.0/0", networks=False)), [])
+        self.assertEqual(list(pisco.expand_addresses("10.0.0.1/24", networks=False)), ["10.0.0.1"])
+
+
+class AddressPatternTest(unittest.TestCase):
+
+    def test_end_of_sentence(self):
+        self.assertEqual(pisco.ADDRESS_PATTERN.findall("10.1.1.1, 10.1.1.2."), ["10.1.1.1", "10.1.1.2"])
+
+
+    def test_blocks_and_ranges(self):
+        self.assertEqual(pisco.ADDRESS_PATTERN.findall("S 10.2.0.0/16 via 10.1.1.1-3"), ["10.2.0.0/16", "10.1.1.1-3"])
+
+
+class ReadInventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def write(self, name, text):
+        filename = os.path.join(self.directory, name)
+        with open(filename, "w") as f:
+            f.write(text)
+        return filename
+
+
+    def test_text(self):
+        filename = self.write("devices.txt", "! core\n10.0.0.1 255.255.255.0\n# 10.0.0.9\nS* 0.0.0.0/0 via 10.0.0.2.\n10.0.1.1-2\n")
+        devices = list(pisco.read_inventory(filename, port=2323))
+        self.assertEqual([device.ip_address for device in devices], ["10.0.0.1", "10.0.0.2", "10.0.1.1", "10.0.1.2"])
+        self.assertEqual(devices[0], pisco.Device("10.0.0.1", 2323, None, ()))
+
+
+    def test_text_cidr_block(self):
+        filename = self.write("devices.txt", "10.0.0.0/30\nC 10.0.1.0/24 is directly connected, Vlan10\n")
+        with redirect_stderr(io.StringIO()) as stderr:
+            devices = list(pisco.read_inventory(filename))
+        self.assertEqual([device.ip_address for device in devices], ["10.0.0.1", "10.0.0.2"])
+        self.assertIn("skipping 10.0.1.0/24", stderr.getvalue())
+
+
+    def test_csv(self):
+        filename = self.write("devices.csv", "host,port,credentials,tags\n10.0.0.0/30,,lab,core;dc1\n10.0.1.1,2001,,\n")
+        self.assertEqual(list(pisco.read_inventory(filename)), [
+            pisco.Device("10.0.0.1", 23, "lab", ("core", "dc1")),
+            pisco.Device("10.0.0.2", 23, "lab", ("core", "dc1")),
+            pisco.Device("10.0.1.1", 2001, None, ()),
+        ])
+
+
+    def test_unique_devices(self):
+        devices = list(pisco.parse_devices("10.0.0.1,10.0.0.0/30"))
+        devices.append(pisco.Device("10.0.0.1", 2001, None, ()))
+        self.assertEqual([(device.ip_address, device.port) for device in pisco.unique_devices(devices)],
+                         [("10.0.0.1", 23), ("10.0.0.2", 23), ("10.0.0.1", 2001)])
+
+
+if __name__ == "__main__":
+    unittest.main()
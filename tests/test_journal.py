@@ -0,0 +1,74 @@
+'''
+Tests of Journal: the devices done according to the journal of a previous run, read with --resume
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import pisco
+
+
+def device_record(ip_address, status, port=23):
+    return json.dumps({"type": "device", "ip_address": ip_address, "port": port, "status": status}) + "\n"
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "journal.jsonl")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def resume(self, text):
+        with open(self.filename, "w") as f:
+            f.write(text)
+        journal = pisco.Journal(self.filename, resume=True)
+        self.addCleanup(journal.close)
+        return journal
+
+
+    def test_done(self):
+        journal = self.resume(device_record("10.0.0.1", "ok") + device_record("10.0.0.2", "failed") + device_record("10.0.0.3", "skipped")
+                              + device_record("10.0.0.4", "ok", 2323) + device_record("10.0.0.4", "unreachable", 2323))
+        self.assertEqual(journal.done, {("10.0.0.1", 23)})
+        devices = [SimpleNamespace(ip_address="10.0.0.{}".format(i), port=2323 if i == 4 else 23) for i in range(1, 6)]
+        self.assertEqual([device.ip_address for device in journal.pending(devices)], ["10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.5"])
+
+
+    def test_failed_then_ok(self):
+        journal = self.resume(device_record("10.0.0.1", "failed") + device_record("10.0.0.1", "ok"))
+        self.assertEqual(journal.done, {("10.0.0.1", 23)})
+
+
+    def test_truncated_record(self):
+        # Run killed while writing its last record
+        journal = self.resume(device_record("10.0.0.1", "ok") + device_record("10.0.0.2", "ok")[:30])
+        journal.device("10.0.0.2", 23, "ok")
+        journal.close()
+        with open(self.filename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])["ip_address"], "10.0.0.2")
+        journal = self.resume("".join(line + "\n" for line in lines))
+        self.assertEqual(journal.done, {("10.0.0.1", 23), ("10.0.0.2", 23)})
+
+
+    def test_without_resume(self):
+        with open(self.filename, "w") as f:
+            f.write(device_record("10.0.0.1", "ok"))
+        journal = pisco.Journal(self.filename)
+        journal.close()
+        self.assertEqual(journal.done, set())
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
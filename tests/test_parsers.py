@@ -0,0 +1,129 @@
+'''
+Tests of the parsers of the tables of the show commands, on the layouts of real IOS devices
+'''
+
+import unittest
+
+import pisco
+
+
+INT_STATUS_FORMAT = "{:<13}{:<19}{:<13}{:<11}{:>6} {:>6} {}"
+
+# show interfaces status of a Catalyst 9300 with 10G and 25G uplink modules
+INT_STATUS = "\n".join([
+    "SW1#show interfaces status",
+    "",
+    "Port         Name               Status       Vlan       Duplex  Speed Type",
+    INT_STATUS_FORMAT.format("Gi1/0/1", "AP-Floor1", "connected", "10", "a-full", "a-1000", "10/100/1000BaseTX"),
+    INT_STATUS_FORMAT.format("Gi1/0/2", "", "notconnect", "1", "auto", "auto", "10/100/1000BaseTX"),
+    INT_STATUS_FORMAT.format("Te1/1/1", "", "notconnect", "1", "full", "10G", "Not Present"),
+    INT_STATUS_FORMAT.format("Twe1/1/1", "Uplink to core-sw1", "connected", "trunk", "full", "25G", "SFP-25GBase-SR"),
+    INT_STATUS_FORMAT.format("Po1", "", "connected", "trunk", "a-full", "a-10G", "N/A"),
+    "SW1#",
+])
+
+INT_DESC = "\n".join([
+    "SW1#show interfaces description",
+    "Interface                      Status         Protocol Description",
+    "Gi1/0/1                        up             up       AP-Floor1 (room 12)",
+    "Gi1/0/2                        down           down     ",
+    "Gi1/0/3                        admin down     down     spare",
+    "Twe1/1/1                       up             up       Uplink to core-sw1 Twe1/0/1",
+    "SW1#",
+])
+
+# The table of the interfaces follows the table of the modules, without an empty line
+POWER_INLINE = "\n".join([
+    "SW1#show power inline",
+    "",
+    "Module   Available     Used     Remaining",
+    "          (Watts)     (Watts)    (Watts) ",
+    "------   ---------   --------   ---------",
+    "1            740.0       15.4       724.6",
+    "Interface Admin  Oper       Power   Device              Class Max",
+    "                            (Watts)                            ",
+    "--------- ------ ---------- ------- ------------------- ----- ----",
+    "Gi1/0/1   auto   on         15.4    Ieee PD             4     30.0",
+    "Gi1/0/2   auto   off        0.0     n/a                 n/a   30.0",
+    "",
+    "SW1#",
+])
+
+
+class TableColumnsTest(unittest.TestCase):
+
+    def test_header_words(self):
+        columns = pisco.table_columns("Port         Name               Status       Vlan")
+        self.assertEqual(columns, [("Port", 0, 4), ("Name", 13, 17), ("Status", 32, 38), ("Vlan", 45, 49)])
+
+
+    def test_ruler(self):
+        columns = pisco.table_columns("Interface Admin  Oper       Power   Device              Class Max",
+                                      "--------- ------ ---------- ------- ------------------- ----- ----")
+        self.assertEqual([name for name, start, end in columns], ["Interface", "Admin", "Oper", "Power", "Device", "Class", "Max"])
+        self.assertEqual(columns[3], ("Power", 28, 35))
+
+
+class SplitRowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = pisco.table_columns("Port         Name               Status       Vlan       Duplex  Speed Type")
+
+
+    def test_empty_name(self):
+        row = pisco.split_row(INT_STATUS_FORMAT.format("Te1/1/1", "", "notconnect", "1", "full", "10G", "Not Present"), self.columns)
+        self.assertEqual(row, {"Port": "Te1/1/1", "Name": "", "Status": "notconnect", "Vlan": "1", "Duplex": "full", "Speed": "10G", "Type": "Not Present"})
+
+
+    def test_right_aligned_values(self):
+        row = pisco.split_row(INT_STATUS_FORMAT.format("Gi1/0/1", "AP-Floor1", "connected", "10", "a-full", "a-1000", "10/100/1000BaseTX"), self.columns)
+        self.assertEqual((row["Duplex"], row["Speed"], row["Type"]), ("a-full", "a-1000", "10/100/1000BaseTX"))
+
+
+    def test_description_of_several_words(self):
+        row = pisco.split_row(INT_STATUS_FORMAT.format("Twe1/1/1", "Uplink to core-sw1", "connected", "trunk", "full", "25G", "SFP-25GBase-SR"), self.columns)
+        self.assertEqual((row["Port"], row["Name"], row["Status"]), ("Twe1/1/1", "Uplink to core-sw1", "connected"))
+
+
+class ParseTableTest(unittest.TestCase):
+
+    def test_int_status(self):
+        int_status = pisco.parse_int_status(INT_STATUS)
+        self.assertEqual(list(int_status), ["Gi1/0/1", "Gi1/0/2", "Te1/1/1", "Twe1/1/1", "Po1"])
+        self.assertEqual(int_status["Gi1/0/1"], {"description": "AP-Floor1", "status": "connected", "vlan": "10", "duplex": "full",
+                                                 "speed": "1000", "type": "10/100/1000BaseTX", "power": "-"})
+        self.assertEqual(int_status["Gi1/0/2"]["speed"], "-")
+        self.assertEqual(int_status["Te1/1/1"]["description"], "")
+        self.assertEqual(int_status["Te1/1/1"]["type"], "Not Present")
+        self.assertEqual(int_status["Twe1/1/1"]["vlan"], "trunk")
+
+
+    def test_int_list(self):
+        self.assertEqual(pisco.parse_int_list(INT_STATUS), ["Gi1/0/1", "Gi1/0/2", "Te1/1/1", "Twe1/1/1", "Po1"])
+
+
+    def test_int_description(self):
+        int_status = pisco.parse_int_status(INT_STATUS)
+        pisco.parse_int_description(INT_DESC, int_status)
+        self.assertEqual(int_status["Gi1/0/1"]["description"], "AP-Floor1 (room 12)")
+        self.assertEqual(int_status["Gi1/0/2"]["description"], "")
+        self.assertEqual(int_status["Twe1/1/1"]["description"], "Uplink to core-sw1 Twe1/0/1")
+        self.assertEqual(pisco.parse_table(INT_DESC, "Interface")[2]["Status"], "admin down")
+
+
+    def test_power_inline_after_module_table(self):
+        int_status = pisco.parse_int_status(INT_STATUS)
+        pisco.parse_power_inline(POWER_INLINE, int_status)
+        self.assertEqual(int_status["Gi1/0/1"]["power"], "15.4W")
+        self.assertEqual(int_status["Gi1/0/2"]["power"], "0W")
+        self.assertEqual(int_status["Te1/1/1"]["power"], "-")
+        rows = pisco.parse_table(POWER_INLINE, "Interface")
+        self.assertEqual([row["Device"] for row in rows], ["Ieee PD", "n/a"])
+
+
+    def test_no_table(self):
+        self.assertEqual(pisco.parse_table("SW1#show power inline\n% Invalid input detected at '^' marker.\nSW1#", "Interface"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Tests of the Scheduler, alone, with its groups shared between processes (--processes), and in run_devices()
+'''
+
+import time
+import asyncio
+import unittest
+import threading
+import multiprocessing
+from types import SimpleNamespace
+from unittest import mock
+
+import pisco
+
+
+def device(ip_address, *tags):
+    return pisco.Device(ip_address, 23, None, tags)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_group_limit(self):
+        scheduler = pisco.Scheduler(10, group_limit=1)
+        waiting = [(device("10.0.0.1"),), (device("10.0.0.2"),), (device("10.0.1.1"),)]
+        self.assertEqual([d[0].ip_address for d in scheduler.ready(waiting)], ["10.0.0.1", "10.0.1.1"])
+        scheduler.finish(device("10.0.0.1"))
+        self.assertEqual([d[0].ip_address for d in scheduler.ready(waiting)], ["10.0.0.2"])
+
+
+    def test_tags(self):
+        scheduler = pisco.Scheduler(10, group_limit=1, group_by="tag")
+        waiting = [(device("10.0.0.1", "dc1", "core"),), (device("10.0.0.2", "dc2"),), (device("10.0.0.3", "core"),)]
+        self.assertEqual([d[0].ip_address for d in scheduler.ready(waiting)], ["10.0.0.1", "10.0.0.2"])
+
+
+    def test_limit(self):
+        scheduler = pisco.Scheduler(1)
+        waiting = [(device("10.0.0.1"),), (device("10.0.1.1"),)]
+        self.assertEqual(len(scheduler.ready(waiting)), 1)
+        self.assertEqual(scheduler.ready(waiting), [])
+
+
+    def test_shared_groups(self):
+        with multiprocessing.Manager() as manager:
+            shared = (manager.Lock(), manager.dict())
+            first = pisco.Scheduler(10, group_limit=1, shared=shared)
+            second = pisco.Scheduler(10, group_limit=1, shared=shared)
+            self.assertEqual(len(first.ready([(device("10.0.0.1"),)])), 1)
+            # The group is full because of the other process
+            waiting = [(device("10.0.0.2"),)]
+            self.assertEqual(second.ready(waiting), [])
+            first.finish(device("10.0.0.1"))
+            self.assertEqual(len(second.ready(waiting)), 1)
+            self.assertEqual(shared[1].copy(), {"10.0.0.0/24": 1})
+
+
+def run_device(device, context):
+    time.sleep(0.2 if device.ip_address == "10.0.1.1" else 0.01)
+    return pisco.DeviceResult(device.ip_address, device.port, None, None, "ok", None, None)
+
+
+async def run_device_async(device, context):
+    await asyncio.sleep(0.2 if device.ip_address == "10.0.1.1" else 0.01)
+    return pisco.DeviceResult(device.ip_address, device.port, None, None, "ok", None, None)
+
+
+@mock.patch("pisco.SCHEDULER_BACKLOG", 3)
+@mock.patch("pisco.run_device_async", run_device_async)
+@mock.patch("pisco.run_device", run_device)
+class RunDevicesTest(unittest.TestCase):
+    '''
+    run_devices() with a slow first device, a device of its group held up by the group limit, and fast devices
+    elsewhere which fill the backlog
+    '''
+
+    def run_devices(self, asyncio_mode):
+        devices = [device("10.0.1.1"), device("10.0.1.2")] + [device("10.0.2.{}".format(i)) for i in range(1, 20)]
+        context = SimpleNamespace(args=SimpleNamespace(asyncio=asyncio_mode, workers=4), scheduler=pisco.Scheduler(4, group_limit=1))
+        written = []
+        runner = threading.Thread(target=pisco.run_devices, args=(devices, context, lambda result: written.append(result.ip_address)), daemon=True)
+        runner.start()
+        runner.join(30)
+        self.assertFalse(runner.is_alive(), "{} of {} devices written".format(len(written), len(devices)))
+        self.assertEqual(written, [d.ip_address for d in devices])
+
+
+    def test_threads(self):
+        self.run_devices(False)
+
+
+    def test_asyncio(self):
+        self.run_devices(True)
+
+
+if __name__ == "__main__":
+    unittest.main()
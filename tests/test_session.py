@@ -0,0 +1,287 @@
+'''
+Tests of the processing of the data received from the devices: Telnet commands and prompt search
+'''
+
+import io
+import unittest
+
+import pisco
+
+
+def make_scanner(hostname="SW1"):
+    sink = io.BytesIO()
+    return pisco.PromptScanner(pisco.prompt_patterns(hostname=hostname), sink), sink
+
+
+class TelnetFilterTest(unittest.TestCase):
+
+    def test_plain_data(self):
+        self.assertEqual(pisco.telnet_filter(b"SW1#"), (b"SW1#", b"", b""))
+
+
+    def test_options_are_refused(self):
+        data, replies, rest = pisco.telnet_filter(bytes([pisco.IAC, pisco.DO, 1, pisco.IAC, pisco.WILL, 3]) + b"Username: ")
+        self.assertEqual(data, b"Username: ")
+        self.assertEqual(replies, bytes([pisco.IAC, pisco.WONT, 1, pisco.IAC, pisco.DONT, 3]))
+        self.assertEqual(rest, b"")
+
+
+    def test_escaped_iac_and_subnegotiation(self):
+        data, replies, rest = pisco.telnet_filter(b"a" + bytes([pisco.IAC, pisco.IAC]) + b"b" + bytes([pisco.IAC, pisco.SB, 24, 1, pisco.IAC, pisco.SE]) + b"c")
+        self.assertEqual((data, replies, rest), (b"a\xffbc", b"", b""))
+
+
+    def test_command_split_between_chunks(self):
+        data, replies, rest = pisco.telnet_filter(b"output" + bytes([pisco.IAC, pisco.DO]))
+        self.assertEqual((data, replies), (b"output", b""))
+        data, replies, rest = pisco.telnet_filter(rest + bytes([1]) + b" more")
+        self.assertEqual((data, replies, rest), (b" more", bytes([pisco.IAC, pisco.WONT, 1]), b""))
+
+
+    def test_nul_and_xon_are_dropped(self):
+        self.assertEqual(pisco.telnet_filter(b"a\x00b\x11c")[0], b"abc")
+
+
+class PromptScannerTest(unittest.TestCase):
+
+    def test_prompt_split_between_chunks(self):
+        scanner, sink = make_scanner()
+        self.assertFalse(scanner.feed(b"show clock\r\n*10:00:00 UTC\r\nSW"))
+        self.assertTrue(scanner.feed(b"1#show ver"))
+        # The line break before the prompt is part of it, the line ending is cleaned up by the writers
+        self.assertEqual(sink.getvalue(), b"show clock\r\n*10:00:00 UTC\r")
+        self.assertEqual(scanner.prompt, b"\nSW1#")
+        self.assertEqual(scanner.rest, b"show ver")
+
+
+    def test_large_output_keeps_a_bounded_window(self):
+        scanner, sink = make_scanner()
+        line = b"interface GigabitEthernet1/0/1\r\n"
+        for i in range(1000):
+            self.assertFalse(scanner.feed(line))
+            self.assertLessEqual(len(scanner.window), pisco.PROMPT_WINDOW + len(line))
+        self.assertTrue(scanner.feed(b"SW1#"))
+        self.assertEqual(sink.getvalue(), (line * 1000)[:-1])
+        self.assertEqual(scanner.size, len(line) * 1000 + 4)
+
+
+    def test_pager_prompt(self):
+        scanner, sink = make_scanner()
+        self.assertFalse(scanner.feed(b"line 1\r\n --More-- "))
+        self.assertTrue(scanner.more)
+        # The device erases the pager prompt before the next page
+        self.assertFalse(scanner.feed(b"\x08\x08\x08\x08\x08\x08\x08\x08\x08"))
+        self.assertTrue(scanner.feed(b"         \x08\x08\x08\x08\x08\x08\x08\x08\x08line 2\r\nSW1#"))
+        self.assertEqual(sink.getvalue(), b"line 1\r\nline 2\r")
+
+
+    def test_flush_without_prompt(self):
+        scanner, sink = make_scanner()
+        self.assertFalse(scanner.feed(b"Building configuration..."))
+        self.assertEqual(scanner.flush(), b"Building configuration...")
+        self.assertEqual(sink.getvalue(), b"Building configuration...")
+
+
+class PromptPatternsTest(unittest.TestCase):
+
+    def test_hash_inside_output(self):
+        scanner, sink = make_scanner()
+        self.assertFalse(scanner.feed(b" description uplink #1 to >core-sw#1\r\nbanner # SW1#\r\n"))
+        self.assertTrue(scanner.feed(b"SW1(config-if)#"))
+        self.assertEqual(scanner.prompt, b"\nSW1(config-if)#")
+
+
+    def test_login_prompts(self):
+        scanner = pisco.PromptScanner(pisco.prompt_patterns(password_prompt=True), io.BytesIO())
+        self.assertTrue(scanner.feed(b"\r\nUser Access Verification\r\n\r\nUsername: "))
+        self.assertEqual(scanner.prompt, b"sername: ")
+
+
+class ScriptedDevice(object):
+    '''
+    Answer the requests of pisco.DeviceProtocol like a device whose commands return outputs[command]. The lines of
+    a multi-line banner get no prompt until the line closing it. A command without an output (a question) gets no
+    prompt, and neither do the next ones.
+    '''
+
+    def __init__(self, outputs, slow=()):
+        self.outputs = outputs
+        # Commands whose prompt comes only after a read timed out (write memory...)
+        self.slow = slow
+        self.requests = []
+        self.sent = []
+        self.pending = b""
+        self.late = b""
+        self.delimiter = None
+        self.stuck = False
+
+
+    def perform(self, request):
+        self.requests.append(request[0])
+        if request[0] == "write":
+            command = request[1].decode("Latin_1").rstrip("\n")
+            self.sent.append(command)
+            self.pending += (command + "\r\n").encode("Latin_1")
+            if self.delimiter:
+                if self.delimiter in command:
+                    self.delimiter = None
+                    self.pending += b"SW1#"
+                return
+            if command.startswith("banner "):
+                text = command.split(None, 2)[2]
+                if text[0] in text[1:]:
+                    self.pending += b"SW1#"
+                else:
+                    self.delimiter = text[0]
+                    self.pending += "Enter TEXT message.  End with the character '{}'.\r\n".format(self.delimiter).encode("Latin_1")
+                return
+            self.stuck = self.stuck or command not in self.outputs
+            if self.stuck:
+                return
+            if command in self.slow:
+                self.pending += self.outputs[command].encode("Latin_1")
+                self.late += b"\r\nSW1#"
+            else:
+                self.pending += (self.outputs[command] + "\r\nSW1#").encode("Latin_1")
+        elif request[0] == "read":
+            data, self.pending = self.pending, b""
+            if not data:
+                # Nothing more to read: the read times out, and the late prompt comes
+                self.pending, self.late = self.late, b""
+            return data or None
+
+
+def send_commands(device, commands, window):
+    session = pisco.DeviceProtocol("192.0.2.1", quiet=True)
+    session.hostname = "SW1"
+    pipeline = pisco.CommandPipeline(session, commands, window)
+    results = []
+    while True:
+        result = pisco.run_steps(pipeline.next_steps(), device.perform)
+        if result is None:
+            return results
+        results.append(result)
+
+
+class CommandPipelineTest(unittest.TestCase):
+
+    def test_window(self):
+        device = ScriptedDevice({"show clock": "*10:00:00 UTC", "show users": "vty 0 admin", "show version": "Version 15.2"})
+        results = send_commands(device, ["show clock", "show users", "show version"], window=2)
+        # Two commands are sent before the first output is read
+        self.assertEqual(device.requests[:3], ["write", "write", "read"])
+        self.assertEqual([(command, response.splitlines()[1]) for command, response in results],
+                         [("show clock", "*10:00:00 UTC"), ("show users", "vty 0 admin"), ("show version", "Version 15.2")])
+
+
+    def test_late_prompt(self):
+        device = ScriptedDevice({"write": "Building configuration...", "show run": "end"}, slow=("write",))
+        results = send_commands(device, ["write", "show run"], window=1)
+        # The prompt of write is waited for once more instead of ending the output of show run
+        self.assertEqual([(command, response.splitlines()[1]) for command, response in results],
+                         [("write", "Building configuration..."), ("show run", "end")])
+
+
+    def test_banner(self):
+        device = ScriptedDevice({"show clock": "*10:00:00 UTC", "show version": "Version 15.2"})
+        commands = ["show clock", "banner motd ^", "Authorized access only", "^", "banner login #Lab#", "show version"]
+        for window in (1, 3):
+            results = send_commands(device, commands, window)
+            self.assertEqual([command for command, response in results], commands)
+            # Nothing is read for the lines without a prompt: their echo is in the response of the closing line
+            self.assertEqual([response for command, response in results[1:3]], ["", ""])
+            self.assertIn("Authorized access only", results[3][1])
+            self.assertEqual(results[-1][1].splitlines()[1], "Version 15.2")
+
+
+    def test_no_prompt_without_pipelining(self):
+        device = ScriptedDevice({"show version": "Version 15.2"})
+        results = send_commands(device, ["crypto key generate rsa", "show version"], window=1)
+        # The next command is still sent
+        self.assertEqual(device.sent, ["crypto key generate rsa", "show version"])
+        self.assertEqual(len(results), 2)
+
+
+    def test_lost_prompt(self):
+        device = ScriptedDevice({"show clock": "*10:00:00 UTC", "show version": "Version 15.2", "show run": "end"})
+        with self.assertRaises(TimeoutError) as raised:
+            send_commands(device, ["show clock", "crypto key generate rsa", "show version", "show run"], window=2)
+        self.assertIn("no prompt after 'crypto key generate rsa'", str(raised.exception))
+        self.assertIn("1 command(s) not sent", str(raised.exception))
+        # The commands after the lost prompt are not sent, and the one in flight doesn't get the output of another
+        self.assertEqual(device.sent, ["show clock", "crypto key generate rsa", "show version"])
+
+
+    def test_lost_prompt_responses(self):
+        device = ScriptedDevice({"show clock": "*10:00:00 UTC"})
+        session = pisco.DeviceProtocol("192.0.2.1", quiet=True)
+        session.hostname = "SW1"
+        pipeline = pisco.CommandPipeline(session, ["show clock", "crypto key generate rsa", "show version"], window=3)
+        self.assertEqual(pisco.run_steps(pipeline.next_steps(), device.perform)[0], "show clock")
+        command, response = pisco.run_steps(pipeline.next_steps(), device.perform)
+        self.assertEqual(command, "crypto key generate rsa")
+        self.assertFalse(session.prompt_found)
+        self.assertEqual(pisco.run_steps(pipeline.next_steps(), device.perform), ("show version", ""))
+        with self.assertRaises(TimeoutError):
+            pisco.run_steps(pipeline.next_steps(), device.perform)
+        self.assertEqual(session.metrics.commands[1]["complete"], False)
+
+
+class LoginDevice(object):
+    '''
+    Answer the requests of pisco.DeviceProtocol.login_steps() like a device accepting admin/cisco, and the questions
+    for the missing credentials with answers[name]
+    '''
+
+    def __init__(self, credentials, answers):
+        self.credentials = credentials
+        self.answers = answers
+        self.sent = []
+        self.pending = b"\r\nUser Access Verification\r\n\r\nUsername: "
+
+
+    def perform(self, request):
+        if request[0] == "write":
+            self.sent.append(request[1].decode("Latin_1").rstrip("\n"))
+            if len(self.sent) % 2:
+                self.pending += b"\r\nPassword: "
+            elif self.sent[-2:] == ["admin", "cisco"]:
+                self.pending += b"\r\nSW1>"
+            else:
+                self.pending += b"\r\n% Login invalid\r\n\r\nUsername: "
+        elif request[0] == "read":
+            data, self.pending = self.pending, b""
+            return data or None
+        elif request[0] == "ask":
+            return self.credentials.get(request[1], lambda: self.answers[request[1]])
+
+
+class LoginTest(unittest.TestCase):
+
+    def login(self, credentials, answers):
+        device = LoginDevice(credentials, answers)
+        session = pisco.DeviceProtocol("192.0.2.1", quiet=True, credentials=credentials)
+        pisco.run_steps(session.login_steps(), device.perform)
+        return session, device
+
+
+    def test_login(self):
+        credentials = pisco.CredentialCache("admin")
+        session, device = self.login(credentials, {"password": "cisco"})
+        self.assertEqual(session.hostname, "SW1")
+        self.assertEqual(device.sent, ["admin", "cisco"])
+        self.assertEqual(credentials.password, "cisco")
+
+
+    def test_wrong_password_is_forgotten(self):
+        credentials = pisco.CredentialCache("admin")
+        with self.assertRaises(pisco.LoginError):
+            self.login(credentials, {"password": "cisoc"})
+        # The typo is not sent to the next devices: they ask again
+        self.assertEqual((credentials.username, credentials.password), (None, None))
+        session, device = self.login(credentials, {"username": "admin", "password": "cisco"})
+        self.assertEqual(device.sent, ["admin", "cisco"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+'''
+End-to-end tests of the sessions and of pisco.py against simulated devices (see pisco_sim.py)
+'''
+
+import os
+import sys
+import json
+import socket
+import asyncio
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import pisco
+import pisco_sim
+
+
+DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_simulator(port, *arguments):
+    simulator = subprocess.Popen([sys.executable, os.path.join(DIRECTORY, "pisco_sim.py"), "--address", "127.0.0.1", "--port", str(port)] + list(arguments),
+                                 stdout=subprocess.PIPE, universal_newlines=True)
+    # Serving once it says so
+    simulator.stdout.readline()
+    return simulator
+
+
+def stop_simulator(simulator):
+    simulator.terminate()
+    simulator.wait()
+    simulator.stdout.close()
+
+
+def run_pisco(*arguments):
+    command = [sys.executable, os.path.join(DIRECTORY, "pisco.py"), "-u", "admin", "-p", "cisco", "-e", "secret"] + list(arguments)
+    return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+
+
+class SimulatedOutputsTest(unittest.TestCase):
+
+    def test_tables(self):
+        device = pisco_sim.SimulatedDevice("SW1", interfaces=96)
+        int_status = pisco.parse_int_status("\n".join(["SW1#show interfaces status"] + device.show_int_status() + ["SW1#"]))
+        pisco.parse_int_description("\n".join(["SW1#show interfaces description"] + device.show_int_desc() + ["SW1#"]), int_status)
+        pisco.parse_power_inline("\n".join(["SW1#show power inline"] + device.show_power_inline() + ["SW1#"]), int_status)
+        self.assertEqual(len(int_status), 96)
+        self.assertEqual(int_status["Gi1/0/1"], {"description": "user port 0", "status": "notconnect", "vlan": "1", "duplex": "auto",
+                                                 "speed": "-", "type": "10/100/1000BaseTX", "power": "0W"})
+        self.assertEqual(int_status["Gi2/0/2"]["power"], "15.4W")
+
+
+class SimulatorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.simulator = start_simulator(cls.port, "-n", "2", "--hash-in-output")
+
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_simulator(cls.simulator)
+
+
+    def test_async_interface_rows(self):
+        async def collect():
+            telnet = await pisco.AsyncTelnetDevice.connect("127.0.0.1", port=self.port, username="admin", password="cisco", enable_password="secret", quiet=True)
+            try:
+                await telnet.enable()
+                await telnet.send_command("terminal length 0")
+                await telnet.read_output()
+                return await telnet.get_interface_rows()
+            finally:
+                telnet.close()
+
+        rows = asyncio.run(collect())
+        self.assertEqual(len(rows), 48)
+        self.assertEqual(rows[1]["hostname"], "SW1")
+        self.assertEqual(rows[1]["model"], "WS-C2960X-48FPD-L")
+        self.assertEqual(rows[1]["description"], "uplink #1 to >core-sw#1")
+        self.assertEqual(rows[1]["power"], "15.4W")
+
+
+    @unittest.skipIf(pisco.telnetlib is None, "telnetlib is not available")
+    def test_pager_and_hash_in_output(self):
+        telnet = pisco.TelnetDevice("127.0.0.1", port=self.port, username="admin", password="cisco", enable_password="secret", quiet=True)
+        try:
+            telnet.enable()
+            # Without terminal length 0: the --More-- prompts are answered
+            response = telnet.run_command("show running-config")
+        finally:
+            telnet.close()
+        self.assertTrue(telnet.prompt_found)
+        self.assertIn("# Authorized access only #", response)
+        self.assertNotIn("--More--", response)
+        self.assertTrue(response.rstrip().endswith("SW1#"))
+
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for i in range(2):
+                output = run_pisco("-d", "127.0.0.1", "--port", str(self.port), "-c", "show running-config,show version", "--backup-store", directory, "--asyncio").stdout
+            self.assertIn("1 ok, 0 failed", output)
+            # The messages of the sessions are on stderr
+            self.assertNotIn("[+] Connecting", output)
+            # Nothing changed but the volatile lines
+            self.assertIn("[+] Backups: 0 new version(s), 2 unchanged", output)
+        finally:
+            shutil.rmtree(directory)
+
+
+class ResumeTest(unittest.TestCase):
+    '''
+    --journal and --resume with devices whose write takes longer than twice the read timeout
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.simulator = start_simulator(cls.port, "-n", "2", "--write-delay", "3")
+
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_simulator(cls.simulator)
+
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = os.path.join(self.directory, "journal.jsonl")
+        self.device_list = os.path.join(self.directory, "devices.txt")
+        with open(self.device_list, "w") as f:
+            f.write("127.0.0.1\n127.0.0.2\n")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def run_pisco(self, *arguments):
+        return run_pisco("-D", self.device_list, "--port", str(self.port), "--journal", self.journal, "-O", self.directory,
+                         *arguments)
+
+
+    def records(self, kind):
+        with open(self.journal) as f:
+            records = [json.loads(line) for line in f if line.startswith("{") and line.endswith("}\n")]
+        return [record for record in records if record["type"] == kind]
+
+
+    def test_killed_run(self):
+        # Killed while writing the record of the second device, done after the first one
+        with open(self.journal, "w") as f:
+            f.write(json.dumps({"type": "device", "ip_address": "127.0.0.1", "port": self.port, "status": "ok"}) + "\n")
+            f.write('{"type": "device", "ip_address": "127.0')
+        process = self.run_pisco("-c", "show version", "--resume")
+        # Like the messages of the sessions, on stderr
+        self.assertIn("1 device(s) already done are skipped", process.stderr)
+        self.assertIn("1 ok, 0 failed", process.stdout)
+        self.assertEqual([(record["ip_address"], record["status"]) for record in self.records("device")],
+                         [("127.0.0.1", "ok"), ("127.0.0.2", "ok")])
+        self.assertEqual([record["ip_address"] for record in self.records("command")], ["127.0.0.2"])
+
+
+    def test_incomplete_command(self):
+        output = self.run_pisco("-c", "show version,write,show version", "--read-timeout", "0.5", "--workers", "1").stdout
+        self.assertIn("0 ok, 2 failed", output)
+        # Without --batch the next command is still sent, and its prompt is late too
+        self.assertEqual([record["status"] for record in self.records("command")], ["ok", "incomplete", "incomplete"] * 2)
+        self.assertEqual([record["status"] for record in self.records("device")], ["failed", "failed"])
+        # Both devices are run again, even the commands which were complete
+        process = self.run_pisco("-c", "show version", "--resume")
+        self.assertIn("0 device(s) already done are skipped", process.stderr)
+        self.assertIn("2 ok, 0 failed", process.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()